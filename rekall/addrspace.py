@@ -30,10 +30,37 @@
    Alias for all address spaces
 
 """
+from rekall import config
 from rekall import registry
 from rekall import utils
 
 
+config.DeclareOption(
+    "--cache_chunk_size", default=32 * 1024, type="IntParser",
+    help="The size of the blocks held by the physical address space read "
+    "cache.")
+
+config.DeclareOption(
+    "--cache_size", default=32 * 1024 * 1024, type="IntParser",
+    help="The total number of bytes the physical address space read cache "
+    "may hold. Set to 0 to disable the read cache.")
+
+config.DeclareOption(
+    "--cache_policy", default="2q", choices=["lru", "2q"],
+    help="The eviction policy of the read cache. The 2q policy prevents large "
+    "scans from flushing frequently used data from the cache.")
+
+config.DeclareOption(
+    "--decompression_workers", default=0, type="IntParser",
+    help="The number of workers used to decompress compressed images in "
+    "parallel.")
+
+# Eviction policies for the read cache.
+CACHE_POLICIES = dict(
+    lru=utils.FastStore,
+    **{"2q": utils.TwoQueueStore})
+
+
 class BaseAddressSpace(object):
     """ This is the base class of all Address Spaces. """
 
@@ -108,10 +135,40 @@ class BaseAddressSpace(object):
     def read(self, unused_addr, length):
         """Should be overridden by derived classes."""
         if length > self.session.GetParameter("buffer_size"):
-            raise IOError("Too much data to read.")
+            raise IOError("Too much data to read. Use read_stream() instead.")
 
         return "\x00" * length
 
+    def read_stream(self, addr, length, chunk_size=None):
+        """Read length bytes from addr, yielding the data in chunks.
+
+        Unlike read(), this is not limited by the buffer_size parameter since
+        only a single chunk is held in memory at a time.
+        """
+        chunk_size = chunk_size or self.session.GetParameter("buffer_size")
+        addr, length = int(addr), int(length)
+
+        while length > 0:
+            to_read = min(length, chunk_size)
+            yield self.read(addr, to_read)
+
+            addr += to_read
+            length -= to_read
+
+    def read_buffer(self, addr, length):
+        """Read length bytes from addr, avoiding a copy if possible.
+
+        Returns an object supporting the buffer protocol (e.g. a string or a
+        buffer). Address spaces which hold their data in memory (e.g. mmapped
+        files) return a buffer which refers to the data directly. Since the
+        result may not be a string, it is best used for data which is only
+        passed on (e.g. written to a file or hashed).
+
+        Note that the scanners do not use this, since their checks (str
+        methods, acora and yara) need the block as a string.
+        """
+        return self.read(addr, length)
+
     def get_available_addresses(self, start=0):
         """Generates address ranges (offset, phys_offset, size) for this AS.
 
@@ -217,6 +274,18 @@ class BaseAddressSpace(object):
         """Obtain metadata about this address space."""
         return getattr(cls, "_%s__%s" % (cls.__name__, name), default)
 
+    def is_live(self):
+        """Does this address space read memory which may change under us?"""
+        return bool(self.metadata("live"))
+
+    def after_fork(self):
+        """Resets state which can not be used in a forked process.
+
+        This is called on each layer of the address space in processes forked
+        to read from it (e.g. the parallel scan workers). Layers holding file
+        handles, threads or locks must replace them here.
+        """
+
     def __str__(self):
         return self.__class__.__name__
 
@@ -238,6 +307,12 @@ class BufferAddressSpace(BaseAddressSpace):
         self.base_offset = base_offset
 
     def assign_buffer(self, data, base_offset=0):
+        """Replace the data in this address space.
+
+        Args:
+          data: A string or a buffer (e.g. from read_buffer()) to read from.
+          base_offset: The address the data is mapped at.
+        """
         self.base_offset = base_offset
         self.data = data
 
@@ -250,6 +325,13 @@ class BufferAddressSpace(BaseAddressSpace):
         data = self.data[offset: offset + length]
         return data + "\x00" * (length - len(data))
 
+    def read_buffer(self, addr, length):
+        offset = addr - self.base_offset
+        if offset >= 0 and offset + length <= len(self.data):
+            return buffer(self.data, offset, length)
+
+        return self.read(addr, length)
+
     def write(self, addr, data):
         self.data = self.data[:addr] + data + self.data[addr + len(data):]
         return True
@@ -274,7 +356,117 @@ class BufferAddressSpace(BaseAddressSpace):
         return self.base_offset + len(self.data)
 
 
+class SnapshotAddressSpace(BufferAddressSpace):
+    """A snapshot of a small range of another address space.
+
+    Objects read many small members from the same range (e.g. the fields of a
+    struct). The snapshot reads the range once, and then serves reads within
+    it from the buffer. Reads outside the range are delegated to the base
+    address space, and writes go to both.
+
+    The snapshot stands in for its base, so it compares equal to it.
+    """
+    __abstract = True
+
+    def __init__(self, base=None, base_offset=0, length=0, **kwargs):
+        # Unreadable data is zero filled, as PagedReader does for invalid
+        # pages.
+        data = base.read(base_offset, length)
+        data += "\x00" * (length - len(data))
+
+        super(SnapshotAddressSpace, self).__init__(
+            base=base, base_offset=base_offset, data=data, **kwargs)
+        self.name = base.name
+        self.phys_base = base.phys_base
+        self.writeable = base.writeable
+
+    def covers(self, addr, length):
+        """Is the range fully inside the snapshot?"""
+        offset = addr - self.base_offset
+        return offset >= 0 and offset + length <= len(self.data)
+
+    def read(self, addr, length):
+        offset = addr - self.base_offset
+        if offset >= 0 and offset + length <= len(self.data):
+            return self.data[offset:offset + length]
+
+        return self.base.read(addr, length)
+
+    def read_buffer(self, addr, length):
+        offset = addr - self.base_offset
+        if offset >= 0 and offset + length <= len(self.data):
+            return buffer(self.data, offset, length)
+
+        return self.base.read_buffer(addr, length)
+
+    def write(self, addr, data):
+        if not self.base.write(addr, data):
+            return False
+
+        # Update the part of the snapshot which was overwritten.
+        start = max(addr, self.base_offset)
+        end = min(addr + len(data), self.base_offset + len(self.data))
+        if start < end:
+            offset = start - self.base_offset
+            self.data = (self.data[:offset] +
+                         data[start - addr:end - addr] +
+                         self.data[end - self.base_offset:])
+
+        return True
+
+    def is_valid_address(self, addr):
+        return self.base.is_valid_address(addr)
+
+    def vtop(self, addr):
+        return self.base.vtop(addr)
+
+    def get_available_addresses(self, start=0):
+        return self.base.get_available_addresses(start=start)
+
+    def end(self):
+        return self.base.end()
+
+    def describe(self, addr):
+        return self.base.describe(addr)
+
+    def __getattr__(self, attr):
+        # Delegate to the base for anything specific to it (e.g. dtb).
+        if attr == "base":
+            raise AttributeError(attr)
+
+        return getattr(self.base, attr)
+
+    def __eq__(self, other):
+        if isinstance(other, SnapshotAddressSpace):
+            other = other.base
+
+        return self.base == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.base)
+
+    def __str__(self):
+        return str(self.base)
+
+    def __repr__(self):
+        return "<%s of %r [%#X-%#X]>" % (
+            self.__class__.__name__, self.base, self.base_offset,
+            self.base_offset + len(self.data))
+
+    def __len__(self):
+        return len(self.data)
+
+
 class CachingAddressSpaceMixIn(object):
+    """Caches reads from an address space in fixed size chunks.
+
+    The chunk size, total size and eviction policy of the cache are taken from
+    the session (cache_chunk_size, cache_size and cache_policy).
+    """
+
     # The size of chunks we cache. This should be large enough to make file
     # reads efficient.
     CHUNK_SIZE = 32 * 1024
@@ -282,22 +474,38 @@ class CachingAddressSpaceMixIn(object):
 
     def __init__(self, **kwargs):
         super(CachingAddressSpaceMixIn, self).__init__(**kwargs)
-        self._cache = utils.FastStore(self.CACHE_SIZE)
+        self.CHUNK_SIZE = (self.session.GetParameter("cache_chunk_size") or
+                           self.CHUNK_SIZE)
+
+        cache_size = self.session.GetParameter("cache_size")
+        if cache_size:
+            self.CACHE_SIZE = max(1, cache_size / self.CHUNK_SIZE)
+
+        policy = CACHE_POLICIES.get(
+            self.session.GetParameter("cache_policy") or "lru",
+            utils.FastStore)
+        self._cache = policy(self.CACHE_SIZE)
+
+        self.cache_hits = self.cache_misses = 0
+
+    def read_uncached(self, addr, length):
+        """Read data bypassing the cache."""
+        return super(CachingAddressSpaceMixIn, self).read(addr, length)
 
     def read(self, addr, length):
         addr, length = int(addr), int(length)
 
-        result = ""
+        result = []
         while length > 0:
             data = self.read_partial(addr, length)
             if not data:
                 break
 
-            result += data
+            result.append(data)
             length -= len(data)
             addr += len(data)
 
-        return result
+        return "".join(result)
 
     def read_partial(self, addr, length):
         if addr == None:
@@ -308,22 +516,86 @@ class CachingAddressSpaceMixIn(object):
 
         # Do not cache large reads.
         if chunk_offset == 0 and length > self.CHUNK_SIZE:
-            return super(CachingAddressSpaceMixIn, self).read(
-                addr, length)
+            return self.read_uncached(addr, length)
 
         available_length = min(length, self.CHUNK_SIZE - chunk_offset)
 
         try:
             data = self._cache.Get(chunk_number)
+            self.cache_hits += 1
         except KeyError:
+            self.cache_misses += 1
+
             # Just read the data from the real class.
-            data = super(CachingAddressSpaceMixIn, self).read(
+            data = self.read_uncached(
                 chunk_number * self.CHUNK_SIZE, self.CHUNK_SIZE)
 
             self._cache.Put(chunk_number, data)
 
         return data[chunk_offset:chunk_offset+available_length]
 
+    def write(self, addr, data):
+        result = super(CachingAddressSpaceMixIn, self).write(addr, data)
+
+        # Drop the chunks we wrote to so they are read again.
+        addr = int(addr)
+        for chunk_number in xrange(addr / self.CHUNK_SIZE,
+                                   (addr + len(data) - 1) / self.CHUNK_SIZE + 1):
+            self._cache.ExpireObject(chunk_number)
+
+        return result
+
+    def cache_stats(self):
+        """Returns a dict describing the effectiveness of the cache."""
+        return dict(hits=self.cache_hits, misses=self.cache_misses,
+                    chunk_size=self.CHUNK_SIZE, chunks=self.CACHE_SIZE)
+
+
+class CachingAddressSpace(CachingAddressSpaceMixIn, BaseAddressSpace):
+    """A read cache which can be stacked over any address space.
+
+    This is used to cache the physical address space (see the cache_size
+    option), so that e.g. the decompressed chunks of an EWF file or
+    hibernation file do not need to be read again.
+    """
+
+    def __init__(self, **kwargs):
+        super(CachingAddressSpace, self).__init__(**kwargs)
+        self.as_assert(self.base is not None, "Must stack on another AS.")
+        self.name = self.base.name
+
+    def read_uncached(self, addr, length):
+        return self.base.read(addr, length)
+
+    def read_buffer(self, addr, length):
+        # This is used for bulk reads which should not pollute the cache.
+        return self.base.read_buffer(addr, length)
+
+    def get_available_addresses(self, start=0):
+        return self.base.get_available_addresses(start=start)
+
+    def is_valid_address(self, addr):
+        return self.base.is_valid_address(addr)
+
+    def is_live(self):
+        return self.base.is_live()
+
+    def end(self):
+        return self.base.end()
+
+    def describe(self, addr):
+        return self.base.describe(addr)
+
+    def __getattr__(self, attr):
+        # Expose the attributes of the cached address space.
+        if attr.startswith("__") or attr == "base":
+            raise AttributeError(attr)
+
+        return getattr(self.base, attr)
+
+    def __str__(self):
+        return "%s(%s)" % (self.__class__.__name__, self.base)
+
 
 class PagedReader(BaseAddressSpace):
     """An address space which reads in page size.
@@ -356,29 +628,142 @@ class PagedReader(BaseAddressSpace):
         Read 'length' bytes from the virtual address 'vaddr'.
         """
         if length > self.session.GetParameter("buffer_size"):
-            raise IOError("Too much data to read.")
+            raise IOError("Too much data to read. Use read_stream() instead.")
 
         addr, length = int(addr), int(length)
 
-        result = ''
+        result = []
 
         while length > 0:
             buf = self._read_chunk(addr, length)
             if not buf:
                 break
 
-            result += buf
+            result.append(buf)
             addr += len(buf)
             length -= len(buf)
 
-        return result
+        return "".join(result)
 
     def is_valid_address(self, addr):
         vaddr = self.vtop(addr)
         return vaddr != None and self.base.is_valid_address(vaddr)
 
 
-class RunBasedAddressSpace(PagedReader):
+class RunReaderMixIn(object):
+    """Bulk reads for address spaces which map their data using runs.
+
+    self.runs must be a SortedCollection of tuples starting with (virtual
+    address, physical address, length). Instead of reading a run at a time,
+    all the runs covering a read are found with a single lookup and each
+    contiguous stretch of the underlying address space is read at once.
+    """
+
+    def _get_run_address_space(self, _):
+        """Returns the address space the run's physical address refers to."""
+        return self.base
+
+    def _can_read_runs(self):
+        """Can the runs be read directly from their address spaces?
+
+        Subclasses which override _read_chunk() (e.g. to read through a file
+        handle, or to decompress runs) must be read a chunk at a time.
+        """
+        for cls in type(self).__mro__:
+            if "_read_chunk" in vars(cls):
+                break
+
+        if cls is RunBasedAddressSpace:
+            return self.base is not None
+
+        return cls is MultiRunBasedAddressSpace
+
+    def _get_run_segments(self, addr, length):
+        """Splits the range between addr and addr+length into segments.
+
+        Yields:
+          tuples of (address space, physical address, length) for each
+          segment. Adjacent runs which are also contiguous in the same address
+          space are merged. The address space is None for unmapped gaps.
+        """
+        runs = self.runs
+        end = addr + length
+        idx = max(0, runs.index_le(addr))
+        segment = None
+
+        while addr < end:
+            if idx < len(runs):
+                run = runs[idx]
+                run_start, run_paddr, run_length = run[:3]
+
+                # The run ends before the address - try the next one.
+                if run_start + run_length <= addr:
+                    idx += 1
+                    continue
+
+                # There is a gap before the next run.
+                if run_start > addr:
+                    address_space, paddr = None, None
+                    segment_length = min(run_start, end) - addr
+
+                else:
+                    address_space = self._get_run_address_space(run)
+                    paddr = run_paddr + addr - run_start
+                    segment_length = min(run_start + run_length, end) - addr
+                    idx += 1
+
+            # We are past the last run.
+            else:
+                address_space, paddr = None, None
+                segment_length = end - addr
+
+            if (segment and segment[0] is address_space and
+                    (paddr is None or segment[1] + segment[2] == paddr)):
+                segment[2] += segment_length
+
+            else:
+                if segment:
+                    yield tuple(segment)
+
+                segment = [address_space, paddr, segment_length]
+
+            addr += segment_length
+
+        if segment:
+            yield tuple(segment)
+
+    def read(self, addr, length):
+        if not self._can_read_runs():
+            return PagedReader.read(self, addr, length)
+
+        if length > self.session.GetParameter("buffer_size"):
+            raise IOError("Too much data to read. Use read_stream() instead.")
+
+        addr, length = int(addr), int(length)
+        segments = list(self._get_run_segments(addr, length))
+
+        # The common case of a read within a single run needs no copying.
+        if len(segments) == 1:
+            address_space, paddr, _ = segments[0]
+            if address_space is None:
+                return "\x00" * length
+
+            return address_space.read(paddr, length)
+
+        # Gaps are left zero filled.
+        result = bytearray(length)
+        offset = 0
+        for address_space, paddr, segment_length in segments:
+            if address_space is not None:
+                data = address_space.read(paddr, segment_length)
+                result[offset:offset + len(data)] = data
+
+            offset += segment_length
+
+        return str(result)
+
+
+class RunBasedAddressSpace(RunReaderMixIn, PagedReader):
     """An address space which uses a list of runs to specify a mapping."""
 
     # This is a list of (memory_offset, file_offset, length) tuples.
@@ -393,6 +778,14 @@ class RunBasedAddressSpace(PagedReader):
         # overlay on.
         self.phys_base = self.base
 
+    def set_runs(self, runs):
+        """Replaces the runs with an immutable collection of runs.
+
+        Address spaces which parse all their runs up front should collect them
+        and call this once, rather than inserting them one at a time.
+        """
+        self.runs = utils.FrozenSortedCollection(runs, key=lambda x: x[0])
+
     def _read_chunk(self, addr, length):
         """Read from addr as much as possible up to a length of length."""
         file_offset, available_length = self._get_available_buffer(addr, length)
@@ -404,6 +797,18 @@ class RunBasedAddressSpace(PagedReader):
         else:
             return self.base.read(file_offset, min(length, available_length))
 
+    def read_buffer(self, addr, length):
+        if not self._can_read_runs():
+            return self.read(addr, length)
+
+        # If the read falls inside a single run, the base may avoid the copy.
+        file_offset, available_length = self._get_available_buffer(
+            addr, length)
+        if file_offset is not None and available_length >= length:
+            return self.base.read_buffer(file_offset, length)
+
+        return self.read(addr, length)
+
     def vtop(self, addr):
         file_offset, _ = self._get_available_buffer(addr, 1)
         return file_offset
@@ -460,7 +865,7 @@ class RunBasedAddressSpace(PagedReader):
 
 # TODO: Replace the RunBasedAddressSpace with this one since it is a super set.
 
-class MultiRunBasedAddressSpace(PagedReader):
+class MultiRunBasedAddressSpace(RunReaderMixIn, PagedReader):
     """An address space which uses a list of runs to specify a mapping.
 
     This essentially delegates certain address ranges to other address spaces
@@ -493,6 +898,9 @@ class MultiRunBasedAddressSpace(PagedReader):
     def add_run(self, virt_addr, file_address, file_len, address_space):
         self.runs.insert((virt_addr, file_address, file_len, address_space))
 
+    def _get_run_address_space(self, run):
+        return run[3]
+
     def _read_chunk(self, addr, length):
         """Read from addr as much as possible up to a length of length."""
         try:
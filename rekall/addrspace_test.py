@@ -1,9 +1,12 @@
 import logging
+import StringIO
 
 from rekall import addrspace
 from rekall import obj
 from rekall import testlib
 from rekall import session
+from rekall import utils
+from rekall.plugins import core
 
 
 class CustomRunsAddressSpace(addrspace.RunBasedAddressSpace):
@@ -15,6 +18,22 @@ class CustomRunsAddressSpace(addrspace.RunBasedAddressSpace):
             self.runs.insert(i)
 
 
+class ChunkReaderRunsAddressSpace(addrspace.RunBasedAddressSpace):
+    """Reads its runs through _read_chunk() without a base (like win32)."""
+
+    def __init__(self, runs=None, data=None, **kwargs):
+        super(ChunkReaderRunsAddressSpace, self).__init__(**kwargs)
+        self.data = data
+        self.set_runs(runs)
+
+    def _read_chunk(self, addr, length):
+        offset, available_length = self._get_available_buffer(addr, length)
+        if offset is None:
+            return "\x00" * min(length, available_length)
+
+        return self.data[offset:offset + min(length, available_length)]
+
+
 class RunBasedTest(testlib.RekallBaseUnitTestCase):
     """Test the RunBasedAddressSpace implementation."""
 
@@ -55,5 +74,163 @@ class RunBasedTest(testlib.RekallBaseUnitTestCase):
         self.assertEqual(self.contiguous_as.read(2000, 10),
                          "\x00" * 10)
 
+    def testReadBuffer(self):
+        # Reads within a run refer to the underlying data without a copy.
+        data = self.discontiguous_as.read_buffer(1021, 5)
+        self.assertTrue(isinstance(data, buffer))
+        self.assertEqual(data[:], "23456")
+
+        # Reads spanning runs fall back to read().
+        self.assertEqual(self.discontiguous_as.read_buffer(1000, 30),
+                         self.discontiguous_as.read(1000, 30))
+
+    def testCopyAStoFD(self):
+        # The second run only contains zeros and is left as a hole.
+        runs_as = CustomRunsAddressSpace(
+            session=self.session, runs=[(0, 0, 4), (100, 4, 4)],
+            data="ab" + "\x00" * 6)
+
+        out_fd = StringIO.StringIO()
+        utils.CopyAStoFD(runs_as, out_fd)
+        self.assertEqual(out_fd.getvalue(), "ab" + "\x00" * 102)
+
+    def testBulkRead(self):
+        # Many small runs which are contiguous in the file.
+        runs_as = CustomRunsAddressSpace(
+            session=self.session, data="0123456789" * 10,
+            runs=[(i * 10, i * 10, 10) for i in range(10)] +
+            [(200, 50, 10)])
+
+        reads = []
+        original_read = runs_as.base.read
+
+        def CountingRead(addr, length):
+            reads.append((addr, length))
+            return original_read(addr, length)
+
+        runs_as.base.read = CountingRead
+
+        self.assertEqual(runs_as.read(5, 210),
+                         ("0123456789" * 10)[5:] + "\x00" * 100 +
+                         "0123456789" + "\x00" * 5)
+
+        # The contiguous runs are read at once.
+        self.assertEqual(reads, [(5, 95), (50, 10)])
+
+    def testSetRuns(self):
+        runs_as = CustomRunsAddressSpace(
+            session=self.session, runs=[], data="0123456789")
+        runs_as.set_runs([(1020, 1, 9), (1000, 0, 1)])
+
+        self.assertEqual(runs_as.read(1000, 30),
+                         self.discontiguous_as.read(1000, 30))
+        self.assertEqual(runs_as.vtop(1025), 6)
+
+        # The runs can not be modified once set.
+        self.assertRaises(TypeError, runs_as.runs.insert, (0, 0, 1))
+
+    def testChunkReader(self):
+        runs_as = ChunkReaderRunsAddressSpace(
+            session=self.session, runs=[(1000, 0, 1), (1020, 1, 9)],
+            data="0123456789")
+
+        self.assertEqual(runs_as.base, None)
+        self.assertEqual(runs_as.read(1000, 30),
+                         self.discontiguous_as.read(1000, 30))
+        self.assertEqual(runs_as.read_buffer(1021, 5), "23456")
+
+    def testMultiRunRead(self):
+        multi_as = addrspace.MultiRunBasedAddressSpace(session=self.session)
+        multi_as.add_run(0, 5, 5, self.contiguous_as.base)
+        multi_as.add_run(5, 0, 5, self.discontiguous_as.base)
+        multi_as.add_run(20, 1000, 5, self.contiguous_as)
+
+        self.assertEqual(multi_as.read(0, 30),
+                         "56789" + "01234" + "\x00" * 10 + "01234" +
+                         "\x00" * 5)
+
+    def testReadStream(self):
+        with self.session:
+            self.session.SetParameter("buffer_size", 10)
+
+        self.assertRaises(IOError, self.contiguous_as.read, 995, 20)
+        self.assertEqual(
+            list(self.contiguous_as.read_stream(995, 20)),
+            ["\x00" * 5 + "01234", "56789" + "\x00" * 5])
+
+class CachingAddressSpaceTest(testlib.RekallBaseUnitTestCase):
+    """Test the physical read cache."""
+
+    def setUp(self):
+        self.session = session.Session()
+        with self.session:
+            self.session.SetParameter("cache_chunk_size", 10)
+            self.session.SetParameter("cache_size", 100)
+            self.session.SetParameter("cache_policy", "2q")
+
+        self.base = addrspace.BufferAddressSpace(
+            data="".join(chr(x) for x in range(200)), session=self.session)
+
+        self.reads = []
+        original_read = self.base.read
+
+        def CountingRead(addr, length):
+            self.reads.append(addr)
+            return original_read(addr, length)
+
+        self.base.read = CountingRead
+        self.address_space = addrspace.CachingAddressSpace(
+            base=self.base, session=self.session)
+
+    def testCache(self):
+        self.assertEqual(self.address_space.read(5, 10), "".join(
+            chr(x) for x in range(5, 15)))
+        self.assertEqual(self.reads, [0, 10])
+
+        self.address_space.read(5, 10)
+        self.assertEqual(self.reads, [0, 10])
+        self.assertEqual(self.address_space.cache_stats()["hits"], 2)
+
+    def testWrite(self):
+        self.assertEqual(self.address_space.read(18, 4), "\x12\x13\x14\x15")
+
+        # Writes go to the base and drop the cached chunks they touch.
+        self.address_space.write(18, "BBBB")
+        self.assertEqual(self.address_space.read(18, 4), "BBBB")
+        self.assertEqual(self.base.read(18, 4), "BBBB")
+
+    def testLiveAndWritable(self):
+        load_as = core.LoadAddressSpace(session=self.session)
+        self.assertTrue(isinstance(load_as.CacheAddressSpace(self.base),
+                                   addrspace.CachingAddressSpace))
+
+        # Writable address spaces are not cached.
+        writable = addrspace.BufferAddressSpace(
+            data="", session=self.session, write=True)
+        self.assertTrue(load_as.CacheAddressSpace(writable) is writable)
+
+        # Neither are address spaces stacked on live memory.
+        live = addrspace.BufferAddressSpace(data="", session=self.session)
+        live.is_live = lambda: True
+        stacked = addrspace.BufferAddressSpace(data="", session=self.session)
+        stacked.base = live
+        self.assertTrue(load_as.CacheAddressSpace(stacked) is stacked)
+
+    def testScanResistance(self):
+        # Chunk 0 is used repeatedly.
+        for _ in range(2):
+            self.address_space.read(0, 1)
+            for addr in range(10, 50, 10):
+                self.address_space.read(addr, 1)
+
+        # A scan over the rest of the data does not flush it.
+        for addr in range(50, 200, 10):
+            self.address_space.read(addr, 1)
+
+        self.reads = []
+        self.address_space.read(0, 1)
+        self.assertEqual(self.reads, [])
+
+
 if __name__ == "__main__":
     unittest.main()
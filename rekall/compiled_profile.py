@@ -0,0 +1,302 @@
+# Rekall Memory Forensics
+# Copyright 2014 Google Inc. All Rights Reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or (at
+# your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+#
+
+"""A compiled binary container for Rekall profiles.
+
+JSON profiles must be parsed in their entirety when loaded, and all their types
+are copied into the profile, even though most analyses only ever use a small
+fraction of them. Large profiles (e.g. the Windows kernel) therefore dominate
+startup time.
+
+The compiled container stores each type separately, so a type is only
+deserialized when the profile compiles it. The container consists of:
+
+- A header: magic, format version and the length of the index.
+
+- The index: a marshalled dict with all the profile sections except $STRUCTS,
+  a table of contents mapping each type name to the location of its definition,
+  and the profile's constants pre-merged and sorted by address.
+
+- The type definitions, each marshalled on its own.
+
+All strings are interned before marshalling, so marshal stores them as
+interned strings, and repeated member and type names share memory when loaded.
+
+The compiled profile is stored next to the JSON profile, with the
+COMPILED_SUFFIX appended to its name. The convert_profile plugin produces it
+from an existing JSON profile.
+"""
+
+__author__ = "Michael Cohen <scudette@gmail.com>"
+
+import copy
+import marshal
+import struct
+
+
+MAGIC = "RKPROFC\x00"
+VERSION = 1
+HEADER = struct.Struct("<8sII")
+
+# The name of the compiled profile is the name of the profile with this suffix.
+COMPILED_SUFFIX = ".compiled"
+
+# The marshal version which supports interned strings.
+MARSHAL_VERSION = 2
+
+
+def _Intern(value):
+    """Convert all the strings in value into interned byte strings."""
+    if isinstance(value, unicode):
+        try:
+            value = str(value)
+        except UnicodeError:
+            return value
+
+    if isinstance(value, str):
+        return intern(value)
+
+    if isinstance(value, (list, tuple)):
+        return [_Intern(x) for x in value]
+
+    if isinstance(value, dict):
+        return dict((_Intern(k), _Intern(v)) for k, v in value.iteritems())
+
+    return value
+
+
+def CompileProfile(data):
+    """Compile the profile data (as loaded from the JSON profile).
+
+    Returns:
+      A string containing the compiled profile.
+    """
+    sections = {}
+    for k, v in data.iteritems():
+        if k != "$STRUCTS":
+            sections[_Intern(k)] = _Intern(v)
+
+    # Constants are stored both in the $CONSTANTS and the $FUNCTIONS section.
+    # The profile treats them the same, so we merge them here once.
+    constants = {}
+    for section in ["$CONSTANTS", "$FUNCTIONS"]:
+        constants.update(sections.get(section) or {})
+
+    constant_addresses = []
+    for name, value in constants.iteritems():
+        try:
+            constant_addresses.append((int(value), name))
+        except (ValueError, TypeError):
+            pass
+
+    constant_addresses.sort()
+    sections["$CONSTANT_INDEX"] = [constants, constant_addresses]
+
+    toc = {}
+    types = []
+    offset = 0
+    for type_name, definition in sorted((data.get("$STRUCTS") or {}).items()):
+        serialized = marshal.dumps(_Intern(definition), MARSHAL_VERSION)
+        toc[_Intern(type_name)] = (offset, len(serialized))
+        types.append(serialized)
+        offset += len(serialized)
+
+    index = marshal.dumps(dict(sections=sections, toc=toc), MARSHAL_VERSION)
+
+    return "".join([HEADER.pack(MAGIC, VERSION, len(index)), index] + types)
+
+
+def IsCompiledProfile(data):
+    return isinstance(data, str) and data.startswith(MAGIC)
+
+
+class CompiledProfile(object):
+    """Provides access to the sections of a compiled profile.
+
+    This behaves like the dict loaded from a JSON profile, except that the
+    $STRUCTS section is a LazyVTypes instance.
+    """
+
+    def __init__(self, data):
+        if not IsCompiledProfile(data) or len(data) < HEADER.size:
+            raise IOError("Not a compiled profile.")
+
+        _, version, index_length = HEADER.unpack_from(data, 0)
+        if version != VERSION:
+            raise IOError("Unsupported compiled profile version %s" % version)
+
+        try:
+            index = marshal.loads(
+                data[HEADER.size:HEADER.size + index_length])
+        except (ValueError, EOFError, TypeError) as e:
+            raise IOError("Corrupted compiled profile: %s" % e)
+
+        self.data = data
+        self.types_offset = HEADER.size + index_length
+        self.toc = index["toc"]
+        self.sections = index["sections"]
+        self.sections["$STRUCTS"] = LazyVTypes(sources=[self])
+
+    def get(self, section, default=None):
+        return self.sections.get(section, default)
+
+    def __getitem__(self, section):
+        return self.sections[section]
+
+    def __contains__(self, section):
+        return section in self.sections
+
+    def LoadType(self, type_name):
+        """Deserialize the definition of type_name.
+
+        Each call returns a new copy of the definition.
+        """
+        offset, length = self.toc[type_name]
+        offset += self.types_offset
+
+        try:
+            return marshal.loads(self.data[offset:offset + length])
+        except (ValueError, EOFError, TypeError) as e:
+            raise IOError("Corrupted compiled profile type %s: %s" % (
+                type_name, e))
+
+
+class LazyVTypes(dict):
+    """A vtypes dict which loads types from compiled profiles on demand.
+
+    The dict itself holds the types which were already loaded or were added
+    explicitly. Other types are loaded from the sources on first access. Later
+    sources take precedence over earlier ones, as if they were applied with
+    update().
+    """
+
+    def __init__(self, data=(), sources=()):
+        super(LazyVTypes, self).__init__(data)
+        self.sources = []
+        for source in sources:
+            self.AddSource(source)
+
+    def AddSource(self, source):
+        # Types in the new source replace the ones we already have.
+        if dict.__len__(self) < len(source.toc):
+            for type_name in self._LoadedKeys():
+                if type_name in source.toc:
+                    del self[type_name]
+        else:
+            for type_name in source.toc:
+                self.pop(type_name, None)
+
+        self.sources.append(source)
+
+    def _LoadedKeys(self):
+        return super(LazyVTypes, self).keys()
+
+    def _FindSource(self, type_name):
+        for source in reversed(self.sources):
+            if type_name in source.toc:
+                return source
+
+    def __missing__(self, type_name):
+        source = self._FindSource(type_name)
+        if source is None:
+            raise KeyError(type_name)
+
+        result = source.LoadType(type_name)
+        self[type_name] = result
+
+        return result
+
+    def get(self, type_name, default=None):
+        try:
+            return self[type_name]
+        except KeyError:
+            return default
+
+    def GetCopy(self, type_name, default=None):
+        """Returns a copy of the type definition which may be modified.
+
+        Types which were not loaded yet are deserialized directly, which is
+        much cheaper than loading and then copying them.
+        """
+        if not super(LazyVTypes, self).__contains__(type_name):
+            source = self._FindSource(type_name)
+            if source is not None:
+                return source.LoadType(type_name)
+
+        return copy.deepcopy(self.get(type_name, default))
+
+    def __contains__(self, type_name):
+        return (super(LazyVTypes, self).__contains__(type_name) or
+                self._FindSource(type_name) is not None)
+
+    has_key = __contains__
+
+    def keys(self):
+        result = set(self._LoadedKeys())
+        for source in self.sources:
+            result.update(source.toc)
+
+        return list(result)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    iterkeys = __iter__
+
+    def __len__(self):
+        return len(self.keys())
+
+    def _LoadAll(self):
+        for type_name in self.keys():
+            _ = self[type_name]
+
+    def items(self):
+        self._LoadAll()
+        return super(LazyVTypes, self).items()
+
+    def iteritems(self):
+        return iter(self.items())
+
+    def values(self):
+        self._LoadAll()
+        return super(LazyVTypes, self).values()
+
+    def itervalues(self):
+        return iter(self.values())
+
+    def copy(self):
+        result = LazyVTypes(dict.copy(self))
+        result.sources = self.sources[:]
+
+        return result
+
+    def update(self, other=(), **kwargs):
+        if isinstance(other, LazyVTypes):
+            for source in other.sources:
+                self.AddSource(source)
+
+            # Only copy the types the other has already loaded.
+            other = dict.copy(other)
+
+        super(LazyVTypes, self).update(other, **kwargs)
+
+    def __deepcopy__(self, memo):
+        result = LazyVTypes(copy.deepcopy(dict.copy(self), memo))
+        result.sources = self.sources[:]
+
+        return result
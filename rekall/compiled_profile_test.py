@@ -0,0 +1,149 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from rekall import addrspace
+from rekall import compiled_profile
+from rekall import io_manager
+from rekall import obj
+from rekall import plugins  # pylint: disable=unused-import
+from rekall import session
+from rekall import testlib
+
+
+PROFILE_DATA = {
+    "$METADATA": dict(ProfileClass="Profile32Bits", Type="Profile"),
+    "$CONSTANTS": dict(foo=0x1000, bar=0x2000),
+    "$FUNCTIONS": dict(baz=0x1800),
+    "$ENUMS": {"Color": {"1": "Red", "2": "Blue"}},
+    "$STRUCTS": {
+        "_HEADER": [8, {
+            "Magic": [0, ["unsigned short"]],
+            "Color": [4, ["unsigned int"]],
+        }],
+        "_UNUSED": [4, {
+            "Value": [0, ["unsigned int"]],
+        }],
+    },
+}
+
+
+class MemoryIOManager(io_manager.IOManager):
+    """A container which holds its members in a dict."""
+    __abstract = True
+
+    def __init__(self, members=None, **kwargs):
+        super(MemoryIOManager, self).__init__(**kwargs)
+        self.members = members
+
+    def CheckInventory(self, path):
+        return path in self.members
+
+    def GetData(self, name, raw=False):
+        data = self.members[name]
+        if raw:
+            return data
+
+        return json.loads(data)
+
+
+class LocalIOManager(MemoryIOManager):
+    __abstract = True
+
+    load_compiled_profiles = True
+
+
+class CompiledProfileTest(testlib.RekallBaseUnitTestCase):
+    """Test the compiled profile format."""
+
+    def setUp(self):
+        self.session = session.Session()
+        self.address_space = addrspace.BufferAddressSpace(
+            data="MZ\x00\x00\x02\x00\x00\x00", session=self.session)
+        self.compiled = compiled_profile.CompileProfile(PROFILE_DATA)
+
+    def _LoadCompiled(self):
+        return obj.Profile.LoadProfileFromData(
+            compiled_profile.CompiledProfile(self.compiled),
+            session=self.session, name="test")
+
+    def testCompiledProfile(self):
+        json_profile = obj.Profile.LoadProfileFromData(
+            json.loads(json.dumps(PROFILE_DATA)), session=self.session,
+            name="test")
+        profile = self._LoadCompiled()
+
+        # Types are only deserialized when used.
+        self.assertEqual(dict.keys(profile.vtypes), [])
+        self.assertTrue(profile.has_type("_UNUSED"))
+
+        for p in (json_profile, profile):
+            header = p.Object("_HEADER", vm=self.address_space, offset=0)
+            self.assertEqual(header.Magic, 0x5a4d)
+            self.assertEqual(header.Color, 2)
+
+        self.assertEqual(dict.keys(profile.vtypes), [])
+        self.assertEqual(profile.get_enum("Color"),
+                         json_profile.get_enum("Color"))
+        self.assertEqual(profile.constants, json_profile.constants)
+        self.assertEqual(list(profile.constant_addresses),
+                         sorted(json_profile.constant_addresses))
+
+        # Types from compiled profiles survive copying and merging.
+        merged = obj.Profile.classes["Profile32Bits"](
+            name="other", session=self.session)
+        merged.merge(profile.copy())
+        self.assertEqual(merged.Object(
+            "_HEADER", vm=self.address_space, offset=0).Magic, 0x5a4d)
+
+    def testLoadProfilePrefersCompiled(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(temp_dir, "test")
+            with open(path, "wb") as fd:
+                fd.write(json.dumps(PROFILE_DATA))
+
+            with open(path + compiled_profile.COMPILED_SUFFIX, "wb") as fd:
+                fd.write(self.compiled)
+
+            profile = self.session.LoadProfile(path)
+            self.assertTrue(isinstance(
+                profile.vtypes, compiled_profile.LazyVTypes))
+            self.assertEqual(profile.get_constant("baz"), 0x1800)
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def testCorruptedType(self):
+        compiled = compiled_profile.CompiledProfile(self.compiled)
+        offset, length = compiled.toc["_HEADER"]
+        offset += compiled.types_offset
+
+        compiled = compiled_profile.CompiledProfile(
+            self.compiled[:offset] + "\xff" * length +
+            self.compiled[offset + length:])
+
+        self.assertRaises(IOError, compiled.LoadType, "_HEADER")
+        self.assertEqual(compiled.LoadType("_UNUSED"),
+                         PROFILE_DATA["$STRUCTS"]["_UNUSED"])
+
+    def testCompiledOnlyFromLocalContainers(self):
+        members = {
+            "test": json.dumps(PROFILE_DATA),
+            "test" + compiled_profile.COMPILED_SUFFIX: self.compiled,
+            "other" + compiled_profile.COMPILED_SUFFIX: self.compiled}
+
+        local = LocalIOManager(members=members, session=self.session)
+        self.assertTrue(isinstance(
+            local.GetProfileData("test"), compiled_profile.CompiledProfile))
+        self.assertTrue(local.CheckProfileInventory("other"))
+
+        # Other containers (e.g. remote repositories) never unmarshal data.
+        remote = MemoryIOManager(members=members, session=self.session)
+        self.assertEqual(remote.GetProfileData("test"), PROFILE_DATA)
+        self.assertFalse(remote.CheckProfileInventory("other"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -41,10 +41,12 @@ import json
 import logging
 import time
 import os
+import threading
 import urllib2
 import urlparse
 import zipfile
 
+from rekall import compiled_profile
 from rekall import constants
 from rekall import obj
 from rekall import registry
@@ -77,6 +79,10 @@ class IOManager(object):
 
     order = 100
 
+    # Compiled profiles are decoded with marshal, which is not safe for
+    # untrusted data, so they are only loaded from local containers.
+    load_compiled_profiles = False
+
     def __init__(self, urn=None, mode="r", session=None,
                  version=constants.PROFILE_REPOSITORY_VERSION):
         """Initialize the IOManager.
@@ -123,6 +129,43 @@ class IOManager(object):
         """
         return path in self.inventory.get("$INVENTORY")
 
+    def CheckProfileInventory(self, name):
+        """Checks if a profile, in either form, exists in the inventory."""
+        if self.CheckInventory(name):
+            return True
+
+        return (self.load_compiled_profiles and
+                self.CheckInventory(name + compiled_profile.COMPILED_SUFFIX))
+
+    def HasMember(self, name):
+        """Returns True if the named member exists in this container."""
+        return self.CheckInventory(name)
+
+    def GetProfileData(self, name):
+        """Get the data for the named profile.
+
+        If a compiled version of the profile exists in this container, it is
+        preferred since it loads much faster. Otherwise this is the same as
+        GetData().
+        """
+        if not self.load_compiled_profiles:
+            return self.GetData(name)
+
+        if name.endswith(compiled_profile.COMPILED_SUFFIX):
+            compiled_name = name
+        else:
+            compiled_name = name + compiled_profile.COMPILED_SUFFIX
+
+        if self.HasMember(compiled_name):
+            try:
+                return compiled_profile.CompiledProfile(
+                    self.GetData(compiled_name, raw=True))
+            except IOError as e:
+                logging.warning("Unable to load compiled profile %s: %s",
+                                compiled_name, e)
+
+        return self.GetData(name)
+
     def FlushInventory(self):
         """Write the inventory to the storage."""
         self.inventory.setdefault("$METADATA", dict(
@@ -235,6 +278,8 @@ class DirectoryIOManager(IOManager):
     Where $urn is the path where the DirectoryIOManager was initialized with.
     """
 
+    load_compiled_profiles = True
+
     def __init__(self, urn=None, **kwargs):
         super(DirectoryIOManager, self).__init__(**kwargs)
 
@@ -289,6 +334,10 @@ class DirectoryIOManager(IOManager):
         except IOError:
             return gzip.open(path + ".gz")
 
+    def HasMember(self, name):
+        path = self._GetAbsolutePathName(name)
+        return os.path.isfile(path) or os.path.isfile(path + ".gz")
+
     def __str__(self):
         return "Directory:%s" % self.dump_dir
 
@@ -318,6 +367,7 @@ class ZipFileManager(IOManager):
     """An IO Manager which stores files in a zip archive."""
 
     order = 50
+    load_compiled_profiles = True
 
     def __init__(self, urn=None, fd=None, **kwargs):
         super(ZipFileManager, self).__init__(**kwargs)
@@ -331,6 +381,9 @@ class ZipFileManager(IOManager):
             self.file_name = os.path.normpath(os.path.abspath(urn))
             self.canonical_name = os.path.splitext(os.path.basename(urn))[0]
 
+        # Members may be written and read from several threads (e.g. by the
+        # web console's plugin workers).
+        self._lock = threading.RLock()
         self._OpenZipFile()
 
         # The set of outstanding writers. When all outstanding writers have been
@@ -374,35 +427,41 @@ class ZipFileManager(IOManager):
         return self.zip.namelist()
 
     def _Cancel(self, name):
-        self._outstanding_writers.remove(name)
+        with self._lock:
+            self._outstanding_writers.remove(name)
 
     def _Write(self, name, data):
-        self.zip.writestr(name, data)
-        self._outstanding_writers.remove(name)
-        if not self._outstanding_writers:
-            self.zip.close()
+        with self._lock:
+            self.zip.writestr(name, data)
+            self._outstanding_writers.remove(name)
+            if not self._outstanding_writers:
+                self.zip.close()
 
-            # Reopen the zip file so we may add new members.
-            self._OpenZipFile(mode="a")
+                # Reopen the zip file so we may add new members.
+                self._OpenZipFile(mode="a")
 
     def Create(self, name):
         if self.mode not in ["w", "a"]:
             raise IOManagerError("Container not opened for writing.")
 
         result = SelfClosingFile(name, self)
-        self._outstanding_writers.add(name)
+        with self._lock:
+            self._outstanding_writers.add(name)
+
         return result
 
     def Open(self, name):
         if self.mode not in ["r", "a"]:
             raise IOManagerError("Container not opened for reading.")
-        if self.zip is None:
-            self._OpenZipFile()
 
-        try:
-            return self.zip.open(name)
-        except KeyError as e:
-            raise IOManagerError(e)
+        with self._lock:
+            if self.zip is None:
+                self._OpenZipFile()
+
+            try:
+                return self.zip.open(name)
+            except KeyError as e:
+                raise IOManagerError(e)
 
     def __enter__(self):
         self._outstanding_writers.add(self)
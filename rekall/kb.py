@@ -1,6 +1,13 @@
 # This module provides for a central knowledge base which plugins can use to
 # collect information.
 
+import hashlib
+import json
+import logging
+import os
+import tempfile
+
+from rekall import obj
 from rekall import registry
 
 
@@ -43,3 +50,221 @@ class ParameterHook(object):
 
     def calculate(self):
         """Derive the value of the parameter."""
+
+
+class KnowledgeBaseCache(object):
+    """A persistent cache of ParameterHook results for an image.
+
+    Parameters such as the profile or the KDBG may require scanning the entire
+    image to derive. These never change for a given image, so when the kb_cache
+    parameter is set we store them in the cache_dir and restore them in later
+    sessions, rather than running the hooks again.
+
+    The cache file is keyed by the path of the image and holds a fingerprint of
+    the image (its size, mtime and hashes of sampled pages). If the fingerprint
+    no longer matches, the cached entries are discarded.
+    """
+
+    VERSION = 1
+
+    # The number of pages hashed into the fingerprint.
+    FINGERPRINT_SAMPLES = 16
+    PAGE_SIZE = 0x1000
+
+    def __init__(self, session, filename, cache_dir):
+        self.session = session
+        self.filename = os.path.abspath(filename)
+        self.path = os.path.join(cache_dir, "kb-%s.json" % hashlib.sha1(
+            self.filename).hexdigest())
+
+        self.fingerprint = self.Fingerprint()
+        self.entries = {}
+        self.Load()
+
+    def Fingerprint(self):
+        """A fingerprint of the image which is fast to calculate."""
+        stat = os.stat(self.filename)
+        fingerprint = hashlib.sha1("%d:%d" % (stat.st_size, stat.st_mtime))
+
+        with open(self.filename, "rb") as fd:
+            pages = stat.st_size / self.PAGE_SIZE
+            step = max(1, pages / self.FINGERPRINT_SAMPLES)
+            for page in range(0, pages + 1, step):
+                fd.seek(page * self.PAGE_SIZE)
+                fingerprint.update(fd.read(self.PAGE_SIZE))
+
+        return fingerprint.hexdigest()
+
+    def Load(self):
+        try:
+            with open(self.path, "rb") as fd:
+                data = json.load(fd)
+        except (IOError, ValueError):
+            return
+
+        if (data.get("version") != self.VERSION or
+                data.get("fingerprint") != self.fingerprint):
+            logging.info("Image %s changed, discarding cached parameters.",
+                         self.filename)
+            return
+
+        self.entries = data.get("entries", {})
+
+    def Save(self):
+        data = dict(version=self.VERSION, filename=self.filename,
+                    fingerprint=self.fingerprint, entries=self.entries)
+
+        # Write to a temp file first so a concurrent session never sees a
+        # partial cache file.
+        try:
+            fd, temp_path = tempfile.mkstemp(
+                dir=os.path.dirname(self.path), suffix=".tmp")
+            with os.fdopen(fd, "wb") as out_fd:
+                json.dump(data, out_fd, sort_keys=True, indent=1)
+
+            os.rename(temp_path, self.path)
+        except (IOError, OSError) as e:
+            logging.debug("Unable to write %s: %s", self.path, e)
+
+    def Restore(self, name):
+        """Restore the cached value of the parameter name.
+
+        The session's cache is also updated with all the parameters which the
+        hook cached while originally calculating it.
+
+        Returns:
+          A tuple (found, value).
+        """
+        entry = self.entries.get(name)
+        if entry is None:
+            return False, None
+
+        try:
+            value = self._Decode(entry["value"])
+            cache = dict((k, self._Decode(v))
+                         for k, v in entry["cache"].iteritems())
+        except (ValueError, KeyError, TypeError) as e:
+            logging.debug("Unable to restore cached %s: %s", name, e)
+            return False, None
+
+        logging.debug("Restored %s from %s (produced by %s).",
+                      name, self.path, entry["hook"])
+
+        for k, v in cache.iteritems():
+            self.session.SetCache(k, v)
+
+        return True, value
+
+    def Store(self, name, hook_name, value, cache):
+        """Store the value produced by the hook hook_name.
+
+        Args:
+          name: The name of the parameter.
+          hook_name: The name of the ParameterHook class which produced it.
+          value: The value of the parameter.
+          cache: A dict of other parameters cached by the hook while it ran.
+        """
+        try:
+            encoded_value = self._Encode(value)
+        except ValueError as e:
+            logging.debug("Not caching %s: %s", name, e)
+            return
+
+        encoded_cache = {}
+        for k, v in cache.iteritems():
+            try:
+                encoded_cache[k] = self._Encode(v)
+            except ValueError:
+                pass
+
+        self.entries[name] = dict(
+            hook=hook_name, value=encoded_value, cache=encoded_cache)
+        self.Save()
+
+    def _Encode(self, value):
+        """Encode value as a JSON serializable tagged list.
+
+        Raises:
+          ValueError if the value can not be reconstructed in a later session.
+        """
+        if value is None or isinstance(value, (bool, float)):
+            return ["value", value]
+
+        if isinstance(value, (int, long)):
+            return ["int", str(value)]
+
+        if isinstance(value, str):
+            return ["str", value.encode("hex")]
+
+        if isinstance(value, unicode):
+            return ["unicode", value]
+
+        if isinstance(value, (list, tuple)):
+            return ["list", [self._Encode(x) for x in value]]
+
+        if isinstance(value, dict):
+            return ["dict", [[self._Encode(k), self._Encode(v)]
+                             for k, v in value.iteritems()]]
+
+        if isinstance(value, obj.Profile):
+            if not value.name:
+                raise ValueError("Profile has no name.")
+
+            return ["profile", value.name]
+
+        if isinstance(value, obj.BaseObject) and value != None:
+            if value.obj_profile is not self.session.profile:
+                raise ValueError("Object is not from the session's profile.")
+
+            if value.obj_vm is self.session.kernel_address_space:
+                vm = "kernel"
+            elif value.obj_vm is self.session.physical_address_space:
+                vm = "physical"
+            else:
+                raise ValueError("Object is in an unknown address space.")
+
+            return ["object", value.obj_type, value.obj_offset, vm]
+
+        raise ValueError("Can not cache %r." % value)
+
+    def _Decode(self, value):
+        tag = value[0]
+        if tag == "value":
+            return value[1]
+
+        if tag == "int":
+            return int(value[1])
+
+        if tag == "str":
+            return str(value[1]).decode("hex")
+
+        if tag == "unicode":
+            return value[1]
+
+        if tag == "list":
+            return [self._Decode(x) for x in value[1]]
+
+        if tag == "dict":
+            return dict((self._Decode(k), self._Decode(v))
+                        for k, v in value[1])
+
+        if tag == "profile":
+            profile = self.session.LoadProfile(value[1])
+            if profile == None:
+                raise ValueError(profile.reason)
+
+            return profile
+
+        if tag == "object":
+            _, type_name, offset, vm = value
+            if vm == "kernel":
+                # Make sure the kernel address space is loaded.
+                self.session.GetParameter("default_address_space")
+                address_space = self.session.kernel_address_space
+            else:
+                address_space = self.session.physical_address_space
+
+            return self.session.profile.Object(
+                type_name, offset=offset, vm=address_space)
+
+        raise ValueError("Unknown tag %s" % tag)
@@ -0,0 +1,74 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from rekall import kb
+from rekall import session
+from rekall import testlib
+
+
+class KBCacheTestHook(kb.ParameterHook):
+    """A hook which counts how many times it was calculated."""
+    name = "kb_cache_test"
+
+    calls = 0
+
+    def calculate(self):
+        KBCacheTestHook.calls += 1
+        self.session.SetCache("kb_cache_test_side_effect", "side effect")
+
+        return [1, 2L**40, "\xff", u"unicode"]
+
+
+class KnowledgeBaseCacheTest(testlib.RekallBaseUnitTestCase):
+    """Test the persistent cache of parameter hook results."""
+
+    def setUp(self):
+        self.temp_directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.temp_directory, "image.raw")
+        with open(self.filename, "wb") as fd:
+            fd.write("A" * 0x10000)
+
+        KBCacheTestHook.calls = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_directory)
+
+    def _MakeSession(self):
+        return session.Session(filename=self.filename, kb_cache=True,
+                               cache_dir=self.temp_directory)
+
+    def testCacheAcrossSessions(self):
+        expected = [1, 2L**40, "\xff", u"unicode"]
+        self.assertEqual(
+            self._MakeSession().GetParameter("kb_cache_test"), expected)
+        self.assertEqual(KBCacheTestHook.calls, 1)
+
+        # A new session restores the value and the hook's side effects.
+        new_session = self._MakeSession()
+        self.assertEqual(new_session.GetParameter("kb_cache_test"), expected)
+        self.assertEqual(
+            new_session.GetParameter("kb_cache_test_side_effect"),
+            "side effect")
+        self.assertEqual(KBCacheTestHook.calls, 1)
+
+        # Modifying the image invalidates the cache.
+        with open(self.filename, "r+b") as fd:
+            fd.seek(0x8000)
+            fd.write("B")
+
+        self._MakeSession().GetParameter("kb_cache_test")
+        self.assertEqual(KBCacheTestHook.calls, 2)
+
+    def testCacheIsOptional(self):
+        for _ in range(2):
+            session.Session(
+                filename=self.filename, cache_dir=self.temp_directory
+            ).GetParameter("kb_cache_test")
+
+        self.assertEqual(KBCacheTestHook.calls, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -30,6 +30,7 @@ __author__ = ("Michael Cohen <scudette@gmail.com> based on original code "
               "by Mike Auty")
 
 import atexit
+import heapq
 import inspect
 import json
 import logging
@@ -40,6 +41,7 @@ import struct
 import copy
 
 from rekall import addrspace
+from rekall import compiled_profile
 from rekall import registry
 from rekall import utils
 from rekall.ui import renderer
@@ -562,6 +564,19 @@ CreateMixIn(NumericProxyMixIn)
 CreateMixIn(StringProxyMixIn)
 
 
+# Compiled struct.Struct instances for each format string.
+_COMPILED_FORMATS = {}
+
+
+def CompileFormat(format_string):
+    """Returns a compiled struct.Struct for the format string."""
+    try:
+        return _COMPILED_FORMATS[format_string]
+    except KeyError:
+        result = _COMPILED_FORMATS[format_string] = struct.Struct(format_string)
+        return result
+
+
 class NativeType(NumericProxyMixIn, BaseObject):
     def __init__(self, value=None, format_string=None, **kwargs):
         super(NativeType, self).__init__(**kwargs)
@@ -573,7 +588,7 @@ class NativeType(NumericProxyMixIn, BaseObject):
 
     def write(self, data):
         """Writes the data back into the address space"""
-        output = struct.pack(self.format_string, int(data))
+        output = CompileFormat(self.format_string).pack(int(data))
         return self.obj_vm.write(self.obj_offset, output)
 
     def proxied(self):
@@ -587,19 +602,20 @@ class NativeType(NumericProxyMixIn, BaseObject):
 
     @property
     def obj_size(self):
-        return struct.calcsize(self.format_string)
+        return CompileFormat(self.format_string).size
 
     def v(self, vm=None):
         if self.value is not None:
             return self.value
 
-        data = self.obj_vm.read(self.obj_offset, self.obj_size)
+        compiled_format = CompileFormat(self.format_string)
+        data = self.obj_vm.read(self.obj_offset, compiled_format.size)
         if not data:
             return NoneObject("Unable to read {0} bytes from {1}",
-                              self.obj_size, self.obj_offset)
+                              compiled_format.size, self.obj_offset)
 
         # Cache this for next time.
-        (self.value,) = struct.unpack(self.format_string, data)
+        (self.value,) = compiled_format.unpack(data)
 
         return self.value
 
@@ -741,6 +757,11 @@ class Pointer(NativeType):
         # Casts into the correct AS:
         vm = vm or self.obj_vm
 
+        # The target is usually outside the struct this pointer was read from,
+        # so there is no point keeping its snapshot alive.
+        if isinstance(vm, addrspace.SnapshotAddressSpace):
+            vm = vm.base
+
         if offset:
             kwargs = copy.deepcopy(self.target_args)
             kwargs.update(dict(offset=offset,
@@ -904,11 +925,21 @@ class Void(Pointer):
         return bool(self.dereference())
 
 
+# Arrays of native types are read in chunks of up to this many bytes when they
+# are iterated over.
+ARRAY_CHUNK_SIZE = 0x10000
+
+
 class Array(BaseObject):
     """ An array of objects of the same size """
 
     target_size = 0
 
+    # Set by _GetElementFormat().
+    _element_format = None
+    _decode_values = False
+    _pointer_values = False
+
     def __init__(self, count=0, target=None, target_args=None,
                  target_size=None, max_count=100000, size=0,
                  **kwargs):
@@ -964,30 +995,147 @@ class Array(BaseObject):
         """The size of the entire array."""
         return self.target_size * self.count
 
+    def _GetElementFormat(self):
+        """Returns the struct format of each element if they are native types.
+
+        Arrays of native types (including pointers) may be read in bulk. For
+        other arrays we return "".
+        """
+        if self._element_format is None:
+            self._element_format = ""
+            prototype = self.obj_profile.Object(
+                self.target, offset=self.obj_offset, vm=self.obj_vm,
+                profile=self.obj_profile, parent=self, **self.target_args)
+
+            if not isinstance(prototype, NativeType):
+                return self._element_format
+
+            # The values can only be decoded directly if the element does not
+            # interpret them any further (e.g. BitField or Enumeration).
+            element_v = type(prototype).v.im_func
+            if isinstance(prototype, Pointer):
+                self._decode_values = element_v is Pointer.v.im_func
+                self._pointer_values = True
+                prototype = prototype._proxy
+            else:
+                self._decode_values = element_v is NativeType.v.im_func
+
+            format_string = prototype.format_string
+            if (isinstance(format_string, basestring) and
+                    CompileFormat(format_string).size == self.target_size):
+                self._element_format = format_string
+
+        return self._element_format
+
+    def _GetChunkVM(self, position, count):
+        """Returns an address space for reading elements from position onwards.
+
+        For arrays of native types this is a snapshot of up to ARRAY_CHUNK_SIZE
+        bytes of the array, read in a single call. Chunks end on a page boundary
+        so paged address spaces satisfy them with whole pages (invalid pages
+        are zero filled).
+
+        Returns:
+          A tuple of (address space, index of the first element after the
+          chunk).
+        """
+        if self.target_size <= 0 or not self._GetElementFormat():
+            return self.obj_vm, count
+
+        start = self.obj_offset + position * self.target_size
+        chunk_end = (start + ARRAY_CHUNK_SIZE) & ~0xFFF
+        end = min(count, max(
+            position + 1,
+            position + (chunk_end - start) // self.target_size))
+
+        vm = self.obj_vm
+        if isinstance(vm, addrspace.SnapshotAddressSpace):
+            vm = vm.base
+
+        return addrspace.SnapshotAddressSpace(
+            base=vm, base_offset=start,
+            length=(end - position) * self.target_size), end
+
+    def _GetIterationCount(self):
+        """The number of elements iteration yields."""
+        # Since we often calculate array counts it is possible to calculate
+        # huge arrays. This will then spin here uncontrollably. We use
+        # max_count as a safety to break out early - but we need to ensure that
+        # users see we hit this artificial limit.
+        if self.count > self.max_count + 1:
+            if self.obj_session.GetParameter("debug"):
+                pdb.set_trace()
+
+            logging.warn("%s Array iteration truncated by max_count!",
+                         self.obj_name)
+
+            return self.max_count + 1
+
+        return self.count
+
+    def values(self):
+        """Returns the values of all the elements.
+
+        This is the same as [x.v() for x in array], but arrays of native types
+        and pointers are decoded in bulk, without creating an object for each
+        element.
+        """
+        element_format = self._GetElementFormat()
+        if not element_format or not self._decode_values:
+            return [x.v() for x in self]
+
+        if not self.obj_vm.is_valid_address(self.obj_offset):
+            return []
+
+        if element_format[0] in "@=<>!":
+            prefix, element_format = element_format[0], element_format[1:]
+        else:
+            prefix = ""
+
+        count = self._GetIterationCount()
+        result = []
+        position = 0
+        while position < count:
+            vm, end = self._GetChunkVM(position, count)
+            result.extend(CompileFormat(
+                prefix + element_format * (end - position)).unpack(vm.data))
+            position = end
+
+        if self._pointer_values:
+            return [Pointer.integer_to_address(x) for x in result]
+
+        return result
+
+    def _MakeElement(self, pos, vm):
+        offset = self.target_size * pos + self.obj_offset
+        context = dict(index=pos)
+        context.update(self.obj_context)
+
+        return self.obj_profile.Object(
+            self.target, offset=offset, vm=vm,
+            parent=self, profile=self.obj_profile,
+            name="{0}[{1}] ".format(self.obj_name, pos),
+            context=context, **self.target_args)
+
     def __iter__(self):
         # If the array is invalid we do not iterate.
         if self.obj_vm.is_valid_address(self.obj_offset):
-            for position in xrange(0, self.count):
-                # Since we often calculate array counts it is possible to
-                # calculate huge arrays. This will then spin here
-                # uncontrollably. We use max_count as a safety to break out
-                # early - but we need to ensure that users see we hit this
-                # artificial limit.
-                if position > self.max_count:
-                    if self.obj_session.GetParameter("debug"):
-                        pdb.set_trace()
-
-                    logging.warn("%s Array iteration truncated by max_count!",
-                                 self.obj_name)
-                    break
-
-                # We don't want to stop on a NoneObject.  Its
-                # entirely possible that this array contains a bunch of
-                # pointers and some of them may not be valid (or paged
-                # in). This should not stop us though we just return the
-                # invalid pointers to our callers.  It's up to the callers
-                # to do what they want with the array.
-                yield self[position]
+            count = self._GetIterationCount()
+            position = 0
+            while position < count:
+                # Elements are created lazily, but arrays of native types are
+                # read a chunk at a time.
+                vm, end = self._GetChunkVM(position, count)
+                for position in xrange(position, end):
+                    # We don't want to stop on a NoneObject.  Its
+                    # entirely possible that this array contains a bunch of
+                    # pointers and some of them may not be valid (or paged
+                    # in). This should not stop us though we just return the
+                    # invalid pointers to our callers.  It's up to the callers
+                    # to do what they want with the array.
+                    yield self._MakeElement(position, vm)
+
+                position = end
 
     def __repr__(self):
         return "<{3} {0} x {1} @ 0x{2:08X}>".format(
@@ -1020,16 +1168,7 @@ class Array(BaseObject):
             start, stop, step = pos.indices(self.count)
             return [self[i] for i in xrange(start, stop, step)]
 
-        pos = int(pos)
-        offset = self.target_size * pos + self.obj_offset
-        context = dict(index=pos)
-        context.update(self.obj_context)
-
-        return self.obj_profile.Object(
-            self.target, offset=offset, vm=self.obj_vm,
-            parent=self, profile=self.obj_profile,
-            name="{0}[{1}] ".format(self.obj_name, pos),
-            context=context, **self.target_args)
+        return self._MakeElement(int(pos), self.obj_vm)
 
     def __setitem__(self, item, value):
         if isinstance(item, int):
@@ -1047,24 +1186,24 @@ class PointerArray(Array):
     The idea is to decode all pointers at once.
     """
 
+    _data = None
+
     def __init__(self, **kwargs):
         super(PointerArray, self).__init__(target="Pointer", **kwargs)
 
-        if self.target_size == 8:
-            self.format_string = "<" + "Q" * self.count
-        else:
-            self.format_string = "<" + "I" * self.count
+    def _GetData(self):
+        # Decode all the pointers on first use.
+        if self._data is None:
+            self._data = self.values()
 
-        # Read all the data
-        data = self.obj_vm.read(self.obj_offset, self.target_size * self.count)
-        self._data = struct.unpack(self.format_string, data)
+        return self._data
 
     def __iter__(self):
-        return iter(self._data)
+        return iter(self._GetData())
 
     def __getitem__(self, pos):
         return self.obj_profile.Pointer(
-            value=self._data[pos], vm=self.obj_vm, session=self.obj_session)
+            value=self._GetData()[pos], vm=self.obj_vm)
 
 
 class ListArray(Array):
@@ -1182,6 +1321,11 @@ class BaseAddressComparisonMixIn(object):
         return self.__comparator__(other, operator.__ne__)
 
 
+# Larger structs are not snapshotted, since most of their data is not usually
+# needed.
+MAX_SNAPSHOT_SIZE = 0x2000
+
+
 class Struct(BaseAddressComparisonMixIn, BaseObject):
     """ A Struct is an object which represents a c struct
 
@@ -1214,6 +1358,10 @@ class Struct(BaseAddressComparisonMixIn, BaseObject):
         self.struct_size = struct_size
         self._cache = {}
 
+        # The address space members are read from. This is a snapshot of the
+        # struct when snapshots are used (see Snapshot()).
+        self._member_vm = None
+
     def __hash__(self):
         return hash(self.indices)
 
@@ -1323,9 +1471,16 @@ class Struct(BaseAddressComparisonMixIn, BaseObject):
             ## Otherwise its relative to the start of our struct
             offset = int(offset) + int(self.obj_offset)
 
+        if self._member_vm is None:
+            self._member_vm = self.obj_vm
+            if self.obj_session and self.obj_session.GetParameter(
+                    "struct_snapshots", False):
+                self.Snapshot()
+
         try:
-            result = cls(offset=offset, vm=self.obj_vm, parent=self, name=attr,
-                         profile=self.obj_profile, context=self.obj_context)
+            result = cls(offset=offset, vm=self._member_vm, parent=self,
+                         name=attr, profile=self.obj_profile,
+                         context=self.obj_context)
         except Error, e:
             result = NoneObject(str(e))
 
@@ -1339,6 +1494,35 @@ class Struct(BaseAddressComparisonMixIn, BaseObject):
 
         return result
 
+    def Snapshot(self):
+        """Read the entire struct at once and decode all members from it.
+
+        Otherwise each member reads its own data from the address space as it is
+        accessed. Members (and nested structs) which are created after this call
+        share the snapshot. Note that the snapshot does not reflect later
+        changes to memory, except for writes made through the struct's members.
+
+        Returns:
+          self, so the call may be chained.
+        """
+        vm = self.obj_vm
+        start = self.obj_offset - self.preamble_size()
+        size = self.obj_size
+
+        if isinstance(vm, addrspace.SnapshotAddressSpace):
+            # We are already inside the parent's snapshot.
+            if vm.covers(start, size):
+                self._member_vm = vm
+                return self
+
+            vm = vm.base
+
+        if vm is not None and 0 < size <= MAX_SNAPSHOT_SIZE:
+            self._member_vm = addrspace.SnapshotAddressSpace(
+                base=vm, base_offset=start, length=size)
+
+        return self
+
     def SetMember(self, attr, value):
         """Write a value to a member."""
         member = self.m(attr)
@@ -1376,7 +1560,8 @@ class Struct(BaseAddressComparisonMixIn, BaseObject):
 
     def GetData(self):
         """Returns the raw data of this struct."""
-        return self.obj_vm.read(self.obj_offset, self.obj_size)
+        return (self._member_vm or self.obj_vm).read(
+            self.obj_offset, self.obj_size)
 
 
 ## Profiles are the interface for creating/interpreting
@@ -1463,13 +1648,19 @@ class Profile(object):
 
     def _SetupProfileFromData(self, data):
         """Sets up the current profile."""
-        # The constants are stored both in the $CONSTANTS section and the
-        # $FUNCTIONS section. We treat them the same here.
-        for section in ["$CONSTANTS", "$FUNCTIONS"]:
-            constants = data.get(section)
-            if constants:
-                self.add_constants(
-                    constants_are_addresses=True, **constants)
+        # Compiled profiles have their constants already merged and sorted.
+        constant_index = data.get("$CONSTANT_INDEX")
+        if constant_index:
+            self.add_constant_index(*constant_index)
+
+        else:
+            # The constants are stored both in the $CONSTANTS section and the
+            # $FUNCTIONS section. We treat them the same here.
+            for section in ["$CONSTANTS", "$FUNCTIONS"]:
+                constants = data.get(section)
+                if constants:
+                    self.add_constants(
+                        constants_are_addresses=True, **constants)
 
         # The enums
         enums = data.get("$ENUMS")
@@ -1527,7 +1718,12 @@ class Profile(object):
         self.overlays = []
         self.vtypes = {}
         self.constants = {}
-        self.constant_addresses = utils.SortedCollection(key=lambda x: x[0])
+        self.constant_addresses = utils.FrozenSortedCollection(
+            key=lambda x: x[0])
+
+        # (address, name) of address constants added since constant_addresses
+        # was last built.
+        self._new_constant_addresses = []
         self.enums = {}
         self.reverse_enums = {}
         self.applied_modifications = set()
@@ -1561,6 +1757,30 @@ class Profile(object):
     def flush_cache(self):
         self.types = {}
 
+    @property
+    def constant_addresses(self):
+        """A FrozenSortedCollection of (address, name) for address constants.
+
+        Profiles may have many thousands of constants, added a batch at a time
+        (e.g. once per module), so new constants are collected and merged into
+        the collection when it is next used.
+        """
+        if self._new_constant_addresses:
+            new_addresses = sorted(self._new_constant_addresses,
+                                   key=lambda x: x[0])
+            self._new_constant_addresses = []
+
+            self._constant_addresses = utils.FrozenSortedCollection(
+                heapq.merge(self._constant_addresses, new_addresses),
+                key=lambda x: x[0])
+
+        return self._constant_addresses
+
+    @constant_addresses.setter
+    def constant_addresses(self, value):
+        self._constant_addresses = value
+        self._new_constant_addresses = []
+
     def copy(self):
         """Makes a copy of this profile."""
         self.EnsureInitialized()
@@ -1591,6 +1811,10 @@ class Profile(object):
         """
         other.EnsureInitialized()
 
+        if (isinstance(other.vtypes, compiled_profile.LazyVTypes) and
+                not isinstance(self.vtypes, compiled_profile.LazyVTypes)):
+            self.vtypes = compiled_profile.LazyVTypes(self.vtypes)
+
         self.vtypes.update(other.vtypes)
         self.overlays += other.overlays
         self.constants.update(other.constants)
@@ -1639,19 +1863,31 @@ class Profile(object):
     def add_constants(self, constants_are_addresses=False, **kwargs):
         """Add the kwargs as constants for this profile."""
         self.flush_cache()
+        self.constants.update(kwargs)
 
-        for k, v in kwargs.iteritems():
-            self.constants[k] = v
-            if constants_are_addresses:
+        if constants_are_addresses:
+            for k, v in kwargs.iteritems():
                 try:
                     # We need to interpret the value as a pointer.
-                    address = Pointer.integer_to_address(v)
-                    if (address, 0) not in self.constant_addresses:
-                        self.constant_addresses.insert((address, k))
-
+                    self._new_constant_addresses.append(
+                        (Pointer.integer_to_address(v), k))
                 except ValueError:
                     pass
 
+    def add_constant_index(self, constants, constant_addresses):
+        """Add constants from a compiled profile's constant index.
+
+        Args:
+          constants: A dict of all the constants.
+          constant_addresses: A list of (address, name) sorted by address.
+        """
+        self.flush_cache()
+        self.constants.update(constants)
+
+        self._new_constant_addresses.extend(
+            (Pointer.integer_to_address(address), name)
+            for address, name in constant_addresses)
+
     def add_reverse_enums(self, **kwargs):
         """Add the kwargs as a reverse enum for this profile."""
         for k, v in kwargs.iteritems():
@@ -1668,6 +1904,15 @@ class Profile(object):
     def add_types(self, abstract_types):
         self.flush_cache()
 
+        # Types from a compiled profile are only loaded when needed.
+        if isinstance(abstract_types, compiled_profile.LazyVTypes):
+            self.known_types.update(abstract_types.keys())
+            if not isinstance(self.vtypes, compiled_profile.LazyVTypes):
+                self.vtypes = compiled_profile.LazyVTypes(self.vtypes)
+
+            self.vtypes.update(abstract_types)
+            return
+
         abstract_types = copy.deepcopy(abstract_types)
         self.known_types.update(abstract_types)
 
@@ -1699,8 +1944,12 @@ class Profile(object):
         if type_name in self.types:
             return
 
-        original_type_descriptor = type_descriptor = copy.deepcopy(
-            self.vtypes.get(type_name, self.EMPTY_DESCRIPTOR))
+        if isinstance(self.vtypes, compiled_profile.LazyVTypes):
+            original_type_descriptor = type_descriptor = self.vtypes.GetCopy(
+                type_name, self.EMPTY_DESCRIPTOR)
+        else:
+            original_type_descriptor = type_descriptor = copy.deepcopy(
+                self.vtypes.get(type_name, self.EMPTY_DESCRIPTOR))
 
         for overlay in self.overlays:
             type_overlay = copy.deepcopy(overlay.get(type_name))
@@ -2118,6 +2367,24 @@ class Profile(object):
         except ValueError:
             return -1, NoneObject("Constant not found")
 
+    def get_nearest_constants_by_address(self, addresses):
+        """A bulk version of get_nearest_constant_by_address().
+
+        Args:
+          addresses: A sorted list of addresses.
+
+        Returns:
+          A list of (offset, name) tuples, one for each address.
+        """
+        result = []
+        for hit in self.constant_addresses.find_le_many(addresses):
+            if hit is None:
+                result.append((-1, NoneObject("Constant not found")))
+            else:
+                result.append(hit)
+
+        return result
+
     def get_enum(self, enum_name, field=None):
         result = self.enums.get(enum_name)
         if result and field != None:
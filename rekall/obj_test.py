@@ -1,4 +1,5 @@
 import logging
+import struct
 
 from rekall import addrspace
 from rekall import obj
@@ -9,6 +10,17 @@ from rekall import session
 from rekall import testlib
 
 
+class ReadCountingAddressSpace(addrspace.BufferAddressSpace):
+    """A buffer address space which counts the reads made from it."""
+    __abstract = True
+
+    reads = 0
+
+    def read(self, addr, length):
+        self.reads += 1
+        return super(ReadCountingAddressSpace, self).read(addr, length)
+
+
 class ProfileTest(testlib.RekallBaseUnitTestCase):
     """Test the profile implementation."""
 
@@ -212,6 +224,119 @@ class ProfileTest(testlib.RekallBaseUnitTestCase):
         # Can read past the end of the array but this returns all zeros.
         self.assertEqual(test[100], 0)
 
+    def testArrayValues(self):
+        address_space = ReadCountingAddressSpace(
+            data="".join(struct.pack("<I", x) for x in range(0x8000)),
+            session=self.session)
+
+        profile = obj.Profile.classes['Profile32Bits'](session=self.session)
+
+        # The array straddles several chunks.
+        test = profile.Object("Array", vm=address_space, offset=0xFF8,
+                              target="unsigned int", count=0x5000)
+
+        expected = range(0x3FE, 0x3FE + 0x5000)
+        self.assertEqual(test.values(), expected)
+        self.assertEqual(address_space.reads, 2)
+
+        # Iteration reads a chunk at a time too.
+        address_space.reads = 0
+        self.assertEqual([x.v() for x in test], expected)
+        self.assertEqual(address_space.reads, 2)
+        self.assertEqual(test[5].obj_offset, 0xFF8 + 5 * 4)
+
+        pointers = profile.Object("PointerArray", vm=address_space, offset=8,
+                                  count=3)
+        self.assertEqual(list(pointers), [2, 3, 4])
+        self.assertEqual(pointers[1], 3)
+
+        # Elements which interpret their values are decoded one by one.
+        bits = profile.Object("Array", vm=address_space, offset=4, count=2,
+                              target="BitField",
+                              target_args=dict(start_bit=1, end_bit=2,
+                                               target="unsigned int"))
+        self.assertEqual(bits.values(), [0, 1])
+
+    def testNearestConstants(self):
+        profile = obj.Profile.classes['Profile32Bits'](session=self.session)
+        profile.add_constants(constants_are_addresses=True,
+                              foo=0x1000, bar=0x2000, baz=0x2004)
+
+        addresses = [0x1000, 0x1fff, 0x2000, 0x2002, 0x3000]
+        self.assertEqual(
+            profile.get_nearest_constants_by_address(addresses),
+            [profile.get_nearest_constant_by_address(x) for x in addresses])
+
+        # There is no constant below the first address.
+        offset, name = profile.get_nearest_constants_by_address([0x10])[0]
+        self.assertEqual(offset, -1)
+        self.assertFalse(name)
+
+    def testAddConstantsInBatches(self):
+        profile = obj.Profile.classes['Profile32Bits'](session=self.session)
+        for i in range(10, 0, -1):
+            profile.add_constants(constants_are_addresses=True,
+                                  **{"const%d" % i: i * 0x1000})
+
+        # Constants are merged in when they are first used.
+        self.assertEqual(profile.get_constant_by_address(0x3000), "const3")
+        profile.add_constants(constants_are_addresses=True, extra=0x3800)
+        self.assertEqual(profile.get_nearest_constant_by_address(0x3900),
+                         (0x3800, "extra"))
+
+        self.assertEqual(
+            list(profile.constant_addresses),
+            sorted([(i * 0x1000, "const%d" % i) for i in range(1, 11)] +
+                   [(0x3800, "extra")]))
+
+        # Copies see all the constants.
+        profile.add_constants(constants_are_addresses=True, last=0x20000)
+        self.assertEqual(len(profile.copy().constant_addresses), 12)
+
+    def testStructSnapshot(self):
+        address_space = ReadCountingAddressSpace(
+            data="\x01\x00\x00\x00\x02\x00\x00\x00"
+            "\x03\x00\x00\x00\x10\x00\x00\x00"
+            "\x04\x00\x00\x00", session=self.session)
+
+        profile = obj.Profile.classes['Profile32Bits'](session=self.session)
+        profile.add_types({
+            'Inner': [0x8, {
+                'a': [0x00, ['unsigned int']],
+                'b': [0x04, ['unsigned int']],
+                }],
+            'Outer': [0x10, {
+                'x': [0x00, ['unsigned int']],
+                'inner': [0x04, ['Inner']],
+                'ptr': [0x0C, ['Pointer', dict(target='unsigned int')]],
+                }]})
+
+        test = profile.Object("Outer", offset=0, vm=address_space).Snapshot()
+        self.assertEqual(address_space.reads, 1)
+
+        # All members, including nested structs, are decoded from the snapshot.
+        self.assertEqual(test.x, 1)
+        self.assertEqual(test.inner.a, 2)
+        self.assertEqual(test.inner.b, 3)
+        self.assertEqual(test.ptr, 0x10)
+        self.assertEqual(test.GetData(), address_space.data[:0x10])
+        self.assertEqual(address_space.reads, 1)
+
+        # Pointers into memory outside the snapshot read the address space.
+        self.assertEqual(test.ptr.deref(), 4)
+        self.assertEqual(address_space.reads, 2)
+
+        # Members still compare as if they were created on the address space.
+        self.assertEqual(
+            test.inner, profile.Object("Inner", offset=4, vm=address_space))
+
+        # Writes go to the address space and update the snapshot.
+        test.inner.SetMember("b", 5)
+        self.assertEqual(address_space.data[8:12], "\x05\x00\x00\x00")
+        self.assertEqual(
+            profile.Object("Outer", offset=0, vm=address_space).Snapshot(
+                ).inner.GetData(), "\x02\x00\x00\x00\x05\x00\x00\x00")
+
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.DEBUG)
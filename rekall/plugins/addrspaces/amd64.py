@@ -108,13 +108,12 @@ class AMD64PagedMemory(intel.IA32PagedMemoryPae):
 
     lock = 0
 
-    def vtop(self, vaddr):
+    def walk_page_tables(self, vaddr):
         '''
-        Translates virtual addresses into physical offsets.
-        The function returns either None (no valid mapping)
-        or the offset in physical memory where the address maps.
+        Translates a virtual address by walking the page tables.
+
+        This is not cached - callers should normally use vtop().
         '''
-        vaddr = long(vaddr)
         pml4e = self.get_pml4e(vaddr)
         if not self.pml4e_entry_present(pml4e):
             # Add support for paged out PML4E
@@ -142,7 +141,7 @@ class AMD64PagedMemory(intel.IA32PagedMemoryPae):
 
         return self.get_phys_addr(vaddr, pte)
 
-    def get_available_addresses(self, start=0):
+    def walk_available_addresses(self, start=0):
         """Enumerate all available ranges.
 
         Yields tuples of (vaddr, physical address, length) for all available
@@ -309,6 +308,9 @@ class VTxPagedMemory(AMD64PagedMemory):
                            ((vaddr & 0xff8000000000) >> 36))
         return self.read_long_long_phys(ept_pml4e_paddr)
 
+    def page_map_key(self):
+        return (self.__class__.__name__, self._ept)
+
     def __str__(self):
         return "%s@0x%08X" % (self.__class__.__name__, self._ept)
 
@@ -392,6 +394,9 @@ class XenParaVirtAMD64PagedMemory(AMD64PagedMemory):
         self.m2p_mapping = new_mapping
         self.session.SetParameter("mapping", self.m2p_mapping)
 
+        # Translations made before the mapping was complete are stale.
+        self.flush_translations()
+
     def m2p(self, machine_address):
         """Translates from a machine address to a physical address.
 
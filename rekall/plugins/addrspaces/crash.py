@@ -52,13 +52,16 @@ class WindowsCrashDumpSpace32(addrspace.RunBasedAddressSpace):
 
         file_offset = self.header.obj_size
 
+        runs = []
         for run in self.header.PhysicalMemoryBlockBuffer.Run:
-            self.runs.insert((int(run.BasePage) * self.PAGE_SIZE,
-                              file_offset,
-                              int(run.PageCount) * self.PAGE_SIZE))
+            runs.append((int(run.BasePage) * self.PAGE_SIZE,
+                         file_offset,
+                         int(run.PageCount) * self.PAGE_SIZE))
 
             file_offset += run.PageCount * self.PAGE_SIZE
 
+        self.set_runs(runs)
+
         self.session.SetCache(
             "dtb", int(self.header.DirectoryTableBase))
 
@@ -182,6 +185,7 @@ class WindowsCrashBMP(addrspace.RunBasedAddressSpace):
         first_page = self.bmp_header.FirstPage.v()
         last_run = [0, first_page, 0]
 
+        runs = []
         for pfn, present in enumerate(self._generate_bitmap()):
             if present:
                 if pfn * PAGE_SIZE == last_run[0] + last_run[2]:
@@ -190,7 +194,7 @@ class WindowsCrashBMP(addrspace.RunBasedAddressSpace):
                 else:
                     # Dump the last run only if it has non zero length.
                     if last_run[2] > 0:
-                        self.runs.insert(last_run)
+                        runs.append(last_run)
 
                     # The next run starts here.
                     last_run = [
@@ -198,7 +202,9 @@ class WindowsCrashBMP(addrspace.RunBasedAddressSpace):
 
         # Flush the last run if needed.
         if last_run[2] > 0:
-            self.runs.insert(last_run)
+            runs.append(last_run)
+
+        self.set_runs(runs)
 
     def _generate_bitmap(self):
         """Generate Present/Not Present for each page in the dump."""
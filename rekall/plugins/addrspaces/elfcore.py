@@ -62,6 +62,8 @@ class Elf64CoreDump(addrspace.RunBasedAddressSpace):
                        "Elf file is not a core file.")
         self.name = "%s|%s" % (self.__class__.__name__, self.base.name)
         # Iterate over all the program headers and map the runs.
+        runs = []
+        metadata_offsets = []
         for segment in self.elf64_hdr.e_phoff:
             if segment.p_type == "PT_LOAD":
                 # Some load segments are empty.
@@ -71,12 +73,19 @@ class Elf64CoreDump(addrspace.RunBasedAddressSpace):
 
                 # Add the run to the memory map.
                 virtual_address = int(segment.p_paddr) or int(segment.p_vaddr)
-                self.runs.insert((virtual_address,  # Virtual Addr
-                                  int(segment.p_offset), # File Addr
-                                  int(segment.p_memsz))) # Length
+                runs.append((virtual_address,  # Virtual Addr
+                             int(segment.p_offset), # File Addr
+                             int(segment.p_memsz))) # Length
 
             elif segment.p_type == PT_PMEM_METADATA:
-                self.LoadMetadata(segment.p_offset)
+                metadata_offsets.append(segment.p_offset)
+
+        self.set_runs(runs)
+
+        # The metadata may map the pagefile after the end of the runs, so it
+        # is only loaded once all the runs are known.
+        for offset in metadata_offsets:
+            self.LoadMetadata(offset)
 
         # Search for the pmem footer signature.
         footer = self.base.read(self.base.end() - 10000, 10000)
@@ -137,7 +146,8 @@ class Elf64CoreDump(addrspace.RunBasedAddressSpace):
         vaddr = self.end() + 0x10000
 
         logging.info("Loading pagefile into physical offset %#08x", vaddr)
-        self.runs.insert((vaddr, pagefile_offset, pagefile_size))
+        self.set_runs(list(self.runs) + [
+            (vaddr, pagefile_offset, pagefile_size)])
 
         # Remember the region for the pagefile.
         self.pagefile_offset = vaddr
@@ -166,6 +176,9 @@ class KCoreAddressSpace(Elf64CoreDump):
     __name = "elf64"
     __image = True
 
+    # /proc/kcore is the memory of the running system.
+    __live = True
+
     def __init__(self, **kwargs):
         super(KCoreAddressSpace, self).__init__(**kwargs)
 
@@ -177,9 +190,7 @@ class KCoreAddressSpace(Elf64CoreDump):
                 runs.append((vaddr - 0xffff880000000000, paddr, length))
 
         self.as_assert(runs, "No kcore compatible virtual ranges.")
-        self.runs.clear()
-        for x in runs:
-            self.runs.insert(x)
+        self.set_runs(runs)
 
 
 def WriteElfFile(address_space, outfd, session=None):
@@ -61,3 +61,10 @@ class EWFAddressSpace(addrspace.BaseAddressSpace):
 
     def get_available_addresses(self, start=0):
         yield (0, 0, self.ewf_file.size)
+
+    def after_fork(self):
+        self.ewf_file.after_fork()
+
+    def close(self):
+        self.ewf_file.close()
+        self.base.close()
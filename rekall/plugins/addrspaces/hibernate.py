@@ -25,11 +25,20 @@
 # this code in Rekall Memory Forensics.
 
 """ A Hiber file Address Space """
+import hashlib
+import itertools
+import logging
+import multiprocessing
+import os
+import struct
+import tempfile
+import zlib
+
 from rekall import addrspace
+from rekall import config
 from rekall import obj
 from rekall import utils
 from rekall.plugins.addrspaces import xpress
-import struct
 
 
 # pylint: disable=C0111
@@ -38,6 +47,159 @@ PAGE_SIZE = 0x1000
 page_shift = 12
 
 
+config.DeclareOption(
+    "--hiber_spill", default=False, type="Boolean",
+    help="Keep all decompressed hibernation file blocks in a temporary file "
+    "so they never need to be decompressed twice.")
+
+
+class HiberFileIndex(object):
+    """A persistent copy of the hibernation file's page lookup table.
+
+    Walking all the _PO_MEMORY_RANGE_ARRAYs of a large hibernation file takes
+    minutes, so the result is stored on disk and reused when the same file is
+    opened again. The index is stored in the cache_dir under a name derived
+    from the file's header and size. Nothing is ever written next to the
+    image, so without a cache_dir the index is not kept.
+
+    The index file format is:
+      - A header (magic, version, highest page, page count, memory range
+        count, number of address ranges).
+      - The address ranges as (virtual address, physical address, length).
+      - A zlib compressed block holding the page lookup table in columns: page
+        numbers, xpress header offsets, xpress block sizes, page in block.
+    """
+
+    MAGIC = "RKHIBIDX"
+    VERSION = 1
+
+    HEADER = struct.Struct("<8sIQQQQ")
+    RANGE = struct.Struct("<QQQ")
+
+    # The number of bytes at the start of the file used to identify it.
+    FINGERPRINT_SIZE = 0x10000
+
+    def __init__(self, session, base):
+        self.session = session
+        self.base = base
+        self.path = self._GetPath()
+
+    def _GetPath(self):
+        cache_dir = self.session.GetParameter("cache_dir")
+        if not cache_dir:
+            return
+
+        cache_dir = os.path.join(config.GetHomeDir(), cache_dir)
+        size = self.base.end() or 0
+        fingerprint = hashlib.sha1(self.base.read(0, self.FINGERPRINT_SIZE))
+        fingerprint.update(str(size))
+
+        return os.path.join(
+            cache_dir, "hiberfil-%s-%d.idx" % (fingerprint.hexdigest(), size))
+
+    def Load(self, hiber_as):
+        """Populate the page tables of hiber_as from the index.
+
+        Returns:
+          True if the index was loaded.
+        """
+        if not self.path or not os.access(self.path, os.R_OK):
+            return False
+
+        try:
+            with open(self.path, "rb") as fd:
+                data = fd.read()
+
+            (magic, version, highest_page, page_count, mem_range_count,
+             range_count) = self.HEADER.unpack_from(data)
+            if magic != self.MAGIC or version != self.VERSION:
+                return False
+
+            offset = self.HEADER.size
+            address_list = []
+            for _ in xrange(range_count):
+                address_list.append(self.RANGE.unpack_from(data, offset))
+                offset += self.RANGE.size
+
+            table = zlib.decompress(data[offset:])
+            columns = []
+            offset = 0
+            for fmt in "QQIB":
+                column = struct.Struct("<%d%s" % (page_count, fmt))
+                columns.append(column.unpack_from(table, offset))
+                offset += column.size
+
+        except (IOError, OSError, struct.error, zlib.error), e:
+            logging.info("Unable to load hibernation index %s: %s",
+                         self.path, e)
+            return False
+
+        page_dict = {}
+        lookup_cache = {}
+        for page, header_offset, block_size, xpress_page in zip(*columns):
+            page_dict.setdefault(header_offset, []).append(
+                (page, block_size, xpress_page))
+            lookup_cache[page] = (header_offset, block_size, xpress_page)
+
+        hiber_as.HighestPage = highest_page
+        hiber_as.PageIndex = page_count
+        hiber_as.MemRangeCnt = mem_range_count
+        hiber_as.AddressList = address_list
+        hiber_as.PageDict = page_dict
+        hiber_as.LookupCache = lookup_cache
+
+        return True
+
+    def Save(self, hiber_as):
+        """Write the page tables of hiber_as into the index."""
+        if not self.path:
+            return
+
+        pages = sorted(hiber_as.LookupCache.iteritems())
+        page_count = len(pages)
+        table = "".join([
+            struct.pack("<%dQ" % page_count, *[x[0] for x in pages]),
+            struct.pack("<%dQ" % page_count, *[x[1][0] for x in pages]),
+            struct.pack("<%dI" % page_count, *[x[1][1] for x in pages]),
+            struct.pack("<%dB" % page_count, *[x[1][2] for x in pages])])
+
+        try:
+            with open(self.path, "wb") as fd:
+                fd.write(self.HEADER.pack(
+                    self.MAGIC, self.VERSION, hiber_as.HighestPage,
+                    page_count, hiber_as.MemRangeCnt,
+                    len(hiber_as.AddressList)))
+
+                for address_range in hiber_as.AddressList:
+                    fd.write(self.RANGE.pack(*address_range))
+
+                fd.write(zlib.compress(table))
+
+        except (IOError, OSError), e:
+            logging.info("Unable to save hibernation index %s: %s",
+                         self.path, e)
+
+
+class XpressSpillStore(object):
+    """Keeps decompressed xpress blocks in a temporary file."""
+
+    def __init__(self):
+        self.fd = tempfile.TemporaryFile()
+        self.index = {}
+
+    def Put(self, baddr, data):
+        if baddr not in self.index:
+            self.fd.seek(0, 2)
+            self.index[baddr] = (self.fd.tell(), len(data))
+            self.fd.write(data)
+
+    def Get(self, baddr):
+        """Returns the block at baddr. Raises KeyError if it is not stored."""
+        offset, length = self.index[baddr]
+        self.fd.seek(offset)
+        return self.fd.read(length)
+
+
 class HibernationSupport(obj.ProfileModification):
     """Support hibernation file structures for different versions of windows."""
 
@@ -232,6 +394,7 @@ class WindowsHiberFileSpace(addrspace.BaseAddressSpace):
         self.AddressList = []
         self.LookupCache = {}
         self.PageCache = utils.FastStore(500)
+        self.SpillStore = None
         self.MemRangeCnt = 0
         self.offset = 0
         self.entry_count = 0xFF
@@ -260,11 +423,18 @@ class WindowsHiberFileSpace(addrspace.BaseAddressSpace):
         ## need to search for it.
         self.dtb = self.ProcState.SpecialRegisters.Cr3.v()
 
-        # This is a lengthy process, it was cached, but it may be best to delay this
-        # until it's absolutely necessary and/or convert it into a generator...
-        self.build_page_cache()
+        # This is a lengthy process, so the result is kept in an index file for
+        # the next time this file is opened.
+        index = HiberFileIndex(self.session, self.base)
+        if not index.Load(self):
+            self.build_page_cache()
+            index.Save(self)
+
         super(WindowsHiberFileSpace, self).__init__(**kwargs)
 
+        if self.session.GetParameter("hiber_spill"):
+            self.SpillStore = XpressSpillStore()
+
     def _get_first_table_page(self):
         if self.header:
             return self.header.FirstTablePage
@@ -341,21 +511,45 @@ class WindowsHiberFileSpace(addrspace.BaseAddressSpace):
             else:
                 MemoryArrayOffset = 0
 
-    def convert_to_raw(self, ofile):
-        page_count = 0
-        for _i, xb in enumerate(self.PageDict.keys()):
+    def _generate_compressed_blocks(self, xpress_blocks):
+        """Yields (block size, compressed data) for the xpress blocks."""
+        for xb in xpress_blocks:
             size = self.PageDict[xb][0][1]
-            data_z = self.base.read(xb + 0x20, size)
-            if size == 0x10000:
-                data_uz = data_z
-            else:
-                data_uz = xpress.xpress_decode(data_z)
-            for page, size, offset in self.PageDict[xb]:
-                ofile.seek(page * 0x1000)
-                ofile.write(data_uz[offset * 0x1000:offset * 0x1000 + 0x1000])
-                page_count += 1
-            del data_z, data_uz
-            yield page_count
+            yield size, self.base.read(xb + 0x20, size)
+
+    def convert_to_raw(self, ofile):
+        """Writes the decompressed pages into ofile.
+
+        If decompression_workers is set, blocks are decompressed in a pool of
+        worker processes while this process reads the compressed blocks and
+        writes the pages in order.
+        """
+        xpress_blocks = sorted(self.PageDict)
+        compressed_blocks = self._generate_compressed_blocks(xpress_blocks)
+
+        workers = self.session.GetParameter("decompression_workers") or 0
+        pool = None
+        if workers > 1:
+            pool = multiprocessing.Pool(workers)
+            blocks = pool.imap(_DecodeXpressBlock, compressed_blocks, 16)
+        else:
+            blocks = itertools.imap(_DecodeXpressBlock, compressed_blocks)
+
+        try:
+            page_count = 0
+            for xb, data_uz in itertools.izip(xpress_blocks, blocks):
+                for page, _, offset in self.PageDict[xb]:
+                    ofile.seek(page * 0x1000)
+                    ofile.write(
+                        data_uz[offset * 0x1000:offset * 0x1000 + 0x1000])
+                    page_count += 1
+
+                yield page_count
+
+        finally:
+            if pool:
+                pool.terminate()
+                pool.join()
 
     def next_xpress(self, XpressHeader, XpressBlockSize):
         XpressHeaderOffset = int(XpressBlockSize) + XpressHeader.obj_offset + \
@@ -443,15 +637,29 @@ class WindowsHiberFileSpace(addrspace.BaseAddressSpace):
         return XpressHeaderOffset != None
 
     def read_xpress(self, baddr, BlockSize):
-        data_uz = self.PageCache.Get(baddr)
-        if data_uz is None:
-            data_read = self.base.read(baddr, BlockSize)
-            if BlockSize == 0x10000:
-                data_uz = data_read
-            else:
-                data_uz = xpress.xpress_decode(data_read)
-
+        try:
+            return self.PageCache.Get(baddr)
+        except KeyError:
+            pass
+
+        # Blocks we decompressed before need not be read from the base again.
+        if self.SpillStore:
+            try:
+                data_uz = self.SpillStore.Get(baddr)
                 self.PageCache.Put(baddr, data_uz)
+                return data_uz
+            except KeyError:
+                pass
+
+        data_read = self.base.read(baddr, BlockSize)
+        if BlockSize == 0x10000:
+            return data_read
+
+        data_uz = xpress.xpress_decode(data_read)
+        if self.SpillStore:
+            self.SpillStore.Put(baddr, data_uz)
+
+        self.PageCache.Put(baddr, data_uz)
 
         return data_uz
 
@@ -534,3 +742,12 @@ class WindowsHiberFileSpace(addrspace.BaseAddressSpace):
 
     def close(self):
         self.base.close()
+
+
+def _DecodeXpressBlock(args):
+    """Decompresses a single block in convert_to_raw()."""
+    size, data_z = args
+    if size == 0x10000:
+        return data_z
+
+    return xpress.xpress_decode(data_z)
@@ -0,0 +1,138 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from rekall import addrspace
+from rekall import session
+from rekall import testlib
+from rekall import utils
+from rekall.plugins.addrspaces import hibernate
+from rekall.plugins.addrspaces import xpress
+
+
+class FakeHiberFile(object):
+    """Holds the page tables like WindowsHiberFileSpace."""
+
+    HighestPage = 0
+    PageIndex = 0
+    MemRangeCnt = 0
+    AddressList = []
+    PageDict = {}
+    LookupCache = {}
+
+
+class HiberFileIndexTest(testlib.RekallBaseUnitTestCase):
+    """Test the persistent hibernation file index."""
+
+    def setUp(self):
+        self.session = session.Session()
+        self.temp_dir = tempfile.mkdtemp()
+        self.base = addrspace.BufferAddressSpace(
+            data="hibr" + "\x01" * 0x2000, session=self.session)
+
+        # Pretend the image is a file in the temp directory.
+        self.base.fname = os.path.join(self.temp_dir, "hiberfil.sys")
+
+        self.hiber_as = FakeHiberFile()
+        self.hiber_as.HighestPage = 0x200
+        self.hiber_as.MemRangeCnt = 2
+        self.hiber_as.AddressList = [(0, 0, 0x1000), (0x5000, 0x1000, 0x2000)]
+        self.hiber_as.LookupCache = {
+            0: (0x1000, 0x800, 0),
+            1: (0x1000, 0x800, 1),
+            0x100: (0x3000, 0x10000, 0),
+        }
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def testRoundTrip(self):
+        cache_dir = os.path.join(self.temp_dir, "cache")
+        os.mkdir(cache_dir)
+        with self.session:
+            self.session.SetParameter("cache_dir", cache_dir)
+
+        hibernate.HiberFileIndex(self.session, self.base).Save(self.hiber_as)
+        self.assertEqual(len(os.listdir(cache_dir)), 1)
+
+        loaded = FakeHiberFile()
+        self.assertTrue(
+            hibernate.HiberFileIndex(self.session, self.base).Load(loaded))
+
+        self.assertEqual(loaded.HighestPage, 0x200)
+        self.assertEqual(loaded.PageIndex, 3)
+        self.assertEqual(loaded.MemRangeCnt, 2)
+        self.assertEqual(loaded.AddressList, self.hiber_as.AddressList)
+        self.assertEqual(loaded.LookupCache, self.hiber_as.LookupCache)
+        self.assertEqual(sorted(loaded.PageDict[0x1000]),
+                         [(0, 0x800, 0), (1, 0x800, 1)])
+
+        # A different file does not use the index.
+        other = addrspace.BufferAddressSpace(
+            data="hibr" + "\x02" * 0x2000, session=self.session)
+        self.assertFalse(
+            hibernate.HiberFileIndex(self.session, other).Load(FakeHiberFile()))
+
+    def testNoCacheDir(self):
+        with self.session:
+            self.session.SetParameter("cache_dir", None)
+
+        index = hibernate.HiberFileIndex(self.session, self.base)
+        index.Save(self.hiber_as)
+
+        # Nothing is written next to the image.
+        self.assertEqual(os.listdir(self.temp_dir), [])
+        self.assertFalse(index.Load(FakeHiberFile()))
+
+
+class CountingAddressSpace(addrspace.BufferAddressSpace):
+    __abstract = True
+
+    def __init__(self, **kwargs):
+        super(CountingAddressSpace, self).__init__(**kwargs)
+        self.reads = []
+
+    def read(self, addr, length):
+        self.reads.append(addr)
+        return super(CountingAddressSpace, self).read(addr, length)
+
+
+class XpressSpillStoreTest(testlib.RekallBaseUnitTestCase):
+    """Test spilling decompressed blocks."""
+
+    def testSpillStore(self):
+        store = hibernate.XpressSpillStore()
+        store.Put(0x1000, "a" * 10)
+        store.Put(0x2000, "b" * 20)
+
+        # Blocks are only stored once.
+        store.Put(0x1000, "c" * 10)
+
+        self.assertEqual(store.Get(0x2000), "b" * 20)
+        self.assertEqual(store.Get(0x1000), "a" * 10)
+        self.assertRaises(KeyError, store.Get, 0x3000)
+
+    def testReadXpress(self):
+        data = "".join(chr(x % 251) for x in range(0x4000))
+        block = xpress.xpress_encode(data)
+
+        hiber_as = hibernate.WindowsHiberFileSpace.__new__(
+            hibernate.WindowsHiberFileSpace)
+        hiber_as.base = CountingAddressSpace(
+            data="\x00" * 0x100 + block, session=session.Session())
+        hiber_as.PageCache = utils.FastStore(500)
+        hiber_as.SpillStore = hibernate.XpressSpillStore()
+
+        self.assertEqual(hiber_as.read_xpress(0x100, len(block)), data)
+        self.assertEqual(hiber_as.base.reads, [0x100])
+
+        # Once the block falls out of the page cache it comes from the spill
+        # store without reading the base.
+        hiber_as.PageCache.Flush()
+        self.assertEqual(hiber_as.read_xpress(0x100, len(block)), data)
+        self.assertEqual(hiber_as.base.reads, [0x100])
+
+
+if __name__ == "__main__":
+    unittest.main()
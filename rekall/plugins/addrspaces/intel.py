@@ -23,6 +23,8 @@
 
 """ This is Jesse Kornblum's patch to clean up the standard AS's.
 """
+import array
+import bisect
 import struct
 
 from rekall import addrspace
@@ -33,20 +35,49 @@ config.DeclareOption(
     "dtb", group="Autodetection Overrides",
     type="IntParser", help="The DTB physical address.")
 
+config.DeclareOption(
+    "--tlb_size", default=10000, type="IntParser",
+    help="The number of page translations cached by each paged address "
+    "space.")
+
 PAGE_SHIFT = 12
 PAGE_MASK = ~ 0xFFF
 
+# The array typecode for addresses. Where longs are only 32 bits, doubles still
+# represent page aligned addresses exactly.
+ADDRESS = "L" if array.array("L").itemsize == 8 else "d"
+
 
 class TranslationLookasideBuffer(utils.FastStore):
-    """An implementation of a TLB."""
+    """An implementation of a TLB.
+
+    Translations are cached per page, so a single entry serves every address
+    in the page. Invalid pages are cached as None so repeated lookups of
+    unmapped addresses do not walk the page tables again.
+    """
+
+    def __init__(self, max_size=10, **kwargs):
+        super(TranslationLookasideBuffer, self).__init__(
+            max_size=max_size, **kwargs)
+        self.hits = 0
+        self.misses = 0
 
     def Get(self, vaddr):
-        result = super(TranslationLookasideBuffer, self).Get(
-            vaddr >> PAGE_SHIFT)
+        try:
+            result = super(TranslationLookasideBuffer, self).Get(
+                vaddr >> PAGE_SHIFT)
+        except KeyError:
+            self.misses += 1
+            raise
 
+        self.hits += 1
         if result is not None:
             return result + (vaddr & 0xFFF)
 
+    def Stats(self):
+        """Returns a dict describing the effectiveness of the TLB."""
+        return dict(hits=self.hits, misses=self.misses, size=len(self._hash))
+
     def Put(self, vaddr, paddr):
         if paddr is not None:
             paddr = paddr & PAGE_MASK
@@ -55,6 +86,66 @@ class TranslationLookasideBuffer(utils.FastStore):
             vaddr >> PAGE_SHIFT, paddr)
 
 
+class PageMap(object):
+    """A sorted index of all the valid pages in a paged address space.
+
+    Adjacent pages which are also adjacent in the physical address space are
+    coalesced into runs. The runs are kept in parallel arrays, which are much
+    smaller than lists of ints, and are searched by bisection.
+    """
+
+    def __init__(self, ranges=()):
+        self.vaddrs = array.array(ADDRESS)
+        self.paddrs = array.array(ADDRESS)
+        self.lengths = array.array(ADDRESS)
+
+        for vaddr, paddr, length in ranges:
+            self.append(vaddr, paddr, length)
+
+    def append(self, vaddr, paddr, length):
+        """Adds a range, which must be above all the existing ranges."""
+        if self.vaddrs:
+            last_length = self.lengths[-1]
+            if (vaddr == self.vaddrs[-1] + last_length and
+                    paddr == self.paddrs[-1] + last_length):
+                self.lengths[-1] += length
+                return
+
+        self.vaddrs.append(vaddr)
+        self.paddrs.append(paddr)
+        self.lengths.append(length)
+
+    def find(self, vaddr):
+        """Finds the run containing vaddr.
+
+        Returns:
+          a tuple of (physical address, number of bytes mapped contiguously
+          from vaddr), or None if vaddr is not mapped.
+        """
+        idx = bisect.bisect_right(self.vaddrs, vaddr) - 1
+        if idx >= 0:
+            offset = vaddr - int(self.vaddrs[idx])
+            length = int(self.lengths[idx])
+            if offset < length:
+                return int(self.paddrs[idx]) + offset, length - offset
+
+    def vtop(self, vaddr):
+        run = self.find(vaddr)
+        if run:
+            return run[0]
+
+    def ranges(self, start=0):
+        """Yields (vaddr, paddr, length) for all runs ending above start."""
+        first = max(0, bisect.bisect_right(self.vaddrs, start) - 1)
+        for idx in xrange(first, len(self.vaddrs)):
+            vaddr, length = int(self.vaddrs[idx]), int(self.lengths[idx])
+            if vaddr + length > start:
+                yield vaddr, int(self.paddrs[idx]), length
+
+    def __len__(self):
+        return len(self.vaddrs)
+
+
 class IA32PagedMemory(addrspace.PagedReader):
     """ Standard x86 32 bit non PAE address space.
 
@@ -91,6 +182,11 @@ class IA32PagedMemory(addrspace.PagedReader):
         if not self.base:
             raise TypeError("No base Address Space")
 
+        # Use a TLB to make this faster.
+        self._tlb = TranslationLookasideBuffer(
+            self.session.GetParameter("tlb_size") or 1000)
+        self._page_map = None
+
         # If the underlying address space already knows about the dtb we use it.
         # Allow the dtb to be specified in the session.
         self.dtb = dtb or self.session.GetParameter("dtb")
@@ -100,15 +196,78 @@ class IA32PagedMemory(addrspace.PagedReader):
                             " plugin to search for the dtb.")
         self.name = (name or 'Kernel AS') + "@%#x" % self.dtb
 
-        # Use a TLB to make this faster.
-        self._tlb = TranslationLookasideBuffer(1000)
-
         # Our get_available_addresses() refers to the base address space we
         # overlay on.
         self.phys_base = self.base
 
         self._cache = utils.FastStore(100)
 
+    @property
+    def dtb(self):
+        return self._dtb
+
+    @dtb.setter
+    def dtb(self, value):
+        # Cached translations are only valid for the page tables they came
+        # from.
+        self._dtb = value
+        self._tlb.Flush()
+        self._page_map = None
+
+    def page_map_key(self):
+        """A key which identifies the page tables used by this address space."""
+        return (self.__class__.__name__, self.dtb)
+
+    def get_page_map(self):
+        """Returns the PageMap of this address space, building it if needed.
+
+        The page map is kept in the session cache, so all address spaces
+        sharing the same page tables only need to walk them once. Page tables
+        in live memory change under us, so their page map is built again each
+        time and is not used for translation. The TLB is flushed too, so each
+        run sees the current page tables.
+        """
+        if self.base.is_live():
+            self._tlb.Flush()
+            return self._build_page_map()
+
+        if self._page_map is None:
+            page_maps = self.session.GetParameter("page_maps") or {}
+            key = self.page_map_key()
+            page_map = page_maps.get(key)
+            if page_map is None:
+                page_map = self._build_page_map()
+                page_maps[key] = page_map
+                self.session.SetCache("page_maps", page_maps)
+
+            self._page_map = page_map
+
+        return self._page_map
+
+    def _build_page_map(self):
+        page_map = PageMap()
+        for vaddr, paddr, length in self.walk_available_addresses():
+            self.session.report_progress(
+                "%(name)s: Building page map %(spinner)s", name=self.name)
+            page_map.append(vaddr, paddr, length)
+
+        return page_map
+
+    def flush_translations(self):
+        """Forget all cached translations for this address space's DTB."""
+        self._tlb.Flush()
+        self._page_map = None
+        page_maps = self.session.GetParameter("page_maps")
+        if page_maps:
+            page_maps.pop(self.page_map_key(), None)
+
+    def cache_translation(self, vaddr, paddr):
+        self._tlb.Put(vaddr, paddr)
+
+    def tlb_stats(self):
+        """Returns the hit/miss counters of this address space's TLB."""
+        return self._tlb.Stats()
+
     def pde_entry_present(self, entry):
         '''
         Returns whether or not the 'P' (Present) flag is on
@@ -194,24 +353,47 @@ class IA32PagedMemory(addrspace.PagedReader):
         The function should return either None (no valid mapping)
         or the offset in physical memory where the address maps.
         '''
+        vaddr = int(vaddr)
+        if self._page_map is not None:
+            paddr = self._page_map.vtop(vaddr)
+            if paddr is not None:
+                return paddr
+
         try:
             return self._tlb.Get(vaddr)
         except KeyError:
-            pde_value = self.get_pde(vaddr)
-            if not self.pde_entry_present(pde_value):
-                return None
+            res = self.walk_page_tables(vaddr)
+            self.cache_translation(vaddr, res)
+            return res
 
-            if self.page_size_flag(pde_value):
-                return self.get_four_meg_paddr(vaddr, pde_value)
+    def _read_chunk(self, vaddr, length):
+        # If we have a page map, read as much of the run as possible at once.
+        if self._page_map is not None:
+            run = self._page_map.find(vaddr)
+            if run:
+                paddr, available = run
+                return self.base.read(paddr, min(length, available))
 
-            pte_value = self.get_pte(vaddr, pde_value)
-            if not self.pte_entry_present(pte_value):
-                return None
-            res = self.get_phys_addr(vaddr, pte_value)
+        return super(IA32PagedMemory, self)._read_chunk(vaddr, length)
 
-            self._tlb.Put(vaddr, res)
-            return res
+    def walk_page_tables(self, vaddr):
+        '''
+        Translates a virtual address by walking the page tables.
+
+        This is not cached - callers should normally use vtop().
+        '''
+        pde_value = self.get_pde(vaddr)
+        if not self.pde_entry_present(pde_value):
+            return None
 
+        if self.page_size_flag(pde_value):
+            return self.get_four_meg_paddr(vaddr, pde_value)
+
+        pte_value = self.get_pte(vaddr, pde_value)
+        if not self.pte_entry_present(pte_value):
+            return None
+
+        return self.get_phys_addr(vaddr, pte_value)
 
     def read_long_phys(self, addr):
         '''
@@ -222,6 +404,15 @@ class IA32PagedMemory(addrspace.PagedReader):
         return struct.unpack('<I', string)[0]
 
     def get_available_addresses(self, start=0):
+        """Enumerate all valid memory ranges from the page map.
+
+        Yields:
+          tuples of (starting virtual address, physical address, size) for
+          runs of contiguous pages.
+        """
+        return self.get_page_map().ranges(start)
+
+    def walk_available_addresses(self, start=0):
         """Enumerate all valid memory ranges.
 
         Yields:
@@ -368,35 +559,29 @@ class IA32PagedMemoryPae(IA32PagedMemory):
 
         return (pte & 0xffffffffff000) | (vaddr & 0xfff)
 
-    def vtop(self, vaddr):
+    def walk_page_tables(self, vaddr):
         '''
-        Translates virtual addresses into physical offsets.
-        The function returns either None (no valid mapping)
-        or the offset in physical memory where the address maps.
-        '''
-        try:
-            return self._tlb.Get(vaddr)
-        except KeyError:
-            pdpte = self.get_pdpte(vaddr)
-            if not self.pdpte_entry_present(pdpte):
-                # Add support for paged out PDPTE
-                # Insert buffalo here!
-                return None
+        Translates a virtual address by walking the page tables.
 
-            pde = self.get_pde(vaddr, pdpte)
-            if not self.pde_entry_present(pde):
-                # Add support for paged out PDE
-                return None
+        This is not cached - callers should normally use vtop().
+        '''
+        pdpte = self.get_pdpte(vaddr)
+        if not self.pdpte_entry_present(pdpte):
+            # Add support for paged out PDPTE
+            # Insert buffalo here!
+            return None
 
-            if self.page_size_flag(pde):
-                return self.get_two_meg_paddr(vaddr, pde)
+        pde = self.get_pde(vaddr, pdpte)
+        if not self.pde_entry_present(pde):
+            # Add support for paged out PDE
+            return None
 
-            pte = self.get_pte(vaddr, pde)
+        if self.page_size_flag(pde):
+            return self.get_two_meg_paddr(vaddr, pde)
 
-            res = self.get_phys_addr(vaddr, pte)
+        pte = self.get_pte(vaddr, pde)
 
-            self._tlb.Put(vaddr, res)
-            return res
+        return self.get_phys_addr(vaddr, pte)
 
     def read_long_long_phys(self, addr):
         '''
@@ -412,7 +597,7 @@ class IA32PagedMemoryPae(IA32PagedMemory):
 
             return result
 
-    def get_available_addresses(self, start=0):
+    def walk_available_addresses(self, start=0):
         """A generator of address, length tuple for all valid memory regions."""
         # Pages that hold PDEs and PTEs are 0x1000 bytes each.
         # Each PDE and PTE is eight bytes. Thus there are 0x1000 / 8 = 0x200
@@ -0,0 +1,125 @@
+import array
+import struct
+import unittest
+
+from rekall import addrspace
+from rekall import session
+from rekall import testlib
+from rekall.plugins.addrspaces import amd64
+from rekall.plugins.addrspaces import intel
+
+
+class ReadCountingAddressSpace(addrspace.BufferAddressSpace):
+    """A buffer which counts the number of reads made to it."""
+
+    def __init__(self, **kwargs):
+        super(ReadCountingAddressSpace, self).__init__(**kwargs)
+        self.reads = 0
+
+    def read(self, addr, length):
+        self.reads += 1
+        return super(ReadCountingAddressSpace, self).read(addr, length)
+
+
+class TLBTest(testlib.RekallBaseUnitTestCase):
+    """Test the TLB in the paged address spaces."""
+
+    def setUp(self):
+        self.session = session.Session()
+
+        # Map vaddr 0x1000-0x3000 -> paddr 0x5000-0x7000 and vaddr 0x4000 ->
+        # paddr 0x5000, with the page tables at 0x1000 (PML4), 0x2000 (PDPT),
+        # 0x3000 (PD), 0x4000 (PT).
+        data = bytearray(0x7000)
+        for table, entry in ((0x1000, 0x2001), (0x2000, 0x3001),
+                             (0x3000, 0x4001), (0x4008, 0x5001),
+                             (0x4010, 0x6001), (0x4020, 0x5001)):
+            data[table:table+8] = struct.pack("<Q", entry)
+
+        data[0x5000:0x5005] = "hello"
+        self.base = ReadCountingAddressSpace(
+            data=str(data), session=self.session)
+        self.address_space = amd64.AMD64PagedMemory(
+            base=self.base, dtb=0x1000, session=self.session)
+
+    def testTranslationsAreCached(self):
+        self.assertEqual(self.address_space.vtop(0x1010), 0x5010)
+        reads = self.base.reads
+
+        # Any address in the same page is served from the TLB.
+        self.assertEqual(self.address_space.vtop(0x1FFF), 0x5FFF)
+        self.assertEqual(self.address_space.read(0x1000, 5), "hello")
+        self.assertEqual(self.base.reads, reads + 1)
+
+        # Invalid pages are cached too.
+        self.assertEqual(self.address_space.vtop(0x3000), None)
+        reads = self.base.reads
+        self.assertEqual(self.address_space.vtop(0x3123), None)
+        self.assertEqual(self.base.reads, reads)
+
+        stats = self.address_space.tlb_stats()
+        self.assertEqual(stats["misses"], 2)
+        self.assertEqual(stats["hits"], 3)
+
+    def testPageMap(self):
+        # Adjacent pages are coalesced.
+        self.assertEqual(list(self.address_space.get_available_addresses()),
+                         [(0x1000, 0x5000, 0x2000), (0x4000, 0x5000, 0x1000)])
+
+        self.assertEqual(
+            list(self.address_space.get_available_addresses(start=0x3000)),
+            [(0x4000, 0x5000, 0x1000)])
+
+        # Once the page map is built, translation and reads do not need to
+        # touch the page tables.
+        reads = self.base.reads
+        self.assertEqual(self.address_space.vtop(0x2010), 0x6010)
+        self.assertEqual(self.address_space.vtop(0x4000), 0x5000)
+        self.assertEqual(self.address_space.read(0x1000, 0x2000),
+                         "hello" + "\x00" * 0x1FFB)
+        self.assertEqual(self.base.reads, reads + 1)
+
+        # The page map is shared by address spaces using the same DTB.
+        other_as = amd64.AMD64PagedMemory(
+            base=self.base, dtb=0x1000, session=self.session)
+        reads = self.base.reads
+        list(other_as.get_available_addresses())
+        self.assertEqual(self.base.reads, reads)
+
+    def testPageMapColumns(self):
+        page_map = self.address_space.get_page_map()
+        self.assertEqual(len(page_map), 2)
+        for column in (page_map.vaddrs, page_map.paddrs, page_map.lengths):
+            self.assertTrue(isinstance(column, array.array))
+
+        # High kernel addresses survive the round trip.
+        page_map = intel.PageMap([(0xfffff80000000000, 0x1000, 0x1000)])
+        self.assertEqual(page_map.vtop(0xfffff80000000010), 0x1010)
+        self.assertEqual(list(page_map.ranges()),
+                         [(0xfffff80000000000, 0x1000, 0x1000)])
+
+    def testLivePageMap(self):
+        self.base.is_live = lambda: True
+        self.assertEqual(list(self.address_space.get_available_addresses()),
+                         [(0x1000, 0x5000, 0x2000), (0x4000, 0x5000, 0x1000)])
+
+        # Live page maps are not kept around.
+        self.assertFalse(self.session.GetParameter("page_maps"))
+        self.assertEqual(self.address_space.vtop(0x4000), 0x5000)
+
+        # Remap vaddr 0x4000 -> paddr 0x6000. The next run sees the change.
+        self.base.write(0x4020, struct.pack("<Q", 0x6001))
+        self.assertEqual(list(self.address_space.get_available_addresses()),
+                         [(0x1000, 0x5000, 0x2000), (0x4000, 0x6000, 0x1000)])
+        self.assertEqual(self.address_space.vtop(0x4000), 0x6000)
+
+    def testDTBChangeFlushesTLB(self):
+        self.assertEqual(self.address_space.vtop(0x1000), 0x5000)
+
+        # The new page tables do not map anything.
+        self.address_space.dtb = 0
+        self.assertEqual(self.address_space.vtop(0x1000), None)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -43,12 +43,15 @@ class MACHOCoreDump(addrspace.RunBasedAddressSpace):
         # Make sure the file is marked as MH_CORE here.
         # self.as_assert(self.header.filetype == "MH_CORE")
 
+        runs = []
         for segment in self.header.segments:
             # We only map segments into memory.
             if segment.cmd == "LC_SEGMENT_64":
-                self.runs.insert(
+                runs.append(
                     (segment.vmaddr, segment.fileoff, segment.filesize))
 
+        self.set_runs(runs)
+
     def check_file(self):
         """Check for a valid MACH-O file."""
         self.as_assert(self.base,
@@ -80,6 +80,13 @@ class MmapFileAddressSpace(addrspace.BaseAddressSpace):
 
         return result + "\x00" * (length - len(result))
 
+    def read_buffer(self, addr, length):
+        # Refer directly to the mapped file instead of copying it.
+        if addr != None and 0 <= addr and addr + length <= self.fsize:
+            return buffer(self.map, addr, length)
+
+        return self.read(addr, length)
+
     def get_available_addresses(self):
         # TODO: Explain why this is always fsize - 1?
         yield (0, 0, self.fsize - 1)
@@ -25,8 +25,9 @@
 
 """ These are standard address spaces supported by Rekall Memory Forensics """
 import StringIO
-import struct
 import os
+import stat
+import struct
 
 from rekall import addrspace
 from rekall import config
@@ -133,6 +134,25 @@ class FileAddressSpace(FDAddressSpace):
         super(FileAddressSpace, self).__init__(
             fhandle=fhandle, session=session, **kwargs)
 
+    def is_live(self):
+        # Devices (e.g. /dev/pmem) expose the memory of the running system.
+        try:
+            return not stat.S_ISREG(os.stat(self.fname).st_mode)
+        except OSError:
+            return False
+
+    def reopen(self):
+        """Opens our own handle to the file.
+
+        Forked processes share the file offset of their parent's handle, so
+        they must reopen the file before reading from it concurrently.
+        """
+        self.fhandle.close()
+        self.fhandle = open(self.fname, self.mode)
+
+    def after_fork(self):
+        self.reopen()
+
 
 class GlobalOffsetAddressSpace(addrspace.BaseAddressSpace):
     """An address space to add a constant offset."""
@@ -63,8 +63,9 @@ class VMemAddressSpace(addrspace.RunBasedAddressSpace):
         file_offsets = self.header.GetTags("memory", "regionPageNum")
         lengths = self.header.GetTags("memory", "regionSize")
 
-        for v, p, l in zip(virtual_offsets, file_offsets, lengths):
-            self.runs.insert((v * 0x1000, p * 0x1000, l * 0x1000))
+        self.set_runs([(v * 0x1000, p * 0x1000, l * 0x1000)
+                       for v, p, l in zip(
+                           virtual_offsets, file_offsets, lengths)])
 
 
 class VMSSAddressSpace(addrspace.RunBasedAddressSpace):
@@ -94,13 +95,12 @@ class VMSSAddressSpace(addrspace.RunBasedAddressSpace):
             if not mem_regions:
                 raise IOError("Unable to locate mem region tag in VMSS file.")
 
-            self.runs.insert(
-                (0, mem_regions[0].obj_offset, mem_regions[0].length))
+            self.set_runs(
+                [(0, mem_regions[0].obj_offset, mem_regions[0].length)])
         else:
-            for v, l, m in zip(
-                    virtual_offsets, lengths, mem_regions):
-                self.runs.insert(
-                    (v * 0x1000, m.obj_offset, l * 0x1000))
+            self.set_runs([(v * 0x1000, m.obj_offset, l * 0x1000)
+                           for v, l, m in zip(
+                               virtual_offsets, lengths, mem_regions)])
 
 
 class _VMWARE_HEADER(obj.Struct):
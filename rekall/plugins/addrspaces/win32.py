@@ -76,12 +76,16 @@ class Win32FileAddressSpace(addrspace.CachingAddressSpaceMixIn,
             try:
                 self.ParseMemoryRuns()
             except Exception:
-                self.runs.insert((0, 0, 2**63))
+                self.set_runs([(0, 0, 2**63)])
 
         else:
             # The file is just a regular file, we open for reading.
             self._OpenFileForRead(path)
-            self.runs.insert((0, 0, win32file.GetFileSize(self.fhandle)))
+            self.set_runs([(0, 0, win32file.GetFileSize(self.fhandle))])
+
+    def is_live(self):
+        # Devices (e.g. the winpmem driver) expose the running system.
+        return self.fname.startswith("\\\\")
 
     def _OpenFileForRead(self, path):
         try:
@@ -132,9 +136,12 @@ class Win32FileAddressSpace(addrspace.CachingAddressSpaceMixIn,
 
         offset = struct.calcsize(fmt_string)
 
+        runs = []
         for x in xrange(self.memory_parameters["NumberOfRuns"]):
             start, length = struct.unpack_from("QQ", result, x * 16 + offset)
-            self.runs.insert((start, start, length))
+            runs.append((start, start, length))
+
+        self.set_runs(runs)
 
         # Get the kernel base directly from the winpmem driver if that is
         # available.
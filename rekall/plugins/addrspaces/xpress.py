@@ -32,13 +32,29 @@
 
 #pylint: disable-msg=C0111
 
+import struct
+
 from struct import unpack
 from struct import error as StructError
 
+# Xpress blocks in hibernation files decompress to at most 16 pages.
+XPRESS_BLOCK_SIZE = 0x10000
+
+# The largest back reference distance which can be encoded.
+XPRESS_MAX_OFFSET = 0x2000
+
+# The largest match length which can be encoded.
+XPRESS_MAX_LENGTH = 0xFFFF + 3
+
+
 def recombine(outbuf):
     return "".join(outbuf[k] for k in sorted(outbuf.keys()))
 
-def xpress_decode(inputBuffer):
+def xpress_decode_reference(inputBuffer):
+    """The original, straightforward decoder.
+
+    This is very slow and only kept to verify and benchmark xpress_decode().
+    """
     outputBuffer = {}
     outputIndex = 0
     inputIndex = 0
@@ -127,6 +143,183 @@ def xpress_decode(inputBuffer):
 
     return recombine(outputBuffer)
 
+def xpress_decode(inputBuffer, output_size=XPRESS_BLOCK_SIZE):
+    """Decompress an xpress block.
+
+    The output is written into a preallocated bytearray which is only grown if
+    the block decompresses to more than output_size bytes. Back references are
+    copied as slices, and overlapping back references (which repeat the last
+    few bytes) are expanded by repeating the referenced pattern.
+
+    Like xpress_decode_reference(), decoding stops at the end of the input or
+    at the first truncated or invalid token.
+    """
+    data = bytearray(inputBuffer)
+    input_length = len(data)
+    output = bytearray(output_size)
+    output_index = 0
+    input_index = 0
+    indicator = indicator_bit = 0
+    nibble_index = None
+
+    while input_index < input_length:
+        if indicator_bit == 0:
+            if input_index + 4 > input_length:
+                break
+
+            indicator = (data[input_index] |
+                         data[input_index + 1] << 8 |
+                         data[input_index + 2] << 16 |
+                         data[input_index + 3] << 24)
+            input_index += 4
+            indicator_bit = 32
+
+        indicator_bit -= 1
+        if not indicator & (1 << indicator_bit):
+            # A literal byte.
+            if input_index >= input_length:
+                break
+
+            if output_index >= len(output):
+                output.extend(bytearray(len(output) or XPRESS_BLOCK_SIZE))
+
+            output[output_index] = data[input_index]
+            input_index += 1
+            output_index += 1
+            continue
+
+        # A back reference: See xpress_decode_reference() for a description of
+        # the length encoding.
+        if input_index + 2 > input_length:
+            break
+
+        length = data[input_index] | data[input_index + 1] << 8
+        input_index += 2
+        offset = (length >> 3) + 1
+        length &= 7
+
+        try:
+            if length == 7:
+                if nibble_index is None:
+                    nibble_index = input_index
+                    length = data[input_index] & 0xF
+                    input_index += 1
+                else:
+                    length = data[nibble_index] >> 4
+                    nibble_index = None
+
+                if length == 15:
+                    length = data[input_index]
+                    input_index += 1
+                    if length == 255:
+                        length = (data[input_index] |
+                                  data[input_index + 1] << 8) - (15 + 7)
+                        input_index += 2
+
+                    length += 15
+                length += 7
+        except IndexError:
+            break
+
+        length += 3
+
+        start = output_index - offset
+        if start < 0:
+            break
+
+        end = output_index + length
+        if end > len(output):
+            output.extend(bytearray(max(end - len(output), len(output))))
+
+        if offset >= length:
+            output[output_index:end] = output[start:start + length]
+        else:
+            # The reference overlaps the output, i.e. it repeats the last
+            # offset bytes.
+            pattern = output[start:output_index]
+            output[output_index:end] = (
+                pattern * (length // offset + 1))[:length]
+
+        output_index = end
+
+    return str(output[:output_index])
+
+def xpress_encode(data):
+    """A simple greedy xpress compressor.
+
+    This is not used for analysis, but is useful to produce test data for the
+    decoder.
+    """
+    output = bytearray(4)
+    indicator_offset = 0
+    indicator = 0
+    indicator_bit = 32
+    nibble_index = None
+    positions = {}
+    index = 0
+
+    while index < len(data):
+        if indicator_bit == 0:
+            struct.pack_into("<L", output, indicator_offset, indicator)
+            indicator_offset = len(output)
+            output.extend(bytearray(4))
+            indicator = 0
+            indicator_bit = 32
+
+        indicator_bit -= 1
+
+        key = data[index:index + 3]
+        candidate = positions.get(key)
+        positions[key] = index
+
+        match_length = 0
+        if (candidate is not None and len(key) == 3 and
+                index - candidate <= XPRESS_MAX_OFFSET):
+            match_length = 3
+            while (index + match_length < len(data) and
+                   match_length < XPRESS_MAX_LENGTH and
+                   data[candidate + match_length] ==
+                   data[index + match_length]):
+                match_length += 1
+
+        if match_length < 3:
+            output.append(data[index])
+            index += 1
+            continue
+
+        indicator |= 1 << indicator_bit
+        offset = (index - candidate - 1) << 3
+        length = match_length - 3
+        if length < 7:
+            output.extend(struct.pack("<H", offset | length))
+        else:
+            output.extend(struct.pack("<H", offset | 7))
+            length -= 7
+            nibble = min(length, 15)
+            if nibble_index is None:
+                nibble_index = len(output)
+                output.append(nibble)
+            else:
+                output[nibble_index] |= nibble << 4
+                nibble_index = None
+
+            if length >= 15:
+                length -= 15
+                if length < 255:
+                    output.append(length)
+                else:
+                    output.append(255)
+                    output.extend(struct.pack("<H", match_length - 3))
+
+        for i in xrange(index + 1, index + match_length):
+            positions[data[i:i + 3]] = i
+
+        index += match_length
+
+    struct.pack_into("<L", output, indicator_offset, indicator)
+
+    return str(output)
+
 try:
     import pyxpress #pylint: disable-msg=F0401
 
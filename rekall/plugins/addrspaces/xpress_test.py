@@ -0,0 +1,52 @@
+import random
+import unittest
+
+from rekall import testlib
+from rekall.plugins.addrspaces import xpress
+
+
+class XpressTest(testlib.RekallBaseUnitTestCase):
+    """Test the xpress decoder."""
+
+    def _MakeData(self, rand):
+        parts = []
+        for _ in range(rand.randint(0, 40)):
+            kind = rand.random()
+            if kind < 0.3:
+                # Incompressible literals.
+                parts.append("".join(chr(rand.randint(0, 255))
+                                     for _ in range(rand.randint(0, 50))))
+            elif kind < 0.6:
+                # Long runs need the extended length encodings.
+                parts.append(rand.choice("ab\x00") * rand.randint(1, 5000))
+            else:
+                # Short repeating patterns give overlapping back references.
+                parts.append("abcabd"[:rand.randint(1, 6)] *
+                             rand.randint(1, 300))
+
+        return "".join(parts)
+
+    def testDecode(self):
+        rand = random.Random(1)
+        for _ in range(100):
+            data = self._MakeData(rand)
+            compressed = xpress.xpress_encode(data)
+
+            self.assertEqual(xpress.xpress_decode(compressed), data)
+            self.assertEqual(xpress.xpress_decode_reference(compressed), data)
+
+    def testTruncatedInput(self):
+        rand = random.Random(2)
+        for _ in range(100):
+            compressed = xpress.xpress_encode(self._MakeData(rand))
+            truncated = compressed[:rand.randint(0, len(compressed))]
+            try:
+                expected = xpress.xpress_decode_reference(truncated)
+            except IndexError:
+                continue
+
+            self.assertEqual(xpress.xpress_decode(truncated), expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -222,6 +222,16 @@ class AddressResolverMixin(object):
         _ = address
         return (0xFFFFFFFFFF, "")
 
+    def resolve_many(self, addresses):
+        """Resolves many addresses at once.
+
+        Returns a list of (nearest_offset, full_name) tuples, as
+        get_nearest_constant_by_address() would, in the order of addresses.
+        Implementations may override this to resolve all the addresses in a
+        single pass.
+        """
+        return [self.get_nearest_constant_by_address(x) for x in addresses]
+
     def search_symbol(self, pattern):
         """Searches symbols for the pattern.
 
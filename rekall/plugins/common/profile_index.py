@@ -31,16 +31,92 @@ __author__ = (
     "Adam Sindelar <adamsh@google.com>",
 )
 
+import collections
 import logging
 
 from rekall import obj
 
 
+def BuildOffsetIndex(index):
+    """Build an inverted index of comparison points from the profile index.
+
+    The profile index maps each profile to its comparison points. The offset
+    index maps each comparison point offset to the possible values at that
+    offset, and each value to the profiles which expect it.
+
+    The offsets are ordered so those referenced by the most profiles, with the
+    most distinct values, come first. These discriminate best between profiles,
+    so checking them first narrows down the candidate profiles quickly.
+
+    Returns:
+      A list of [offset, {hex value: [profile, ...]}] pairs.
+    """
+    offsets = {}
+    for profile, symbols in index.iteritems():
+        for offset, possible_values in symbols:
+            if isinstance(possible_values, basestring):
+                possible_values = [possible_values]
+
+            values = offsets.setdefault(offset, {})
+            for value in possible_values:
+                values.setdefault(value, []).append(profile)
+
+    def _Order(item):
+        offset, values = item
+        profiles = set()
+        for value_profiles in values.itervalues():
+            profiles.update(value_profiles)
+
+        return (-len(profiles), -len(values), offset)
+
+    result = []
+    for offset, values in sorted(offsets.iteritems(), key=_Order):
+        for value_profiles in values.itervalues():
+            value_profiles.sort()
+
+        result.append([offset, values])
+
+    return result
+
+
+class ComparisonPoint(object):
+    """A single offset to check, with the profiles expecting each value."""
+
+    def __init__(self, offset, values):
+        self.offset = offset
+        self.values = dict((value.decode("hex"), frozenset(profiles))
+                           for value, profiles in values.iteritems())
+        self.profiles = frozenset().union(*self.values.values())
+        self.length = max(len(x) for x in self.values)
+
+    def Check(self, address_space, image_base):
+        """Read the comparison point once.
+
+        Returns:
+          The set of profiles which match, or None if the offset is not mapped.
+        """
+        # If the offset is not mapped in we can not compare it.
+        offset_to_check = image_base + self.offset
+        if address_space.vtop(offset_to_check) == None:
+            return
+
+        data = address_space.read(offset_to_check, self.length)
+        result = set()
+        for value, profiles in self.values.iteritems():
+            if data.startswith(value):
+                result.update(profiles)
+
+        return result
+
+
 class Index(obj.Profile):
     """A profile which contains an index to locate other profiles."""
     index = None
+    offset_index = None
     base_offset = 0
 
+    _comparison_points = None
+
     PERFECT_MATCH = 1.0
     GOOD_MATCH = 0.75
 
@@ -48,94 +124,143 @@ class Index(obj.Profile):
         super(Index, self)._SetupProfileFromData(data)
         self.index = data.get("$INDEX")
 
+        # Older indexes do not have the offset index.
+        self.offset_index = data.get("$OFFSET_INDEX")
+        if self.offset_index is None and self.index:
+            self.offset_index = BuildOffsetIndex(self.index)
+
+        self._comparison_points = None
+
     def copy(self):
         result = super(Index, self).copy()
         result.index = self.index.copy()
+        result.offset_index = self.offset_index
 
         return result
 
-    def _TestSymbols(self, address_space, offset, possible_values):
-        """Match any of the possible_values at offset.
+    def _GetComparisonPoints(self):
+        if self._comparison_points is None:
+            self._comparison_points = [
+                ComparisonPoint(offset, values)
+                for offset, values in self.offset_index or []]
 
-        Return True if there is a match.
-        """
-        for value in possible_values:
-            value = value.decode("hex")
-            data = address_space.read(offset, len(value))
-            if value == data:
-                return data
-
-    def _TestProfile(self, address_space, image_base, profile, symbols,
-                     minimal_match=1):
-        """Match _all_ the symbols against this data."""
-        count_matched = 0
-        count_unmatched = 0
+            # The total number of comparison points for each profile.
+            self._profile_points = collections.Counter()
+            for point in self._comparison_points:
+                self._profile_points.update(point.profiles)
 
-        for offset, possible_values in symbols:
-            # The possible_values can be a single string which means there is
-            # only one option. If it is a list, then any of the symbols may
-            # match at this offset to be considered a match.
-            if isinstance(possible_values, basestring):
-                possible_values = [possible_values]
+        return self._comparison_points
 
-            # If the offset is not mapped in we can not compare it. Skip it.
-            offset_to_check = image_base + offset
-            if address_space.vtop(offset_to_check) == None:
-                continue
+    def _CheckPoint(self, point, address_space, image_base, matched,
+                    unmatched):
+        """Check the comparison point and update the match counters.
 
-            match = self._TestSymbols(
-                address_space=address_space,
-                offset=offset_to_check,
-                possible_values=possible_values)
+        Returns:
+          The set of profiles which did not match.
+        """
+        hits = point.Check(address_space, image_base)
+        if hits is None:
+            return set()
 
-            if match:
-                logging.debug(
-                    "%s matched offset %#x+%#x=%#x (%r)",
-                    profile, offset, image_base, offset+image_base, match)
-                count_matched += 1
+        misses = point.profiles - hits
+        matched.update(hits)
+        unmatched.update(misses)
 
-            else:
-                # FIXME: We get here if the comparison point does not match -
-                # does it make sense to allow some points to not match? Should
-                # we consider these a failure to match?
-                count_unmatched += 1
+        return misses
+
+    def _MatchRatio(self, profile, matched, unmatched, minimal_match):
+        count_matched = matched[profile]
 
         # Require at least this many comparison points to be matched.
-        if count_matched < minimal_match:
+        if count_matched < minimal_match or count_matched == 0:
             return 0
 
-        if count_matched > 0:
-            logging.debug(
-                "%s matches %d/%d comparison points",
-                profile, count_matched, count_matched + count_unmatched)
-
-            return float(count_matched) / (count_matched + count_unmatched)
+        count_unmatched = unmatched[profile]
+        logging.debug(
+            "%s matches %d/%d comparison points",
+            profile, count_matched, count_matched + count_unmatched)
 
-        return 0
+        return float(count_matched) / (count_matched + count_unmatched)
 
     def IndexHits(self, image_base, address_space=None, minimal_match=1):
         if address_space == None:
             address_space = self.session.GetParameter("default_address_space")
 
-        for profile, symbols in self.index.iteritems():
-            match = self._TestProfile(
-                address_space=address_space,
-                image_base=image_base,
-                profile=profile,
-                minimal_match=minimal_match,
-                symbols=symbols)
+        # Each distinct offset is read only once for all the profiles.
+        matched = collections.Counter()
+        unmatched = collections.Counter()
+        for point in self._GetComparisonPoints():
+            self._CheckPoint(point, address_space, image_base, matched,
+                             unmatched)
 
-            yield match, profile
+        for profile in self.index:
+            yield self._MatchRatio(
+                profile, matched, unmatched, minimal_match), profile
 
     def LookupIndex(self, image_base, address_space=None, minimal_match=1):
+        """Find the profiles which match the data at image_base.
+
+        Perfect matches are yielded first, then partial matches in order of
+        accuracy.
+
+        The comparison points are checked in order, and a profile stops being a
+        candidate for a perfect match as soon as one of its points does not
+        match. Points which do not concern any remaining candidate are skipped,
+        so once only one candidate is left, only its own points are read. A
+        perfect match is yielded as soon as all its points are checked. The
+        remaining points are only read if the caller asks for more results.
+        """
+        if address_space == None:
+            address_space = self.session.GetParameter("default_address_space")
+
+        points = list(self._GetComparisonPoints())
+        profile_points = self._profile_points
+
+        matched = collections.Counter()
+        unmatched = collections.Counter()
+        checked = collections.Counter()
+        candidates = set(profile_points)
+        perfect_matches = set()
+
+        while candidates:
+            # The next point which can distinguish between the candidates.
+            for i, point in enumerate(points):
+                if not candidates.isdisjoint(point.profiles):
+                    break
+            else:
+                break
+
+            points.pop(i)
+            candidates -= self._CheckPoint(
+                point, address_space, image_base, matched, unmatched)
+
+            checked.update(point.profiles)
+            for profile in candidates & point.profiles:
+                if checked[profile] < profile_points[profile]:
+                    continue
+
+                # All the points for this profile have been checked.
+                candidates.discard(profile)
+                if self._MatchRatio(profile, matched, unmatched,
+                                    minimal_match) == self.PERFECT_MATCH:
+                    perfect_matches.add(profile)
+
+                    # Yield perfect matches right away.
+                    yield (profile, self.PERFECT_MATCH)
+
+        # Check the rest of the points to rank the partial matches.
+        for point in points:
+            self._CheckPoint(point, address_space, image_base, matched,
+                             unmatched)
+
         partial_matches = []
-        for match, profile in self.IndexHits(image_base, address_space,
-                                             minimal_match=minimal_match):
-            if match == self.PERFECT_MATCH:
-                # Yield perfect matches right away.
-                yield (profile, self.PERFECT_MATCH)
+        for profile in profile_points:
+            if profile in perfect_matches:
+                continue
 
-            elif match > 0:
+            match = self._MatchRatio(profile, matched, unmatched,
+                                     minimal_match)
+            if match > 0:
                 # Imperfect matches will be saved and returned in order of
                 # accuracy.
                 partial_matches.append((match, profile))
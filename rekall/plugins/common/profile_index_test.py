@@ -0,0 +1,76 @@
+import unittest
+
+from rekall import addrspace
+from rekall import obj
+from rekall import session
+from rekall import testlib
+from rekall.plugins.common import profile_index
+
+
+class IndexReadCountingAddressSpace(addrspace.BufferAddressSpace):
+    """A buffer which records the offsets read from it."""
+
+    def __init__(self, **kwargs):
+        super(IndexReadCountingAddressSpace, self).__init__(**kwargs)
+        self.offsets_read = []
+
+    def read(self, addr, length):
+        self.offsets_read.append(addr)
+        return super(IndexReadCountingAddressSpace, self).read(addr, length)
+
+
+class IndexTest(testlib.RekallBaseUnitTestCase):
+    """Test the profile index lookup."""
+
+    INDEX = {
+        "A": [[0, "61"], [4, "6262"], [8, "63"]],
+        "B": [[0, "61"], [4, "6363"], [8, "63"]],
+        "C": [[0, "7a"], [4, ["6262", "6464"]]],
+        "D": [[0, "61"], [4, "6262"], [12, "64"]],
+    }
+
+    def setUp(self):
+        self.session = session.Session()
+        self.index = obj.Profile.LoadProfileFromData({
+            "$METADATA": dict(ProfileClass="Index", Type="Profile"),
+            "$INDEX": self.INDEX}, session=self.session, name="index")
+
+    def _MakeAddressSpace(self, data):
+        return IndexReadCountingAddressSpace(data=data, session=self.session)
+
+    def testBuildOffsetIndex(self):
+        offset_index = profile_index.BuildOffsetIndex(self.INDEX)
+
+        # Offsets shared by the most profiles, with the most values, come first.
+        self.assertEqual([x[0] for x in offset_index], [4, 0, 8, 12])
+        self.assertEqual(offset_index[0][1], {
+            "6262": ["A", "C", "D"], "6363": ["B"], "6464": ["C"]})
+
+    def testLookupIndex(self):
+        address_space = self._MakeAddressSpace("a...bb..c...x...")
+        results = list(self.index.LookupIndex(
+            0, address_space=address_space))
+
+        self.assertEqual(results[0], ("A", 1.0))
+        self.assertEqual(sorted(results[1:]), [
+            ("B", 2.0 / 3), ("C", 0.5), ("D", 2.0 / 3)])
+
+        # Each offset was only read once.
+        self.assertEqual(sorted(address_space.offsets_read), [0, 4, 8, 12])
+
+        # The results agree with IndexHits.
+        hits = dict((profile, match) for match, profile in
+                    self.index.IndexHits(0, address_space=address_space))
+        self.assertEqual(hits, dict(A=1.0, B=2.0 / 3, C=0.5, D=2.0 / 3))
+
+    def testLookupStopsEarly(self):
+        address_space = self._MakeAddressSpace("z...dd..c...x...")
+        lookup = self.index.LookupIndex(0, address_space=address_space)
+        self.assertEqual(lookup.next(), ("C", 1.0))
+
+        # The offsets which C does not use were never read.
+        self.assertEqual(sorted(address_space.offsets_read), [0, 4])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -377,6 +377,8 @@ class LoadAddressSpace(plugin.Command):
                 self.session.physical_address_space = self.AddressSpaceFactory(
                     specification=self.pas_spec)
 
+            self.session.physical_address_space = self.CacheAddressSpace(
+                self.session.physical_address_space)
 
             return self.session.physical_address_space
 
@@ -497,6 +499,28 @@ class LoadAddressSpace(plugin.Command):
 
         return base_as
 
+    def CacheAddressSpace(self, address_space):
+        """Stacks a read cache over the address space if required.
+
+        Live memory and writable images are not cached, since their contents
+        may change.
+        """
+        if (address_space is None or
+                not self.session.GetParameter("cache_size") or
+                isinstance(address_space,
+                           addrspace.CachingAddressSpaceMixIn)):
+            return address_space
+
+        base = address_space
+        while base is not None:
+            if base.is_live() or base.writeable:
+                return address_space
+
+            base = base.base
+
+        return addrspace.CachingAddressSpace(
+            base=address_space, session=self.session)
+
     def AddressSpaceFactory(self, specification='', **kwargs):
         """Build the address space from the specification.
 
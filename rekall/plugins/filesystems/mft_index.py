@@ -0,0 +1,438 @@
+# Rekall Memory Forensics
+# Copyright 2014 Google Inc. All Rights Reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or (at
+# your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+#
+
+"""A bulk parser and name index for the NTFS Master File Table.
+
+Parsing each MFT record through the MFT_ENTRY Struct is convenient but slow. On
+volumes with millions of records, resolving paths or listing directories this
+way takes minutes. The MFTIndex decodes all the records from large sequential
+reads straight into compact arrays, and builds a parent -> children index with
+lower cased names for fast path lookups.
+
+Only the most commonly needed information is extracted: The record header, the
+$STANDARD_INFORMATION timestamps, all $FILE_NAME attributes and the unnamed
+$DATA stream's size and run list.
+"""
+import array
+import hashlib
+import logging
+import marshal
+import os
+import struct
+import zlib
+
+from rekall import config
+
+
+config.DeclareOption(
+    "--mft_index_cache", default=False, type="Boolean",
+    help="Cache the index of NTFS MFT records in the cache_dir, so later "
+    "sessions do not need to parse the MFT again.")
+
+# Attribute types we decode.
+STANDARD_INFORMATION = 0x10
+FILE_NAME = 0x30
+DATA = 0x80
+END_OF_ATTRIBUTES = 0xFFFFFFFF
+
+# MFT record flags.
+IN_USE = 1
+DIRECTORY = 2
+
+# The $FILE_NAME name_type for DOS 8.3 names.
+DOS_NAME = 2
+
+# The MFT entry of the root directory.
+ROOT = 5
+
+# The number of bytes read from the MFT at once.
+BATCH_SIZE = 1024 * 1024
+
+# The number of MFT records hashed into the fingerprint of a cached index.
+FINGERPRINT_SAMPLES = 64
+
+MFT_REFERENCE_MASK = 0xFFFFFFFFFFFF
+
+# The array typecode for 64 bit values. Where longs are only 32 bits, doubles
+# still represent sizes and MFT references exactly.
+QWORD = "L" if array.array("L").itemsize == 8 else "d"
+
+# The array typecode for FILETIME values (signed, as read by WinFileTime).
+FILETIME = "l" if array.array("l").itemsize == 8 else "d"
+
+
+class MFTIndex(object):
+    """Compact arrays describing all the MFT records.
+
+    Record columns are indexed by MFT entry number. File name columns hold one
+    row per $FILE_NAME attribute (a record has several names when it is hard
+    linked or has a DOS name). Timestamps are stored as the raw FILETIME values,
+    so they can be rendered with WinFileTime just like the MFT_ENTRY fields.
+    """
+
+    VERSION = 2
+
+    RECORD_COLUMNS = [
+        ("sequence", "H"), ("flags", "H"), ("data_size", QWORD),
+        ("created", FILETIME), ("file_modified", FILETIME),
+        ("mft_modified", FILETIME), ("file_accessed", FILETIME)]
+
+    NAME_COLUMNS = [
+        ("name_record", "I"), ("name_parent", QWORD), ("name_type", "B"),
+        ("name_created", FILETIME), ("name_file_modified", FILETIME),
+        ("name_mft_modified", FILETIME), ("name_file_accessed", FILETIME),
+        ("name_size", QWORD)]
+
+    def __init__(self):
+        for name, typecode in self.RECORD_COLUMNS + self.NAME_COLUMNS:
+            setattr(self, name, array.array(typecode))
+
+        self.names = []
+
+        # Maps MFT entry to the $DATA run list (only for non resident data).
+        self.run_lists = {}
+
+        self._BuildIndex()
+
+    def __len__(self):
+        return len(self.sequence)
+
+    def _BuildIndex(self):
+        """Build the parent -> children and name lookup indexes."""
+        # Maps a directory's MFT entry to its children's name rows.
+        self.children = {}
+
+        # Maps (parent, lower cased name) to the name row.
+        self.name_index = {}
+
+        # Maps each MFT entry to its name rows.
+        self.name_rows = {}
+
+        for row, (record, parent) in enumerate(zip(
+                self.name_record, map(int, self.name_parent))):
+            self.name_rows.setdefault(record, []).append(row)
+
+            # Only files which are not deleted can be found by name.
+            if record < len(self.flags) and self.flags[record] & IN_USE:
+                self.children.setdefault(parent, []).append(row)
+                self.name_index[(parent, self.names[row].lower())] = row
+
+    def Lookup(self, parent, name):
+        """Returns the name row for name in the parent directory or None."""
+        return self.name_index.get((parent, name.lower()))
+
+    def ListDirectory(self, parent):
+        """Returns the name rows of the directory's children.
+
+        Like the directory's $I30 index, the rows are sorted by name and include
+        DOS names.
+        """
+        rows = [row for row in self.children.get(parent, [])
+                if self.name_record[row] != parent]
+
+        return sorted(rows, key=lambda row: self.names[row].upper())
+
+    def PreferredName(self, mft_entry):
+        """Returns the name row for the record, preferring Win32 names."""
+        result = None
+        for row in self.name_rows.get(mft_entry, []):
+            if self.name_type[row] != DOS_NAME:
+                return row
+
+            result = row
+
+        return result
+
+    def FullPath(self, mft_entry):
+        """Returns the path of the record from the root."""
+        result = []
+        seen = set()
+        while mft_entry != ROOT and mft_entry not in seen:
+            seen.add(mft_entry)
+            row = self.PreferredName(mft_entry)
+            if row is None:
+                break
+
+            result.append(self.names[row])
+            mft_entry = int(self.name_parent[row])
+
+        result.reverse()
+        return "/".join(result)
+
+    def Serialize(self):
+        columns = dict((name, getattr(self, name).tostring())
+                       for name, _ in self.RECORD_COLUMNS + self.NAME_COLUMNS)
+
+        return zlib.compress(marshal.dumps(dict(
+            version=self.VERSION, columns=columns, names=self.names,
+            run_lists=self.run_lists)))
+
+    @classmethod
+    def Deserialize(cls, data):
+        state = marshal.loads(zlib.decompress(data))
+        if state.get("version") != cls.VERSION:
+            raise ValueError("Unsupported index version.")
+
+        result = cls()
+        for name, _ in cls.RECORD_COLUMNS + cls.NAME_COLUMNS:
+            getattr(result, name).fromstring(state["columns"][name])
+
+        result.names = state["names"]
+        result.run_lists = state["run_lists"]
+        result._BuildIndex()  # pylint: disable=protected-access
+
+        return result
+
+
+def DecodeRunList(data, offset, end):
+    """Decode a run list into a list of (cluster, length) tuples.
+
+    Sparse runs have a cluster of None.
+    """
+    result = []
+    run_offset = 0
+    while offset < end:
+        header = data[offset]
+        if header == 0:
+            break
+
+        length_size = header & 0xF
+        offset_size = header >> 4
+        offset += 1
+
+        run_length = 0
+        for i in xrange(length_size):
+            run_length |= data[offset + i] << (8 * i)
+        offset += length_size
+
+        relative_offset = 0
+        for i in xrange(offset_size):
+            relative_offset |= data[offset + i] << (8 * i)
+        offset += offset_size
+
+        # Sign extend the relative offset.
+        if offset_size and relative_offset & (1 << (8 * offset_size - 1)):
+            relative_offset -= 1 << (8 * offset_size)
+
+        run_offset += relative_offset
+        if relative_offset == 0:
+            result.append((None, run_length))
+        else:
+            result.append((run_offset, run_length))
+
+    return result
+
+
+class MFTParser(object):
+    """Decodes MFT records in bulk into an MFTIndex."""
+
+    RECORD_HEADER = struct.Struct("<4sHHQHHHHIIQ")
+    ATTRIBUTE_HEADER = struct.Struct("<IIBBHHH")
+    RESIDENT_HEADER = struct.Struct("<IH")
+    NON_RESIDENT_HEADER = struct.Struct("<QQH6xQQQ")
+    STANDARD_INFORMATION = struct.Struct("<qqqq")
+    FILE_NAME = struct.Struct("<QqqqqQQIIBB")
+
+    def __init__(self, address_space, record_size, session=None):
+        self.address_space = address_space
+        self.record_size = record_size
+        self.session = session
+
+    def Parse(self):
+        """Parse all the records in the MFT and return an MFTIndex."""
+        index = MFTIndex()
+        end = self.address_space.end()
+        records_per_batch = max(1, BATCH_SIZE / self.record_size)
+
+        record = 0
+        for batch_offset in xrange(0, end, records_per_batch *
+                                   self.record_size):
+            if self.session:
+                self.session.report_progress(
+                    "Indexing MFT entry %d", record)
+
+            data = bytearray(self.address_space.read(
+                batch_offset, min(records_per_batch * self.record_size,
+                                  end - batch_offset)))
+
+            for offset in xrange(0, len(data) - self.record_size + 1,
+                                 self.record_size):
+                self._ParseRecord(index, record, data, offset)
+                record += 1
+
+        index._BuildIndex()  # pylint: disable=protected-access
+
+        return index
+
+    def _ApplyFixups(self, data, offset, fixup_offset, fixup_count):
+        fixup_offset += offset
+        magic = data[fixup_offset:fixup_offset + 2]
+        for i in xrange(1, fixup_count):
+            sector_end = offset + i * 512 - 2
+            if (sector_end + 2 > offset + self.record_size or
+                    data[sector_end:sector_end + 2] != magic):
+                return False
+
+            value_offset = fixup_offset + 2 * i
+            data[sector_end:sector_end + 2] = data[
+                value_offset:value_offset + 2]
+
+        return True
+
+    def _ParseRecord(self, index, record, data, offset):
+        (magic, fixup_offset, fixup_count, _, sequence, _, attribute_offset,
+         flags, used_size, _, base_record) = self.RECORD_HEADER.unpack_from(
+             data, offset)
+
+        index.sequence.append(sequence)
+        index.flags.append(0)
+        for name in ("data_size", "created", "file_modified", "mft_modified",
+                     "file_accessed"):
+            getattr(index, name).append(0)
+
+        if magic != "FILE" or not self._ApplyFixups(
+                data, offset, fixup_offset, fixup_count):
+            return
+
+        index.flags[record] = flags
+
+        # Extension records hold attributes of their base record.
+        owner = base_record & MFT_REFERENCE_MASK or record
+
+        end = offset + min(used_size, self.record_size)
+        attribute = offset + attribute_offset
+        while attribute + self.ATTRIBUTE_HEADER.size <= end:
+            (attribute_type, length, non_resident, name_length, _, _,
+             _) = self.ATTRIBUTE_HEADER.unpack_from(data, attribute)
+
+            if (attribute_type == END_OF_ATTRIBUTES or length == 0 or
+                    attribute + length > end):
+                break
+
+            if non_resident:
+                if attribute_type == DATA and name_length == 0:
+                    self._ParseNonResidentData(
+                        index, owner, data, attribute, attribute + length)
+
+            else:
+                content_size, content_offset = (
+                    self.RESIDENT_HEADER.unpack_from(data, attribute + 16))
+                content = attribute + content_offset
+
+                if (attribute_type == STANDARD_INFORMATION and
+                        owner == record and
+                        content + self.STANDARD_INFORMATION.size <= end):
+                    (index.created[record], index.file_modified[record],
+                     index.mft_modified[record], index.file_accessed[record]
+                    ) = self.STANDARD_INFORMATION.unpack_from(data, content)
+
+                elif (attribute_type == FILE_NAME and
+                      content + self.FILE_NAME.size <= end):
+                    self._ParseFileName(index, owner, data, content, end)
+
+                elif attribute_type == DATA and name_length == 0:
+                    self._SetDataSize(index, owner, content_size)
+
+            attribute += length
+
+    def _SetDataSize(self, index, record, size):
+        # Extension records may refer to records we have not parsed yet.
+        if record < len(index.data_size):
+            index.data_size[record] = size
+
+    def _ParseNonResidentData(self, index, owner, data, attribute, end):
+        (vcn_start, _, runlist_offset, _, actual_size,
+         _) = self.NON_RESIDENT_HEADER.unpack_from(data, attribute + 16)
+
+        if vcn_start == 0:
+            self._SetDataSize(index, owner, actual_size)
+
+        index.run_lists.setdefault(owner, []).extend(
+            DecodeRunList(data, attribute + runlist_offset, end))
+
+    def _ParseFileName(self, index, owner, data, content, end):
+        (parent, created, file_modified, mft_modified, file_accessed, _,
+         size, _, _, name_length, name_type) = self.FILE_NAME.unpack_from(
+             data, content)
+
+        name_offset = content + self.FILE_NAME.size
+        if name_offset + name_length * 2 > end:
+            return
+
+        index.name_record.append(owner)
+        index.name_parent.append(parent & MFT_REFERENCE_MASK)
+        index.name_type.append(name_type)
+        index.name_created.append(created)
+        index.name_file_modified.append(file_modified)
+        index.name_mft_modified.append(mft_modified)
+        index.name_file_accessed.append(file_accessed)
+        index.name_size.append(size)
+        index.names.append(
+            str(data[name_offset:name_offset + name_length * 2]).decode(
+                "utf-16-le", "ignore"))
+
+
+def Fingerprint(address_space, record_size):
+    """A fingerprint of the MFT which is fast to calculate.
+
+    Different acquisitions of the same volume usually have the same serial
+    number and MFT size, so we also hash a sample of the records.
+    """
+    end = address_space.end()
+    fingerprint = hashlib.sha1("%d:%d" % (end, record_size))
+
+    records = end / record_size
+    step = max(1, records / FINGERPRINT_SAMPLES)
+    for record in xrange(0, records, step):
+        fingerprint.update(address_space.read(record * record_size,
+                                              record_size))
+
+    return fingerprint.hexdigest()
+
+
+def LoadMFTIndex(session, address_space, record_size, serial):
+    """Returns the MFTIndex for the MFT in address_space.
+
+    If the mft_index_cache parameter is set, the index is cached in the
+    cache_dir, keyed by the volume serial number and a fingerprint of the MFT.
+    """
+    path = None
+    cache_dir = (session and session.GetParameter("mft_index_cache") and
+                 session.GetParameter("cache_dir"))
+    if cache_dir:
+        path = os.path.join(
+            config.GetHomeDir(), cache_dir, "ntfs-%s-%s.idx" % (
+                serial.encode("hex"),
+                Fingerprint(address_space, record_size)))
+
+        try:
+            with open(path, "rb") as fd:
+                return MFTIndex.Deserialize(fd.read())
+        except (IOError, OSError, ValueError, EOFError, zlib.error):
+            pass
+
+    index = MFTParser(address_space, record_size, session=session).Parse()
+
+    if path:
+        try:
+            with open(path, "wb") as fd:
+                fd.write(index.Serialize())
+        except (IOError, OSError), e:
+            logging.info("Unable to save MFT index %s: %s", path, e)
+
+    return index
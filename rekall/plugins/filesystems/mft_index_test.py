@@ -0,0 +1,205 @@
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+from rekall import addrspace
+from rekall import session
+from rekall import testlib
+from rekall.plugins.filesystems import mft_index
+from rekall.plugins.filesystems import ntfs
+
+
+RECORD_SIZE = 1024
+
+
+def MakeResidentAttribute(attribute_type, content):
+    content += "\x00" * (-len(content) % 8)
+    return struct.pack("<IIBBHHHIH2x", attribute_type, 24 + len(content),
+                       0, 0, 0, 0, 0, len(content), 24) + content
+
+
+# 2014-01-01 00:00:00 UTC.
+FILETIME = 130330080000000000
+UNIX_TIME = 1388534400
+
+
+def MakeFileName(parent, name, name_type=1, created=0):
+    return MakeResidentAttribute(mft_index.FILE_NAME, struct.pack(
+        "<QQQQQQQIIBB", parent, created, 0, 0, 0, 0, 100, 0, 0,
+        len(name), name_type) + name.encode("utf-16-le"))
+
+
+def MakeNonResidentData(size, run_list):
+    run_list += "\x00" * (-len(run_list) % 8)
+    return struct.pack("<IIBBHHHQQH6xQQQ", mft_index.DATA, 64 + len(run_list),
+                       1, 0, 0, 0, 0, 0, 0, 64, size, size,
+                       size) + run_list
+
+
+def MakeRecord(attributes, flags=mft_index.IN_USE, sequence=1):
+    attributes = "".join(attributes) + "\xff" * 8
+    record = bytearray(RECORD_SIZE)
+    record[:40] = struct.pack("<4sHHQHHHHIIQ", "FILE", 48, 3, 0, sequence,
+                              1, 56, flags, 56 + len(attributes), RECORD_SIZE,
+                              0)
+    record[56:56 + len(attributes)] = attributes
+
+    # Apply the fixups.
+    record[48:50] = "\x07\x00"
+    for i in (1, 2):
+        record[48 + 2 * i:50 + 2 * i] = record[i * 512 - 2:i * 512]
+        record[i * 512 - 2:i * 512] = "\x07\x00"
+
+    return str(record)
+
+
+class MFTIndexTest(testlib.RekallBaseUnitTestCase):
+    """Test the bulk MFT parser and index."""
+
+    def setUp(self):
+        self.session = session.Session()
+        records = [MakeRecord([])] * 40
+        records[5] = MakeRecord([MakeFileName(5, ".")],
+                                flags=mft_index.IN_USE | mft_index.DIRECTORY)
+        records[30] = MakeRecord([MakeFileName(5, "Windows")])
+        records[31] = MakeRecord([MakeFileName(30, "System32"),
+                                  MakeFileName(30, "SYSTEM~1", name_type=2)])
+        records[32] = MakeRecord(
+            [MakeResidentAttribute(mft_index.STANDARD_INFORMATION,
+                                   struct.pack("<QQQQ", FILETIME, 0, 0, FILETIME + 10**7)),
+             MakeFileName(31, "notepad.exe", created=FILETIME),
+             MakeNonResidentData(0x5000, "\x21\x04\x00\x01\x01\x02")],
+            sequence=7)
+
+        # A deleted file.
+        records[33] = MakeRecord([MakeFileName(31, "gone.txt")], flags=0)
+
+        self.address_space = addrspace.BufferAddressSpace(
+            data="".join(records), session=self.session)
+
+    def testIndex(self):
+        index = mft_index.MFTParser(self.address_space, RECORD_SIZE).Parse()
+        self.CheckIndex(index)
+
+        # The index survives serialization.
+        self.CheckIndex(mft_index.MFTIndex.Deserialize(index.Serialize()))
+
+    def testBadTimestamps(self):
+        # Timestamps out of the unix time range (e.g. timestomped) are kept as
+        # they are in the record.
+        data = MakeRecord(
+            [MakeResidentAttribute(mft_index.STANDARD_INFORMATION,
+                                   struct.pack("<QQQQ", 2**64 - 1, FILETIME,
+                                               2**63, 1)),
+             MakeFileName(5, "stomped.txt", created=2**64 - 1)])
+
+        address_space = addrspace.BufferAddressSpace(
+            data=self.address_space.data + data, session=self.session)
+        index = mft_index.MFTParser(address_space, RECORD_SIZE).Parse()
+
+        self.assertEqual(len(index), 41)
+        self.assertEqual(index.created[40], -1)
+        self.assertEqual(index.file_modified[40], FILETIME)
+        self.assertEqual(index.mft_modified[40], -2**63)
+        self.assertEqual(index.file_accessed[40], 1)
+        self.assertEqual(
+            index.name_created[index.Lookup(5, "stomped.txt")], -1)
+
+        # They are shown just as the MFT_ENTRY fields are.
+        profile = ntfs.NTFSProfile(session=self.session)
+        self.assertEqual(
+            profile.WinFileTime(value=int(index.file_modified[40])),
+            UNIX_TIME)
+        self.assertEqual(
+            profile.WinFileTime(value=int(index.created[40])), 0)
+
+        # The rest of the volume is still indexed.
+        self.CheckIndex(index, records=41)
+
+    def testListingSource(self):
+        # A hard link: Record 34 is also named in another directory, and its
+        # sequence number has changed since.
+        data = self.address_space.data
+        data = (data[:34 * RECORD_SIZE] + MakeRecord(
+            [MakeFileName(31, "link.txt"), MakeFileName(30, "other.txt")],
+            sequence=9) + data[35 * RECORD_SIZE:])
+
+        address_space = addrspace.BufferAddressSpace(
+            data=data, session=self.session)
+        index = mft_index.MFTParser(address_space, RECORD_SIZE).Parse()
+
+        # Listings show the names in the MFT records with the record's
+        # current sequence number, and skip deleted records.
+        self.assertEqual(
+            [(index.names[row], index.name_record[row],
+              index.sequence[index.name_record[row]])
+             for row in index.ListDirectory(31)],
+            [("link.txt", 34, 9), ("notepad.exe", 32, 7)])
+
+        self.assertEqual([index.names[x] for x in index.ListDirectory(30)],
+                         ["other.txt", "System32", "SYSTEM~1"])
+
+    def _LoadCached(self, address_space, **kwargs):
+        with self.session:
+            for key, value in kwargs.items():
+                self.session.SetParameter(key, value)
+
+        return mft_index.LoadMFTIndex(
+            self.session, address_space, RECORD_SIZE, "\x12\x34")
+
+    def testCache(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            # The index is only cached when asked.
+            self._LoadCached(self.address_space, cache_dir=temp_dir)
+            self.assertEqual(os.listdir(temp_dir), [])
+
+            index = self._LoadCached(self.address_space, mft_index_cache=True)
+            self.CheckIndex(index)
+            self.assertEqual(len(os.listdir(temp_dir)), 1)
+            self.CheckIndex(self._LoadCached(self.address_space))
+
+            # Another acquisition of the same volume (same serial number and
+            # MFT size) does not use the cached index.
+            data = self.address_space.data
+            data = (data[:33 * RECORD_SIZE] +
+                    MakeRecord([MakeFileName(31, "new.txt")]) +
+                    data[34 * RECORD_SIZE:])
+
+            index = self._LoadCached(addrspace.BufferAddressSpace(
+                data=data, session=self.session))
+            self.assertEqual(index.name_record[index.Lookup(31, "new.txt")],
+                             33)
+            self.assertEqual(len(os.listdir(temp_dir)), 2)
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def CheckIndex(self, index, records=40):
+        self.assertEqual(len(index), records)
+
+        # Lookups are case insensitive and find DOS names.
+        row = index.Lookup(5, "windows")
+        self.assertEqual(index.name_record[row], 30)
+        self.assertEqual(index.names[row], "Windows")
+        self.assertEqual(index.name_record[index.Lookup(30, "system~1")], 31)
+
+        # Deleted files can not be found.
+        self.assertEqual(index.Lookup(31, "gone.txt"), None)
+
+        self.assertEqual([index.names[x] for x in index.ListDirectory(30)],
+                         ["System32", "SYSTEM~1"])
+
+        self.assertEqual(index.FullPath(32), "Windows/System32/notepad.exe")
+        self.assertEqual(index.sequence[32], 7)
+        self.assertEqual(index.created[32], FILETIME)
+        self.assertEqual(index.file_accessed[32], FILETIME + 10**7)
+        self.assertEqual(index.name_created[index.Lookup(31, "NOTEPAD.EXE")],
+                         FILETIME)
+        self.assertEqual(index.data_size[32], 0x5000)
+        self.assertEqual(index.run_lists[32], [(0x100, 4), (None, 2)])
+
+
+if __name__ == "__main__":
+    unittest.main()
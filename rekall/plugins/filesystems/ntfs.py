@@ -52,6 +52,7 @@ from rekall import utils
 from rekall.plugins import core
 from rekall.plugins import guess_profile
 from rekall.plugins.filesystems import lznt1
+from rekall.plugins.filesystems import mft_index
 from rekall.plugins.overlays import basic
 
 
@@ -971,11 +972,25 @@ class NTFS(object):
         # Add a reference to the mft to all sub-objects..
         self.mft.obj_context["mft"] = self.mft
 
+        self.session = session
+        self._index = None
+
+    @property
+    def index(self):
+        """An MFTIndex of all the MFT records, built on first use."""
+        if self._index is None:
+            self._index = mft_index.LoadMFTIndex(
+                self.session, self.address_space, self.bs.mft_record_size,
+                self.bs.serial.v())
+
+        return self._index
+
     def MFTEntryByName(self, path):
         """Return the MFT entry by traversing the path.
 
         We support both / and \\ as path separators. Path matching is case
-        insensitive.
+        insensitive. The names are those of the $FILE_NAME attributes in the
+        MFT records (see mft_index), including DOS names.
 
         Raises IOError if path is not found.
 
@@ -987,19 +1002,16 @@ class NTFS(object):
         return_path = []
 
         # Always start from the root of the filesystem.
-        directory = self.mft[5]
+        mft_entry = mft_index.ROOT
         for component in components:
-            component = component.lower()
-
-            for record in directory.list_files():
-                filename = record.file.name.v()
-                if filename.lower() == component.lower():
-                    directory = self.mft[record.mftReference]
-                    return_path.append(filename)
-                    break
-            else:
+            row = self.index.Lookup(mft_entry, component)
+            if row is None:
                 raise IOError("Path %s component not found." % component)
 
+            mft_entry = self.index.name_record[row]
+            return_path.append(self.index.names[row])
+
+        directory = self.mft[mft_entry]
         directory.obj_context["path"] = "/".join(return_path)
 
         return directory
@@ -1196,14 +1208,18 @@ class FLS(FileBaseCommandMixin, NTFSPlugins):
 
 
 class ILS(MFTPluginsMixin, NTFSPlugins):
-    """List files in an NTFS image."""
+    """List files in an NTFS image.
+
+    The directory listing comes from the MFT index: Each file is shown with the
+    names, timestamps and size from the $FILE_NAME attributes of its own MFT
+    record and the record's current sequence number, rather than from the
+    copies held in the directory's $I30 index. Deleted records are not listed.
+    """
 
     name = "ils"
 
     def render(self, renderer):
         for mft in self.mfts:
-            directory = self.ntfs.mft[mft]
-
             # List all files inside this directory.
             renderer.table_header([
                 ("MFT", "mft", ">10"),
@@ -1216,18 +1232,23 @@ class ILS(MFTPluginsMixin, NTFSPlugins):
                 ("Filename", "filename", ""),
             ])
 
-            for record in directory.list_files():
-                file_record = record.file
+            index = self.ntfs.index
+            for row in index.ListDirectory(mft):
+                mft_entry = index.name_record[row]
 
                 renderer.table_row(
-                    record.mftReference,
-                    record.seq_num,
-                    file_record.created,
-                    file_record.file_modified,
-                    file_record.mft_modified,
-                    file_record.file_accessed,
-                    file_record.size,
-                    file_record.name)
+                    mft_entry,
+                    index.sequence[mft_entry],
+                    self.profile.WinFileTime(
+                        value=int(index.name_created[row])),
+                    self.profile.WinFileTime(
+                        value=int(index.name_file_modified[row])),
+                    self.profile.WinFileTime(
+                        value=int(index.name_mft_modified[row])),
+                    self.profile.WinFileTime(
+                        value=int(index.name_file_accessed[row])),
+                    int(index.name_size[row]),
+                    index.names[row])
 
 
 class IDump(NTFSPlugins):
@@ -21,17 +21,36 @@
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
 #
 
+import hashlib
+import io
+import json
 import os
 
 from rekall import plugin
 from rekall import testlib
+from rekall import utils
 
 
 class ImageCopy(plugin.PhysicalASMixin, plugin.Command):
-    """Copies a physical address space out as a raw DD image"""
+    """Copies a physical address space out as a raw DD image
+
+    The address space is read in the background while it is written. Blocks of
+    zeros are not written, so the output file is sparse. The image and each of
+    its ranges are hashed as they are copied.
+
+    Progress is saved in a checkpoint file next to the output image, so an
+    interrupted copy can be continued with --resume.
+    """
 
     __name = "imagecopy"
 
+    BLOCKSIZE = 1024 * 1024 * 5
+
+    # The number of blocks copied between checkpoints.
+    CHECKPOINT_INTERVAL = 20
+
+    HASHES = ["md5", "sha1", "sha256"]
+
     @classmethod
     def args(cls, parser):
         super(ImageCopy, cls).args(parser)
@@ -39,7 +58,15 @@ class ImageCopy(plugin.PhysicalASMixin, plugin.Command):
         parser.add_argument("-O", "--output-image", default=None,
                             help="Filename to write output image.")
 
-    def __init__(self, output_image=None, address_space=None, **kwargs):
+        parser.add_argument("--hash_type", default="sha256",
+                            choices=cls.HASHES,
+                            help="The hash used for the image digests.")
+
+        parser.add_argument("--resume", default=False, type="Boolean",
+                            help="Continue an interrupted copy.")
+
+    def __init__(self, output_image=None, address_space=None,
+                 hash_type="sha256", resume=False, **kwargs):
         """Dumps the address_space into the output file.
 
         Args:
@@ -47,9 +74,15 @@ class ImageCopy(plugin.PhysicalASMixin, plugin.Command):
 
           address_space: The address space to dump. If not specified, we use the
           physical address space.
+
+          hash_type: The hash used for the image and range digests.
+
+          resume: If set, continue copying from the last checkpoint.
         """
         super(ImageCopy, self).__init__(**kwargs)
         self.output_image = output_image
+        self.hash_type = hash_type
+        self.resume = resume
         if address_space is None:
             # Use the physical address space.
             if self.session.physical_address_space is None:
@@ -70,35 +103,196 @@ class ImageCopy(plugin.PhysicalASMixin, plugin.Command):
 
         return "{0:0.2f} TB".format(value)
 
+    @property
+    def checkpoint_filename(self):
+        return self.output_image + ".checkpoint"
+
+    def LoadCheckpoint(self, renderer, ranges):
+        """Returns the saved checkpoint.
+
+        Returns None if there is no checkpoint, or if it can not be read, in
+        which case the copy starts again from the beginning.
+        """
+        if not os.path.exists(self.checkpoint_filename):
+            return
+
+        try:
+            with renderer.open(filename=self.checkpoint_filename) as fd:
+                checkpoint = json.load(fd)
+
+            checkpoint_ranges = [tuple(x) for x in checkpoint["ranges"]]
+        except (ValueError, KeyError, TypeError):
+            renderer.format("Checkpoint unreadable, restarting\n")
+            return
+
+        if (checkpoint.get("hash_type") != self.hash_type or
+                checkpoint_ranges != ranges):
+            raise plugin.PluginError(
+                "The checkpoint does not match this address space.")
+
+        return checkpoint
+
+    def SaveCheckpoint(self, renderer, ranges, offset, range_digests):
+        """Replaces the checkpoint.
+
+        The checkpoint is written to a temporary file first and renamed over
+        the old one, so an interruption never leaves a partial checkpoint.
+        """
+        temp_filename = self.checkpoint_filename + ".tmp"
+        with renderer.open(filename=temp_filename, mode="wb") as fd:
+            json.dump(dict(hash_type=self.hash_type, ranges=ranges,
+                           offset=offset, range_digests=range_digests), fd)
+            self._SyncOutput(fd)
+
+        # The renderer may not write to the local filesystem.
+        if not os.path.exists(temp_filename):
+            return
+
+        try:
+            os.rename(temp_filename, self.checkpoint_filename)
+        except OSError:
+            # On Windows we can not rename over an existing file.
+            os.unlink(self.checkpoint_filename)
+            os.rename(temp_filename, self.checkpoint_filename)
+
+    def _SyncOutput(self, fd):
+        """Make sure the copied data is stored before we checkpoint it."""
+        fd.flush()
+
+        # The renderer may not give us a real file (e.g. in the web console).
+        if hasattr(fd, "fileno"):
+            try:
+                os.fsync(fd.fileno())
+            except (AttributeError, io.UnsupportedOperation):
+                pass
+
+    def _GenerateBlocks(self, ranges, start):
+        for range_offset, range_length in ranges:
+            range_end = range_offset + range_length
+            for offset in xrange(max(range_offset, start), range_end,
+                                 self.BLOCKSIZE):
+                yield offset, min(self.BLOCKSIZE, range_end - offset)
+
+    def _HashZeros(self, hash_obj, length):
+        """Hash a hole of length bytes."""
+        zeros = "\x00" * min(length, self.BLOCKSIZE)
+        while length > 0:
+            hash_obj.update(buffer(zeros, 0, min(length, len(zeros))))
+            length -= len(zeros)
+
+    def _RehashOutput(self, fd, end, range_start, image_hash, range_hash):
+        """Hash the data already copied into the output file."""
+        fd.seek(0)
+        for offset in xrange(0, end, self.BLOCKSIZE):
+            to_read = min(self.BLOCKSIZE, end - offset)
+            data = fd.read(to_read)
+
+            # The file may not yet be extended over a trailing hole.
+            data += "\x00" * (to_read - len(data))
+            image_hash.update(data)
+
+            if offset + to_read > range_start:
+                range_hash.update(data[max(range_start - offset, 0):])
+
     def render(self, renderer):
         """Renders the file to disk"""
         if self.output_image is None:
             raise plugin.PluginError("Please provide an output-image filename")
 
-        if (os.path.exists(self.output_image) and
+        ranges = [(range_offset, range_length)
+                  for range_offset, _, range_length in
+                  self.address_space.get_available_addresses()
+                  if range_length > 0]
+
+        range_ends = [x + y for x, y in ranges]
+
+        # An existing checkpoint means the output is our own partial copy,
+        # which we may overwrite.
+        checkpoint = None
+        have_checkpoint = os.path.exists(self.checkpoint_filename)
+        if self.resume:
+            checkpoint = self.LoadCheckpoint(renderer, ranges)
+
+        if (not (self.resume and have_checkpoint) and
+                os.path.exists(self.output_image) and
                 os.path.getsize(self.output_image) > 1):
             raise plugin.PluginError("Refusing to overwrite an existing file, "
                                      "please remove it before continuing")
 
-        blocksize = 1024 * 1024 * 5
+        # The ranges which were completely copied and their digests.
+        range_digests = []
+        image_hash = hashlib.new(self.hash_type)
+        range_hash = hashlib.new(self.hash_type)
+        offset = 0
+
         with renderer.open(filename=self.output_image,
-                           mode="wb") as fd:
-            for _ in self.address_space.get_available_addresses():
-                range_offset, _, range_length = _
-                renderer.format("Range {0:#x} - {1:#x}\n",
-                                range_offset, range_length)
+                           mode="r+b" if checkpoint else "wb") as fd:
+            if checkpoint:
+                offset = checkpoint["offset"]
+                range_digests = checkpoint["range_digests"]
+                renderer.format("Resuming at offset {0:#x}\n", offset)
+
+                if len(range_digests) < len(ranges):
+                    range_start = ranges[len(range_digests)][0]
+                else:
+                    range_start = offset
+
+                self._RehashOutput(fd, offset, range_start, image_hash,
+                                   range_hash)
+
+            # The end of the data which was hashed into image_hash.
+            hashed_end = offset
+            range_index = len(range_digests)
+            if range_index < len(ranges) and offset <= ranges[range_index][0]:
+                renderer.format("Range {0:#x} - {1:#x}\n", *ranges[range_index])
+
+            for i, (offset, data) in enumerate(utils.ReadAhead(
+                    self.address_space, self._GenerateBlocks(ranges, offset))):
+                # Finish the ranges before this block.
+                while offset >= range_ends[range_index]:
+                    range_digests.append(range_hash.hexdigest())
+                    renderer.format("  {0}: {1}\n", self.hash_type,
+                                    range_digests[-1])
 
-                range_end = range_offset + range_length
+                    range_hash = hashlib.new(self.hash_type)
+                    range_index += 1
+                    renderer.format("Range {0:#x} - {1:#x}\n",
+                                    *ranges[range_index])
 
-                for offset in xrange(range_offset, range_end, blocksize):
-                    to_read = min(blocksize, range_end - offset)
-                    data = self.address_space.read(offset, to_read)
+                # The gap between ranges is part of the image.
+                self._HashZeros(image_hash, offset - hashed_end)
+                image_hash.update(data)
+                range_hash.update(data)
+                hashed_end = offset + len(data)
 
+                if not utils.IsZeroBuffer(data):
                     fd.seek(offset)
                     fd.write(data)
 
-                    renderer.RenderProgress(
-                        "Writing offset %s" % self.human_readable(offset))
+                renderer.RenderProgress(
+                    "Writing offset %s" % self.human_readable(offset))
+
+                if (i + 1) % self.CHECKPOINT_INTERVAL == 0:
+                    self._SyncOutput(fd)
+                    self.SaveCheckpoint(
+                        renderer, ranges, hashed_end, range_digests)
+
+            if range_index < len(ranges):
+                range_digests.append(range_hash.hexdigest())
+                renderer.format("  {0}: {1}\n", self.hash_type,
+                                range_digests[-1])
+
+            # Extend the file over a trailing hole.
+            fd.seek(0, 2)
+            if fd.tell() < hashed_end:
+                fd.seek(hashed_end - 1)
+                fd.write("\x00")
+
+        renderer.format("Image {0}: {1}\n", self.hash_type,
+                        image_hash.hexdigest())
+
+        if os.path.exists(self.checkpoint_filename):
+            os.unlink(self.checkpoint_filename)
 
 
 class TestImageCopy(testlib.HashChecker):
@@ -0,0 +1,205 @@
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from rekall import addrspace
+from rekall import session
+from rekall import testlib
+from rekall.plugins import imagecopy
+
+
+class RangesAddressSpace(addrspace.BufferAddressSpace):
+    """A buffer with holes between its ranges."""
+    __abstract = True
+
+    RANGES = [(0, 0x300), (0x800, 0x250), (0x1000, 0x180)]
+
+    def get_available_addresses(self, start=0):
+        for offset, length in self.RANGES:
+            yield offset, offset, length
+
+
+class Interrupted(Exception):
+    pass
+
+
+class FakeRenderer(object):
+    """Opens files in a directory and collects the formatted output."""
+
+    def __init__(self, directory, interrupt_at=None):
+        self.directory = directory
+        self.interrupt_at = interrupt_at
+        self.progress_calls = 0
+        self.output = []
+
+    def open(self, filename=None, mode="rb"):
+        return open(os.path.join(self.directory, filename), mode)
+
+    def format(self, formatstring, *args):
+        self.output.append(formatstring.format(*args))
+
+    def RenderProgress(self, *_, **__):
+        self.progress_calls += 1
+        if self.progress_calls == self.interrupt_at:
+            raise Interrupted()
+
+
+class MemoryFile(io.BytesIO):
+    """A file which is not an OS file, and so can not be fsynced."""
+
+    def __init__(self, files, filename, mode):
+        self.files = files
+        self.filename = filename
+        data = ""
+        if "r" in mode:
+            data = files[filename]
+
+        io.BytesIO.__init__(self, data)
+
+    def close(self):
+        self.files[self.filename] = self.getvalue()
+        io.BytesIO.close(self)
+
+
+class MemoryRenderer(FakeRenderer):
+    """Writes the files into a dict."""
+
+    def __init__(self, **kwargs):
+        super(MemoryRenderer, self).__init__(**kwargs)
+        self.files = {}
+
+    def open(self, filename=None, mode="rb"):
+        return MemoryFile(self.files, filename, mode)
+
+
+class ImageCopyTest(testlib.RekallBaseUnitTestCase):
+    """Test copying, resuming and hashing images."""
+
+    def setUp(self):
+        self.session = session.Session()
+        self.temp_dir = tempfile.mkdtemp()
+        self.output_image = os.path.join(self.temp_dir, "image.raw")
+
+        data = "".join(chr(x % 251) for x in range(0x1180))
+
+        # Some blocks of zeros which are not written.
+        data = data[:0x100] + "\x00" * 0x100 + data[0x200:]
+        self.address_space = RangesAddressSpace(
+            data=data, session=self.session)
+        self.session.physical_address_space = self.address_space
+
+        # The expected image has zeros in the holes.
+        self.expected = ""
+        for offset, length in RangesAddressSpace.RANGES:
+            self.expected += "\x00" * (offset - len(self.expected))
+            self.expected += data[offset:offset + length]
+
+        self.old_blocksize = imagecopy.ImageCopy.BLOCKSIZE
+        self.old_interval = imagecopy.ImageCopy.CHECKPOINT_INTERVAL
+        imagecopy.ImageCopy.BLOCKSIZE = 0x100
+        imagecopy.ImageCopy.CHECKPOINT_INTERVAL = 2
+
+    def tearDown(self):
+        imagecopy.ImageCopy.BLOCKSIZE = self.old_blocksize
+        imagecopy.ImageCopy.CHECKPOINT_INTERVAL = self.old_interval
+        shutil.rmtree(self.temp_dir)
+
+    def _Copy(self, renderer, resume=False):
+        imagecopy.ImageCopy(
+            session=self.session, address_space=self.address_space,
+            output_image=self.output_image, resume=resume).render(renderer)
+
+    def _Digests(self):
+        result = [hashlib.sha256(self.expected[offset:offset + length])
+                  for offset, length in RangesAddressSpace.RANGES]
+        result.append(hashlib.sha256(self.expected))
+
+        return [x.hexdigest() for x in result]
+
+    def _CheckOutput(self, data, output, digests=None):
+        self.assertEqual(data, self.expected)
+
+        self.assertEqual(
+            [x.split(": ")[1].strip() for x in output if ": " in x],
+            digests or self._Digests())
+
+    def testCopy(self):
+        renderer = FakeRenderer(self.temp_dir)
+        self._Copy(renderer)
+
+        with open(self.output_image, "rb") as fd:
+            self._CheckOutput(fd.read(), renderer.output)
+
+        # The checkpoint is removed when the copy is complete.
+        self.assertEqual(os.listdir(self.temp_dir), ["image.raw"])
+
+        # We refuse to overwrite the image.
+        self.assertRaises(Exception, self._Copy, FakeRenderer(self.temp_dir))
+
+    def testResume(self):
+        # Interrupt the copy in the second range.
+        self.assertRaises(Interrupted, self._Copy, FakeRenderer(
+            self.temp_dir, interrupt_at=6))
+
+        # The checkpoint was saved after the fourth block.
+        with open(self.output_image + ".checkpoint") as fd:
+            checkpoint = json.load(fd)
+
+        self.assertEqual(checkpoint["offset"], 0x900)
+        self.assertEqual(checkpoint["range_digests"], self._Digests()[:1])
+
+        renderer = FakeRenderer(self.temp_dir)
+        self._Copy(renderer, resume=True)
+        self.assertEqual(renderer.output[0], "Resuming at offset 0x900\n")
+
+        # The first range was hashed before the copy was interrupted.
+        with open(self.output_image, "rb") as fd:
+            self._CheckOutput(fd.read(), renderer.output,
+                              digests=self._Digests()[1:])
+
+        self.assertFalse(os.path.exists(self.output_image + ".checkpoint"))
+
+    def testCheckpointReplaced(self):
+        # The checkpoint is replaced by renaming, so no temporary file is left.
+        self.assertRaises(Interrupted, self._Copy, FakeRenderer(
+            self.temp_dir, interrupt_at=8))
+
+        self.assertEqual(sorted(os.listdir(self.temp_dir)),
+                         ["image.raw", "image.raw.checkpoint"])
+
+        with open(self.output_image + ".checkpoint") as fd:
+            self.assertEqual(json.load(fd)["offset"], 0xA50)
+
+    def testUnreadableCheckpoint(self):
+        self.assertRaises(Interrupted, self._Copy, FakeRenderer(
+            self.temp_dir, interrupt_at=6))
+
+        # Truncate the checkpoint.
+        with open(self.output_image + ".checkpoint", "r+b") as fd:
+            fd.truncate(10)
+
+        # The copy starts again from the beginning.
+        renderer = FakeRenderer(self.temp_dir)
+        self._Copy(renderer, resume=True)
+        self.assertEqual(renderer.output[0],
+                         "Checkpoint unreadable, restarting\n")
+
+        with open(self.output_image, "rb") as fd:
+            self._CheckOutput(fd.read(), renderer.output)
+
+        self.assertFalse(os.path.exists(self.output_image + ".checkpoint"))
+
+    def testNonOSFile(self):
+        # Files from the renderer can not always be synced or renamed.
+        renderer = MemoryRenderer(directory=self.temp_dir, interrupt_at=6)
+        self.assertRaises(Interrupted, self._Copy, renderer)
+        self.assertTrue(
+            self.output_image + ".checkpoint.tmp" in renderer.files)
+
+
+if __name__ == "__main__":
+    unittest.main()
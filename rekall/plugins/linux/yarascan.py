@@ -49,8 +49,19 @@ class LinYaraScan(common.LinProcessFilter):
             "--scan_physical", default=False, type="Boolean",
             help="If specified we scan the physcial address space.")
 
+        parser.add_argument(
+            "--yara_rule_sets", default=[], type="ArrayStringParser",
+            help="Several yara signature files which are matched in a single "
+            "pass. Hits are attributed to the file they came from.")
+
+        parser.add_argument(
+            "--yara_statistics", default=False, type="Boolean",
+            help="If specified we report the number of hits for each rule and "
+            "the time spent matching.")
+
     def __init__(self, string=None, scan_physical=False, yara_file=None,
-                 yara_expression=None, **kwargs):
+                 yara_expression=None, yara_rule_sets=None,
+                 yara_statistics=False, **kwargs):
         """Scan using yara signatures.
 
         Args:
@@ -59,6 +70,9 @@ class LinYaraScan(common.LinProcessFilter):
           scan_physical: If true we scan the physical address space.
           yara_file: The yara file to read.
           yara_expression: If provided we scan for this yarra expression.
+          yara_rule_sets: A list of yara files which are matched in a single
+            pass.
+          yara_statistics: If true we report hit counts and matching time.
         """
         super(LinYaraScan, self).__init__(**kwargs)
         if yara_expression:
@@ -73,17 +87,23 @@ class LinYaraScan(common.LinProcessFilter):
 
         elif yara_file:
             self.rules = yara.compile(yara_file)
+
+        elif yara_rule_sets:
+            self.rules = yarascanner.CompileRuleSets(yara, yara_rule_sets)
+
         else:
             raise plugin.PluginError("You must specify a yara rule file or "
                                      "string to match.")
 
         self.scan_physical = scan_physical
+        self.yara_statistics = yara_statistics
+        self.statistics = yarascanner.YaraStatistics()
 
     def generate_hits(self, address_space):
         scanner = yarascanner.BaseYaraASScanner(
             profile=self.profile, session=self.session,
             address_space=address_space,
-            rules=self.rules)
+            rules=self.rules, statistics=self.statistics)
 
         return scanner.scan()
 
@@ -128,7 +148,7 @@ class LinYaraScan(common.LinProcessFilter):
     def render(self, renderer):
         """Render output."""
         if self.scan_physical:
-            return self.render_scan_physical(renderer)
+            self.render_scan_physical(renderer)
 
         elif self.filtering_requested:
             for task in self.filter_processes():
@@ -136,4 +156,7 @@ class LinYaraScan(common.LinProcessFilter):
 
         # We are searching the kernel address space
         else:
-            return self.render_kernel_scan(renderer)
+            self.render_kernel_scan(renderer)
+
+        if self.yara_statistics:
+            self.statistics.render(renderer)
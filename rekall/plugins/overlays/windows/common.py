@@ -25,6 +25,7 @@
 import logging
 import struct
 from rekall import addrspace
+from rekall import kb
 from rekall import obj
 from rekall import utils
 
@@ -890,29 +891,83 @@ class _HANDLE_TABLE(obj.Struct):
         """
         return entry.Object.dereference_as("_OBJECT_HEADER", parent=entry)
 
-    def _make_handle_array(self, table_offset, level):
-        """ Returns an array of _HANDLE_TABLE_ENTRY rooted at offset,
-        and iterates over them.
+    # The size of each table in the handle table tree.
+    TABLE_SIZE = 0x1000
+
+    def _get_entry_decoder(self):
+        """Describes where the object pointer is inside a raw handle entry.
+
+        This allows us to skip empty entries without creating any objects for
+        them.
+
+        Returns:
+          A tuple of (compiled struct of the word holding the pointer, offset
+          of the word in the entry, mask of the pointer bits).
+        """
+        entry = self.obj_profile._HANDLE_TABLE_ENTRY(vm=self.obj_vm)
+
+        # In Windows 8 the Object pointer is replaced with a bitfield.
+        field = entry.m("ObjectPointerBits")
+        if isinstance(field, obj.BitField):
+            word = field._proxy
+            mask = (1 << field.end_bit) - (1 << field.start_bit)
+        else:
+            fast_ref = entry.m("Object")
+            word = fast_ref.m("Object")
+            mask = fast_ref.mask
+
+        if isinstance(word, obj.Pointer):
+            word = word._proxy
+
+        compiled_format = obj.CompileFormat(word.format_string)
+
+        return (compiled_format, word.obj_offset - entry.obj_offset,
+                mask & ((1 << (8 * compiled_format.size)) - 1))
+
+    def _make_handle_array(self, table_offset, level, first_handle=0):
+        """Yields the items in the handle table rooted at offset.
+
+        Each table is read in one go, and only the entries which are in use
+        are instantiated.
+
+        Yields:
+          Tuples of (handle value, item).
         """
+        vm = self.obj_session.GetParameter("default_address_space")
+        entry_size = self.obj_profile.get_obj_size("_HANDLE_TABLE_ENTRY")
+        entries_per_table = self.TABLE_SIZE // entry_size
+
         # level == 0 means we are at the bottom level and this is a table of
         # _HANDLE_TABLE_ENTRY, otherwise, it means we are a table of pointers to
         # lower tables.
         if level == 0:
-            table = self.obj_profile.Array(
-                offset=table_offset,
-                target="_HANDLE_TABLE_ENTRY",
-                size=0x1000)
+            compiled_format, word_offset, mask = self._get_entry_decoder()
+            table_vm = addrspace.SnapshotAddressSpace(
+                base=vm, base_offset=table_offset, length=self.TABLE_SIZE)
+
+            for i in xrange(entries_per_table):
+                word = compiled_format.unpack_from(
+                    table_vm.data, i * entry_size + word_offset)[0]
+                if not word & mask:
+                    continue
 
-            for entry in table:
-                yield self.get_item(entry)
+                entry = self.obj_profile._HANDLE_TABLE_ENTRY(
+                    offset=table_offset + i * entry_size, vm=table_vm)
+
+                # Handle values are multiples of 4.
+                yield (first_handle + i) * 4, self.get_item(entry)
 
         else:
             table = self.obj_profile.PointerArray(
-                offset=table_offset, size=0x1000)
+                offset=table_offset, vm=vm, size=self.TABLE_SIZE)
+
+            # The number of handles under each lower table.
+            span = entries_per_table * len(table) ** (level - 1)
 
-            for entry in table:
+            for i, entry in enumerate(table):
                 if entry:
-                    for item in self._make_handle_array(entry, level-1):
+                    for item in self._make_handle_array(
+                            entry, level-1, first_handle + i * span):
                         yield item
 
     def handles(self):
@@ -936,10 +991,10 @@ class _HANDLE_TABLE(obj.Struct):
         table = self.TableCode & ~LEVEL_MASK
         level = self.TableCode & LEVEL_MASK
 
-        for i, handle in enumerate(self._make_handle_array(table, level)):
+        for handle_value, handle in self._make_handle_array(table, level):
             # New object header uses TypeIndex.
             if handle.m("TypeIndex") > 0x0 or handle.m("Type").Name:
-                handle.HandleValue = i * 4
+                handle.HandleValue = handle_value
 
                 yield handle
 
@@ -1024,11 +1079,17 @@ class _OBJECT_HEADER(obj.Struct):
 
     def get_object_type(self, vm=None):
         """Return the object's type as a string"""
-        type_obj = self.obj_profile._OBJECT_TYPE(
-            vm=vm or self.obj_session.kernel_address_space,
-            offset=self.Type)
+        cache = self.obj_session.GetParameter("ObjectTypeNameCache")
+        type_pointer = self.m("Type").v()
+        try:
+            return cache[type_pointer]
+        except KeyError:
+            type_obj = self.obj_profile._OBJECT_TYPE(
+                vm=vm or self.obj_session.kernel_address_space,
+                offset=type_pointer)
 
-        return type_obj.Name.v()
+            result = cache[type_pointer] = type_obj.Name.v()
+            return result
 
     @property
     def Object(self):
@@ -1063,12 +1124,25 @@ class _FILE_OBJECT(ObjectMixin, obj.Struct):
                 ((self.SharedWrite > 0 and "w") or '-') +
                 ((self.SharedDelete > 0 and "d") or '-'))
 
-    def file_name_with_device(self):
+    def file_name_with_device(self, device_names=None):
         """Return the name of the file, prefixed with the name
-        of the device object to which the file belongs"""
+        of the device object to which the file belongs
+
+        Args:
+          device_names: An optional dict which caches device names by the
+            address of their device object. Callers resolving many file names
+            can share it between calls.
+        """
         name = ""
         if self.DeviceObject:
-            device_name = self.DeviceObject.ObjectHeader.NameInfo.Name
+            device = self.DeviceObject.v()
+            if device_names is None or device not in device_names:
+                device_name = self.DeviceObject.ObjectHeader.NameInfo.Name
+                if device_names is not None:
+                    device_names[device] = device_name
+            else:
+                device_name = device_names[device]
+
             if device_name:
                 name = u"\\Device\\{0}".format(device_name)
 
@@ -1095,6 +1169,20 @@ class _OBJECT_DIRECTORY(ObjectMixin, obj.Struct):
                     yield target_obj_header
 
 
+class ObjectTypeNameCacheHook(kb.ParameterHook):
+    """A cache of object type names.
+
+    Every object refers to its _OBJECT_TYPE (by pointer, or in Windows 7 and
+    later by index). There are only a few dozen types, so we remember their
+    names rather than reading them again for every object.
+    """
+
+    name = "ObjectTypeNameCache"
+
+    def calculate(self):
+        return {}
+
+
 class _EX_FAST_REF(obj.Struct):
     """This type allows instantiating an object from its .Object member."""
 
@@ -1146,15 +1234,43 @@ class _EX_FAST_REF(obj.Struct):
 class _CM_KEY_BODY(obj.Struct):
     """Registry key"""
 
-    def full_key_name(self):
+    def full_key_name(self, key_names=None):
+        """Returns the full path of the key.
+
+        Args:
+          key_names: An optional dict which caches the paths of key control
+            blocks by their address. Callers resolving many keys can share it
+            between calls, since keys usually share their parents.
+        """
+        if key_names is None:
+            key_names = {}
+
         output = []
+        visited = []
         kcb = self.KeyControlBlock
+        prefix = None
         while kcb.ParentKcb:
+            prefix = key_names.get(kcb.v())
+            if prefix is not None:
+                break
+
             if kcb.NameBlock.Name == None:
                 break
+
             output.append(str(kcb.NameBlock.Name))
+            visited.append(kcb.v())
             kcb = kcb.ParentKcb
-        return "\\".join(reversed(output))
+
+        output.reverse()
+        if prefix is not None:
+            output.insert(0, prefix)
+
+        # Remember the path of every key control block we walked through.
+        first = len(output) - len(visited)
+        for i, kcb_offset in enumerate(reversed(visited)):
+            key_names[kcb_offset] = "\\".join(output[:first + i + 1])
+
+        return "\\".join(output)
 
 
 class _MMVAD_FLAGS(obj.Struct):
@@ -1200,40 +1316,51 @@ class VadTraverser(obj.Struct):
     left = "LeftChild"
     right = "RightChild"
 
+    # Trees deeper than this are probably corrupted (or contain a loop).
+    MAX_DEPTH = 100
+
     def traverse(self, visited=None, depth=0):
         """ Traverse the VAD tree by generating all the left items,
         then the right items.
 
+        The tree is walked with an explicit stack, rather than recursively, so
+        each node is only yielded once no matter how deep it is.
+
         We try to be tolerant of cycles by storing all offsets visited.
         """
-        if depth > 100:
-            logging.error("Vad tree too deep - something went wrong!")
-            return
-
-        if visited == None:
+        if visited is None:
             visited = set()
 
-        ## We try to prevent loops here
-        if self.obj_offset in visited:
-            return
+        stack = [(self, depth)]
+        while stack:
+            node, depth = stack.pop()
+            if depth > self.MAX_DEPTH:
+                logging.error("Vad tree too deep - something went wrong!")
+                continue
 
-        self.obj_context['depth'] = depth
+            ## We try to prevent loops here
+            if node.obj_offset in visited:
+                continue
 
-        # Find out which Vad type we need to be:
-        if self.Tag in self.tag_map:
-            yield self.cast(self.tag_map[self.Tag])
+            visited.add(node.obj_offset)
 
-        # This tag is valid for the Root.
-        elif depth and self.Tag.v() != "\x00":
-            return
+            # Find out which Vad type we need to be:
+            tag = node.Tag
+            if tag in node.tag_map:
+                yield node.obj_profile.Object(
+                    node.tag_map[tag], offset=node.obj_offset,
+                    vm=node.obj_vm, parent=node.obj_parent,
+                    context=dict(node.obj_context, depth=depth))
 
-        for c in self.m(self.left).traverse(visited=visited, depth=depth+1):
-            visited.add(self.obj_offset)
-            yield c
+            # This tag is valid for the Root.
+            elif depth and tag.v() != "\x00":
+                continue
 
-        for c in self.m(self.right).traverse(visited=visited, depth=depth+1):
-            visited.add(self.obj_offset)
-            yield c
+            # Push the right child first so the left subtree is walked first.
+            for child_name in (node.right, node.left):
+                child = node.m(child_name).dereference()
+                if child:
+                    stack.append((child, depth + 1))
 
 
 class _KTIMER(obj.Struct):
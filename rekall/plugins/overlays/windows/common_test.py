@@ -0,0 +1,195 @@
+"""Tests for the common windows overlays."""
+
+import struct
+import unittest
+
+from rekall import addrspace
+from rekall import session
+from rekall import testlib
+from rekall.plugins.overlays import basic
+from rekall.plugins.overlays.windows import common
+
+
+class FakeObjectHeader(object):
+    """Stands in for the _OBJECT_HEADER of a handle entry."""
+
+    def __init__(self, entry):
+        self.entry = entry
+        self.Object = entry.Object.Object.v()
+
+    def m(self, attr):
+        if attr == "TypeIndex":
+            return 1
+
+
+class FakeHandleTable(common._HANDLE_TABLE):
+    __abstract = True
+
+    def get_item(self, entry):
+        return FakeObjectHeader(entry)
+
+
+class HandleTestProfile(basic.Profile32Bits, basic.BasicClasses):
+    """A profile with just enough to walk a handle table."""
+    __abstract = True
+
+    @classmethod
+    def Initialize(cls, profile):
+        super(HandleTestProfile, cls).Initialize(profile)
+        profile.add_types({
+            "_HANDLE_TABLE": [0x4, {
+                "TableCode": [0, ["unsigned int"]],
+            }],
+            "_HANDLE_TABLE_ENTRY": [0x8, {
+                "Object": [0, ["_EX_FAST_REF"]],
+                "GrantedAccess": [4, ["unsigned int"]],
+            }],
+            "_EX_FAST_REF": [0x4, {
+                "Object": [0, ["Pointer", dict(target="Void")]],
+                "RefCnt": [0, ["BitField", dict(start_bit=0, end_bit=3)]],
+            }],
+            "_CM_KEY_BODY": [0x4, {
+                "KeyControlBlock": [0, ["Pointer", dict(
+                    target="_CM_KEY_CONTROL_BLOCK")]],
+            }],
+            "_CM_KEY_CONTROL_BLOCK": [0x8, {
+                "ParentKcb": [0, ["Pointer", dict(
+                    target="_CM_KEY_CONTROL_BLOCK")]],
+                "NameBlock": [4, ["Pointer", dict(
+                    target="_CM_NAME_CONTROL_BLOCK")]],
+            }],
+            "_CM_NAME_CONTROL_BLOCK": [0x20, {
+                "NameLength": [0, ["unsigned short"]],
+                "Name": [2, ["String", dict(length=lambda x: x.NameLength)]],
+            }],
+        })
+
+        profile.add_classes(_HANDLE_TABLE=FakeHandleTable,
+                            _EX_FAST_REF=common._EX_FAST_REF,
+                            _CM_KEY_BODY=common._CM_KEY_BODY)
+
+
+class HandleTableTest(testlib.RekallBaseUnitTestCase):
+    """Test walking the handle table tree."""
+
+    def setUp(self):
+        self.session = session.Session()
+        self.profile = HandleTestProfile(session=self.session)
+
+        data = bytearray(0x5000)
+
+        # The top level table points to two tables of entries, skipping one
+        # entry, and to an empty table.
+        struct.pack_into("<4I", data, 0x1000, 0x2000, 0, 0x3000, 0x4000)
+
+        # Entry 0 is always empty. The low bits hold the reference count.
+        for table, index, value in [(0x2000, 1, 0x10003),
+                                    (0x2000, 5, 0x20000),
+                                    (0x2000, 511, 0x30001),
+                                    (0x3000, 3, 0x40000)]:
+            struct.pack_into("<II", data, table + index * 8, value, 0x1f0001)
+
+        # An entry with only reference count bits set is empty.
+        struct.pack_into("<II", data, 0x3000 + 4 * 8, 7, 0x1f0001)
+
+        address_space = addrspace.BufferAddressSpace(
+            data=str(data), session=self.session)
+        self.session.SetCache("default_address_space", address_space)
+
+        self.expected = [(4, 0x10000), (5 * 4, 0x20000), (511 * 4, 0x30000),
+                         ((2 * 512 + 3) * 4, 0x40000)]
+
+        struct.pack_into("<I", data, 0, 0x1000 | 1)
+        self.table = self.profile._HANDLE_TABLE(
+            offset=0, vm=addrspace.BufferAddressSpace(
+                data=str(data[:4]), session=self.session))
+
+    def testHandleArray(self):
+        handles = [(value, handle.Object) for value, handle in
+                   self.table._make_handle_array(0x1000, 1)]
+
+        self.assertEqual(handles, self.expected)
+
+    def testLevel0(self):
+        handles = [(value, handle.Object) for value, handle in
+                   self.table._make_handle_array(0x3000, 0, first_handle=10)]
+
+        self.assertEqual(handles, [((10 + 3) * 4, 0x40000)])
+
+    def testHandles(self):
+        handles = [(handle.HandleValue, handle.Object)
+                   for handle in self.table.handles()]
+
+        self.assertEqual(handles, self.expected)
+
+    def testEntryDecoder(self):
+        compiled_format, word_offset, mask = self.table._get_entry_decoder()
+        self.assertEqual(compiled_format.size, 4)
+        self.assertEqual(word_offset, 0)
+        self.assertEqual(mask, 0xfffffff8)
+
+
+class FullKeyNameTest(testlib.RekallBaseUnitTestCase):
+    """Test the key paths with and without a shared memo."""
+
+    def setUp(self):
+        self.session = session.Session()
+        self.profile = HandleTestProfile(session=self.session)
+
+        data = bytearray(0x1000)
+
+        # (name, parent) of each key control block. Block i is at
+        # 0x100 + i * 8 and its name block at 0x400 + i * 0x20.
+        blocks = [("REGISTRY", None),
+                  ("MACHINE", 0),
+                  ("SOFTWARE", 1),
+                  ("Microsoft", 2),
+                  ("Classes", 2),
+                  ("Windows", 3),
+                  ("", 1),
+                  ("Empty", 6)]
+
+        for i, (name, parent) in enumerate(blocks):
+            struct.pack_into(
+                "<II", data, 0x100 + i * 8,
+                0 if parent is None else 0x100 + parent * 8, 0x400 + i * 0x20)
+            struct.pack_into("<H", data, 0x400 + i * 0x20, len(name))
+            data[0x402 + i * 0x20:0x402 + i * 0x20 + len(name)] = name
+
+        # Key bodies pointing at each block, in a different order, with
+        # some blocks opened twice.
+        self.key_blocks = [5, 3, 4, 5, 2, 1, 7, 6, 7, 0, 3]
+        for i, block in enumerate(self.key_blocks):
+            struct.pack_into("<I", data, 0x800 + i * 4, 0x100 + block * 8)
+
+        self.address_space = addrspace.BufferAddressSpace(
+            data=str(data), session=self.session)
+
+    def _Keys(self):
+        for i in range(len(self.key_blocks)):
+            yield self.profile._CM_KEY_BODY(
+                offset=0x800 + i * 4, vm=self.address_space)
+
+    def testFullKeyName(self):
+        uncached = [key.full_key_name() for key in self._Keys()]
+        self.assertEqual(uncached[:3], [
+            "MACHINE\\SOFTWARE\\Microsoft\\Windows",
+            "MACHINE\\SOFTWARE\\Microsoft",
+            "MACHINE\\SOFTWARE\\Classes"])
+
+        # The root key has no parent so it has no path.
+        self.assertEqual(uncached[9], "")
+        self.assertEqual(uncached[6], "MACHINE\\\\Empty")
+
+        key_names = {}
+        cached = [key.full_key_name(key_names=key_names)
+                  for key in self._Keys()]
+
+        self.assertEqual(cached, uncached)
+
+        # Every block below the root was remembered.
+        self.assertEqual(len(key_names), 7)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -31,6 +31,7 @@ http://code.google.com/p/pefile/
 Version information:
 http://msdn.microsoft.com/en-us/library/windows/desktop/ff468916(v=vs.85).aspx
 """
+import bisect
 import copy
 import re
 
@@ -1128,6 +1129,20 @@ class RelativeOffsetMixin(object):
         except ValueError:
             return self.GetImageBase(), "image_base"
 
+    def get_nearest_constants_by_address(self, addresses):
+        image_base = self.GetImageBase()
+
+        # Addresses below the image base can not have a constant.
+        below = bisect.bisect_left(addresses, image_base)
+        result = [(0, "")] * below
+
+        for offset, name in super(
+                RelativeOffsetMixin, self).get_nearest_constants_by_address(
+                    [x - image_base for x in addresses[below:]]):
+            result.append((offset + image_base, name))
+
+        return result
+
 
 class Demangler(object):
     """A utility class to demangle VC++ names.
@@ -163,8 +163,15 @@ class _OBJECT_HEADER(common._OBJECT_HEADER):
 
     def get_object_type(self, vm=None):
         """Return the object's type as a string"""
-        return self.obj_session.GetParameter("ObjectTypeMap")[
-            self.TypeIndex].Name.v()
+        cache = self.obj_session.GetParameter("ObjectTypeNameCache")
+        type_index = self.m("TypeIndex").v()
+        try:
+            return cache[type_index]
+        except KeyError:
+            result = cache[type_index] = self.obj_session.GetParameter(
+                "ObjectTypeMap")[type_index].Name.v()
+
+            return result
 
     def is_valid(self):
         """Determine if the object makes sense."""
@@ -48,19 +48,46 @@ ELF core dump and stacks the relevant address spaces.
 
 __author__ = "Michael Cohen <scudette@google.com>"
 import array
+import collections
 import os
 import struct
+import threading
 import zlib
 
+from rekall import config
 from rekall import obj
 from rekall import plugin
 from rekall import testlib
+from rekall import threadpool
 from rekall import utils
 from rekall.plugins.addrspaces import elfcore
 from rekall.plugins.addrspaces import standard
 from rekall.plugins.overlays import basic
 
 
+config.DeclareOption(
+    "--ewf_readahead", default=16, type="IntParser",
+    help="The number of chunks decompressed ahead of sequential reads from "
+    "EWF files. Set to 0 to disable read-ahead.")
+
+config.DeclareOption(
+    "--ewf_readahead_threads", default=4, type="IntParser",
+    help="The number of threads decompressing the chunks read ahead from "
+    "EWF files.")
+
+config.DeclareOption(
+    "--compression_workers", default=4, type="IntParser",
+    help="The number of threads used to compress chunks when writing EWF "
+    "files. Set to 0 to compress on the writing thread.")
+
+config.DeclareOption(
+    "--compression_level", default=6, type="IntParser",
+    help="The zlib compression level (0-9) used when writing EWF files.")
+
+# The default number of threads used to decompress chunks ahead of reads.
+DEFAULT_READAHEAD_THREADS = 4
+
+
 EWF_TYPES = dict(
     ewf_file_header_v1=[0x0d, {
         'EVF_sig': [0, ['Signature', dict(value="EVF\x09\x0d\x0a\xff\x00")]],
@@ -199,8 +226,44 @@ class EWFProfile(basic.ProfileLLP64, basic.BasicClasses):
             )
 
 
+class PendingChunk(object):
+    """A chunk which is being compressed or decompressed in the background."""
+
+    def __init__(self, data, function):
+        self.data = data
+        self.function = function
+        self.result = None
+        self.cancelled = False
+        self.done = threading.Event()
+
+    def Cancel(self):
+        """The result is not needed, so do not run if not yet started."""
+        self.cancelled = True
+
+    def Run(self):
+        try:
+            if not self.cancelled:
+                self.result = self.function(self.data)
+        except zlib.error:
+            # The caller will try again and report the error.
+            pass
+        finally:
+            self.done.set()
+
+    def Wait(self):
+        self.done.wait()
+        return self.result
+
+
 class EWFFile(object):
-    """A helper for parsing an EWF file."""
+    """A helper for parsing an EWF file.
+
+    When chunks are read sequentially, the following chunks are decompressed
+    ahead of time in a thread pool (zlib releases the GIL while decompressing)
+    so scans over the entire image are not limited to a single core. The
+    number of chunks decompressed ahead is controlled by the ewf_readahead
+    session parameter.
+    """
 
     def __init__(self, session=None, address_space=None):
         self.session = session
@@ -214,6 +277,15 @@ class EWFFile(object):
         # 32kb * 100 = 3.2mb cache size.
         self.chunk_cache = utils.FastStore(max_size=100)
 
+        # Read-ahead state: The last chunk read, and the chunks currently
+        # being decompressed by the thread pool. The pool belongs to the
+        # process which started it (readahead_pid).
+        self.readahead = self.session.GetParameter("ewf_readahead") or 0
+        self.last_chunk_id = -1
+        self.pending_chunks = {}
+        self.readahead_pool = None
+        self.readahead_pid = None
+
         self.address_space = address_space
         self.profile = EWFProfile(session=session)
         self.file_header = self.profile.ewf_file_header_v1(
@@ -303,32 +375,119 @@ class EWFFile(object):
         # The next table starts at this chunk.
         self._chunk_offset += number_of_entries
 
+    def _read_raw_chunk(self, chunk_id):
+        """Read the chunk's data from the file without decompressing it.
+
+        Returns:
+          a tuple of (data, compressed) or (None, False) if the chunk does not
+          exist.
+        """
+        start_chunk, table_header, table = self.tables.find_le(chunk_id)
+
+        # This should be a ewf_table_entry object but the below is faster.
+        try:
+            table_entry = table[chunk_id - start_chunk]
+        except IndexError:
+            return None, False
+
+        offset = table_entry & 0x7fffffff
+        next_offset = table[chunk_id - start_chunk + 1] & 0x7fffffff
+        compressed_chunk_size = next_offset - offset
+
+        data = self.address_space.read(
+            offset + table_header.base_offset, compressed_chunk_size)
+
+        return data, bool(table_entry & 0x80000000)
+
+    def _read_ahead(self, chunk_id):
+        """Start decompressing the chunks following chunk_id."""
+        if self.readahead_pool is None:
+            self.readahead_pool = threadpool.ThreadPool(
+                self.session.GetParameter("ewf_readahead_threads") or
+                DEFAULT_READAHEAD_THREADS)
+            self.readahead_pid = os.getpid()
+
+        for next_chunk_id in xrange(chunk_id + 1,
+                                    min(chunk_id + 1 + self.readahead,
+                                        self._chunk_offset)):
+            if (next_chunk_id in self.pending_chunks or
+                    next_chunk_id in self.chunk_cache):
+                continue
+
+            # The file is only read from this thread.
+            data, compressed = self._read_raw_chunk(next_chunk_id)
+            if data is None:
+                break
+
+            if not compressed:
+                self.chunk_cache.Put(next_chunk_id, data)
+                continue
+
+            pending = PendingChunk(data, zlib.decompress)
+            self.pending_chunks[next_chunk_id] = pending
+            self.readahead_pool.AddTask(pending.Run)
+
     def read_chunk(self, chunk_id):
         """Read a single chunk from the file."""
+        # A pool inherited over fork() has no threads in this process.
+        if self.readahead_pool and self.readahead_pid != os.getpid():
+            self.after_fork()
+
+        # Sequential reads start decompressing the next chunks in the
+        # background. Chunks read ahead are dropped once reads are no longer
+        # sequential.
+        if self.readahead > 0:
+            if chunk_id == self.last_chunk_id + 1:
+                self._read_ahead(chunk_id)
+
+            elif chunk_id != self.last_chunk_id:
+                self._cancel_read_ahead()
+
+        self.last_chunk_id = chunk_id
+
         try:
             return self.chunk_cache.Get(chunk_id)
         except KeyError:
-            start_chunk, table_header, table = self.tables.find_le(chunk_id)
+            pass
 
-            # This should be a ewf_table_entry object but the below is faster.
-            try:
-                table_entry = table[chunk_id - start_chunk]
-            except IndexError:
+        pending = self.pending_chunks.pop(chunk_id, None)
+        data = pending and pending.Wait()
+        if data is None:
+            data, compressed = self._read_raw_chunk(chunk_id)
+            if data is None:
                 return ""
-            offset = table_entry & 0x7fffffff
-            next_offset = table[chunk_id - start_chunk + 1] & 0x7fffffff
-            compressed_chunk_size = next_offset - offset
 
-            data = self.address_space.read(
-                offset + table_header.base_offset, compressed_chunk_size)
-
-            if table_entry & 0x80000000:
+            if compressed:
                 data = zlib.decompress(data)
 
-            # Cache the chunk for later.
-            self.chunk_cache.Put(chunk_id, data)
+        # Cache the chunk for later.
+        self.chunk_cache.Put(chunk_id, data)
+
+        return data
 
-            return data
+    def _cancel_read_ahead(self):
+        """Drop the chunks being read ahead."""
+        for pending in self.pending_chunks.itervalues():
+            pending.Cancel()
+
+        self.pending_chunks.clear()
+
+    def after_fork(self):
+        """Forget the read-ahead state inherited from the parent process.
+
+        The pool's threads only exist in the parent, so nothing would ever
+        run the pending chunks here.
+        """
+        self.pending_chunks = {}
+        self.readahead_pool = None
+        self.readahead_pid = None
+
+    def close(self):
+        """Stop the read-ahead threads."""
+        self._cancel_read_ahead()
+        if self.readahead_pool:
+            self.readahead_pool.Stop()
+            self.readahead_pool = None
 
     def read_partial(self, offset, length):
         """Read as much as possible from the current offset."""
@@ -368,9 +527,13 @@ class EWFFileWriter(object):
     Encase/FTK. We produce EWFv1 files which are unable to store sparse
     images. We place an ELF file inside the EWF container to ensure we can
     efficiently store sparse memory ranges.
+
+    Chunks are compressed in a pool of compression_workers threads while the
+    caller produces more data. The compressed chunks are written in order, so
+    the file is identical to one written without the pool.
     """
 
-    def __init__(self, out_as, session):
+    def __init__(self, out_as, session, compression_level=None):
         self.out_as = out_as
         self.session = session
         self.profile = EWFProfile(session=self.session)
@@ -378,6 +541,22 @@ class EWFFileWriter(object):
         self.current_offset = 0
         self.chunk_id = 0
 
+        if compression_level is None:
+            compression_level = self.session.GetParameter(
+                "compression_level", 6)
+
+        self.compression_level = compression_level
+
+        # Chunks being compressed by the pool, in the order they are written.
+        self.pending_chunks = collections.deque()
+        self.compression_pool = None
+        workers = self.session.GetParameter("compression_workers") or 0
+        if workers > 1:
+            self.compression_pool = threadpool.ThreadPool(workers)
+
+        # The number of chunks we allow to be compressed ahead of the writer.
+        self.max_pending_chunks = 4 * workers
+
         self.last_section = None
 
         # Start off by writing the file header.
@@ -420,6 +599,9 @@ class EWFFileWriter(object):
 
         self.base_offset = self.current_offset = sectors_section.obj_end
 
+    def Compress(self, data):
+        return zlib.compress(data, self.compression_level)
+
     def write(self, data):
         """Writes the data into the file.
 
@@ -429,31 +611,62 @@ class EWFFileWriter(object):
         buffer_offset = 0
         while len(self.buffer) - buffer_offset >= self.chunk_size:
             data = self.buffer[buffer_offset:buffer_offset+self.chunk_size]
-            cdata = zlib.compress(data)
-            chunk_offset = self.current_offset - self.base_offset
+            buffer_offset += self.chunk_size
 
-            if len(cdata) > len(data):
-                self.table.append(chunk_offset)
-                cdata = data
-            else:
-                self.table.append(0x80000000 | chunk_offset)
+            if self.compression_pool is None:
+                self.WriteChunk(data, self.Compress(data))
+                continue
 
-            self.out_as.write(self.current_offset, cdata)
-            self.current_offset += len(cdata)
-            buffer_offset += self.chunk_size
-            self.chunk_id += 1
+            pending = PendingChunk(data, self.Compress)
+            self.pending_chunks.append(pending)
+            self.compression_pool.AddTask(pending.Run)
 
-            # Flush the table when it gets too large. Tables can only store 31
-            # bit offset and so can only address roughly 2gb. We choose to stay
-            # under 1gb: 30000 * 32kb = 0.91gb.
-            if len(self.table) > 30000:
-                self.session.report_progress(
-                    "Flushing EWF Table %s.", self.table_count)
-                self.FlushTable()
-                self.StartNewTable()
+            # Write all the chunks which are ready, waiting only if too many
+            # chunks are outstanding.
+            self.WritePendingChunks(
+                wait=len(self.pending_chunks) > self.max_pending_chunks)
 
         self.buffer = self.buffer[buffer_offset:]
 
+    def WritePendingChunks(self, wait=False):
+        """Write compressed chunks in order.
+
+        Args:
+          wait: If set, block until at least one chunk is written.
+        """
+        while self.pending_chunks and (
+                wait or self.pending_chunks[0].done.is_set()):
+            pending = self.pending_chunks.popleft()
+            cdata = pending.Wait()
+            if cdata is None:
+                cdata = self.Compress(pending.data)
+
+            self.WriteChunk(pending.data, cdata)
+            wait = False
+
+    def WriteChunk(self, data, cdata):
+        """Write a single chunk and add it to the table."""
+        chunk_offset = self.current_offset - self.base_offset
+
+        if len(cdata) > len(data):
+            self.table.append(chunk_offset)
+            cdata = data
+        else:
+            self.table.append(0x80000000 | chunk_offset)
+
+        self.out_as.write(self.current_offset, cdata)
+        self.current_offset += len(cdata)
+        self.chunk_id += 1
+
+        # Flush the table when it gets too large. Tables can only store 31
+        # bit offset and so can only address roughly 2gb. We choose to stay
+        # under 1gb: 30000 * 32kb = 0.91gb.
+        if len(self.table) > 30000:
+            self.session.report_progress(
+                "Flushing EWF Table %s.", self.table_count)
+            self.FlushTable()
+            self.StartNewTable()
+
     def FlushTable(self):
         """Flush the current table."""
         table_section = self.profile.ewf_section_descriptor_v1(
@@ -481,6 +694,14 @@ class EWFFileWriter(object):
         if len(self.buffer):
             self.write("\x00" * (self.chunk_size - len(self.buffer)))
 
+        # Wait for all the chunks to be compressed and written.
+        while self.pending_chunks:
+            self.WritePendingChunks(wait=True)
+
+        if self.compression_pool:
+            self.compression_pool.Stop()
+            self.compression_pool = None
+
         self.FlushTable()
 
         # Write the volume section.
@@ -0,0 +1,223 @@
+# Rekall Memory Forensics
+# Copyright 2014 Google Inc. All Rights Reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or (at
+# your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+#
+
+"""Tests for reading and writing EWF files."""
+import os
+import random
+import shutil
+import StringIO
+import tempfile
+import unittest
+
+from rekall import addrspace
+from rekall import scan
+from rekall import session
+from rekall import testlib
+from rekall.plugins.addrspaces import ewf as ewf_as
+from rekall.plugins.addrspaces import standard
+from rekall.plugins.tools import ewf
+
+
+class EWFFileTest(testlib.RekallBaseUnitTestCase):
+    """Test the EWF reader and writer."""
+
+    def setUp(self):
+        self.session = session.Session()
+        with self.session:
+            self.session.SetParameter("compression_workers", 0)
+
+        rand = random.Random(0)
+        self.data = "".join(chr(rand.randint(0, 255)) * rand.randint(1, 100)
+                            for _ in range(20000))
+
+        fd = StringIO.StringIO()
+        out_as = standard.WritableFDAddressSpace(
+            fhandle=fd, session=self.session)
+        with ewf.EWFFileWriter(out_as, session=self.session) as writer:
+            writer.write(self.data)
+
+        self.ewf_data = fd.getvalue()
+
+    def testPipelinedWriter(self):
+        # Chunks compressed in the pool produce exactly the same file.
+        for workers in (0, 3):
+            with self.session:
+                self.session.SetParameter("compression_workers", workers)
+
+            fd = StringIO.StringIO()
+            out_as = standard.WritableFDAddressSpace(
+                fhandle=fd, session=self.session)
+            with ewf.EWFFileWriter(out_as, session=self.session) as writer:
+                for i in range(0, len(self.data), 10000):
+                    writer.write(self.data[i:i + 10000])
+
+            self.assertEqual(fd.getvalue(), self.ewf_data)
+
+    def _OpenEWFFile(self, readahead):
+        with self.session:
+            self.session.SetParameter("ewf_readahead", readahead)
+
+        return ewf.EWFFile(
+            session=self.session, address_space=addrspace.BufferAddressSpace(
+                data=self.ewf_data, session=self.session))
+
+    def testReadAhead(self):
+        for readahead in (0, 4):
+            ewf_file = self._OpenEWFFile(readahead)
+            try:
+                # Sequential reads.
+                result = "".join(ewf_file.read(offset, 4096)
+                                 for offset in range(0, len(self.data), 4096))
+                self.assertEqual(result[:len(self.data)], self.data)
+
+                # Random reads.
+                rand = random.Random(1)
+                for _ in range(100):
+                    offset = rand.randint(0, len(self.data))
+                    self.assertEqual(ewf_file.read(offset, 100),
+                                     self.data[offset:offset + 100])
+            finally:
+                ewf_file.close()
+
+    def testCancel(self):
+        calls = []
+        pending = ewf.PendingChunk("data", calls.append)
+        pending.Cancel()
+        pending.Run()
+
+        # The function is not run but waiting does not block.
+        self.assertEqual(calls, [])
+        self.assertEqual(pending.Wait(), None)
+
+    def testNonSequentialRead(self):
+        ewf_file = self._OpenEWFFile(4)
+        try:
+            ewf_file.read(0, 100)
+            pending = ewf_file.pending_chunks.values()
+            self.assertTrue(pending)
+
+            # Jumping elsewhere in the file cancels the read ahead.
+            offset = len(self.data) / 2
+            self.assertEqual(ewf_file.read(offset, 100),
+                             self.data[offset:offset + 100])
+            self.assertTrue(all(x.cancelled for x in pending))
+        finally:
+            ewf_file.close()
+
+    def testClose(self):
+        ewf_file = self._OpenEWFFile(4)
+        ewf_file.read(0, 100)
+        workers = ewf_file.readahead_pool.workers
+        ewf_file.close()
+
+        self.assertEqual(ewf_file.readahead_pool, None)
+        self.assertEqual(ewf_file.pending_chunks, {})
+        self.assertFalse(any(x.is_alive() for x in workers))
+
+    def testReadAheadThreads(self):
+        with self.session:
+            self.session.SetParameter("ewf_readahead_threads", 2)
+
+        ewf_file = self._OpenEWFFile(4)
+        try:
+            ewf_file.read(0, 100)
+            self.assertEqual(len(ewf_file.readahead_pool.workers), 2)
+        finally:
+            ewf_file.close()
+
+    def testInheritedReadAhead(self):
+        ewf_file = self._OpenEWFFile(4)
+        ewf_file.read(0, 100)
+        inherited_pool = ewf_file.readahead_pool
+        try:
+            # Pretend the pool was started by our parent process. Its pending
+            # chunks would never complete here.
+            ewf_file.readahead_pid = -1
+            for pending in ewf_file.pending_chunks.values():
+                pending.done.clear()
+
+            chunk_size = ewf_file.chunk_size
+            self.assertEqual(ewf_file.read(chunk_size, 100),
+                             self.data[chunk_size:chunk_size + 100])
+
+            # A new pool was started for this process.
+            self.assertFalse(ewf_file.readahead_pool is inherited_pool)
+            self.assertEqual(ewf_file.readahead_pid, os.getpid())
+        finally:
+            inherited_pool.Stop()
+            ewf_file.close()
+
+    def _OpenEWFAddressSpace(self, temp_dir):
+        filename = os.path.join(temp_dir, "image.E01")
+        with open(filename, "wb") as fd:
+            fd.write(self.ewf_data)
+
+        return ewf_as.EWFAddressSpace(
+            session=self.session, base=standard.FileAddressSpace(
+                filename=filename, session=self.session))
+
+    def testParallelScan(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            with self.session:
+                self.session.SetParameter("ewf_readahead", 16)
+
+            address_space = self._OpenEWFAddressSpace(temp_dir)
+            needles = [self.data[5000:5010], self.data[-20:-10]]
+            scanner = scan.MultiStringScanner(
+                needles=needles, session=self.session,
+                address_space=address_space)
+
+            # Start the read ahead before the workers are forked.
+            expected = list(scanner.scan())
+            self.assertTrue(address_space.ewf_file.readahead_pool)
+            self.assertTrue(expected)
+
+            with self.session:
+                self.session.SetParameter("scan_workers", 2)
+
+            try:
+                self.assertEqual(list(scanner.scan()), expected)
+            finally:
+                with self.session:
+                    self.session.SetParameter("scan_workers", 0)
+
+            address_space.close()
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def testAddressSpaceClose(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            with self.session:
+                self.session.SetParameter("ewf_readahead", 4)
+
+            address_space = self._OpenEWFAddressSpace(temp_dir)
+            self.assertEqual(address_space.read(0, 100), self.data[:100])
+
+            # Closing the address space stops the read ahead threads.
+            workers = address_space.ewf_file.readahead_pool.workers
+            address_space.close()
+            self.assertEqual(address_space.ewf_file.readahead_pool, None)
+            self.assertFalse(any(x.is_alive() for x in workers))
+        finally:
+            shutil.rmtree(temp_dir)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -219,8 +219,11 @@ class StreamBasedAddressSpace(addrspace.CachingAddressSpaceMixIn,
         self.pages = pages
         self.PAGE_SIZE = page_size = int(page_size)
         i = 0
+        runs = []
         for i, page in enumerate(pages):
-            self.runs.insert((i * page_size, page * page_size, page_size))
+            runs.append((i * page_size, page * page_size, page_size))
+
+        self.set_runs(runs)
 
         # Record the total size of the file.
         self.size = (i+1) * page_size
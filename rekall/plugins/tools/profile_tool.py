@@ -90,6 +90,7 @@ import re
 import StringIO
 import yaml
 
+from rekall import compiled_profile
 from rekall import io_manager
 from rekall import plugin
 from rekall import registry
@@ -97,6 +98,7 @@ from rekall import testlib
 from rekall import utils
 
 from rekall.plugins import core
+from rekall.plugins.common import profile_index
 from rekall.plugins.overlays.linux import dwarfdump
 from rekall.plugins.overlays.linux import dwarfparser
 
@@ -343,6 +345,11 @@ class ConvertProfile(core.OutputFileMixin, plugin.Command):
 
     - Linux debug compiled kernel module (see tool/linux/README)
     - OSX Dwarfdump outputs.
+
+    With --compiled, an existing Rekall JSON profile is converted to the
+    compiled profile format (see rekall/compiled_profile.py). Store the output
+    next to the JSON profile, named with the ".compiled" suffix, so that
+    LoadProfile uses it automatically.
     """
 
     __name = "convert_profile"
@@ -360,17 +367,23 @@ class ConvertProfile(core.OutputFileMixin, plugin.Command):
             help="The name of the converter to use. "
             "If not specified autoguess.")
 
+        parser.add_argument(
+            "--compiled", default=False, type="Boolean",
+            help="Convert a Rekall JSON profile to the compiled format.")
+
         parser.add_argument("source",
                             help="Filename of profile to read.")
 
         super(ConvertProfile, cls).args(parser)
 
     def __init__(self, source=None, out_file=None,
-                 profile_class=None, converter=None, **kwargs):
+                 profile_class=None, converter=None, compiled=False,
+                 **kwargs):
         super(ConvertProfile, self).__init__(out_file=out_file, **kwargs)
         self.profile_class = profile_class
         self.converter = converter
         self.source = source
+        self.compiled = compiled
 
     def ConvertProfile(self, input, output):
         """Converts the input profile to a new standard profile in output."""
@@ -386,8 +399,28 @@ class ConvertProfile(core.OutputFileMixin, plugin.Command):
         raise RuntimeError(
             "No suitable converter found - profile not recognized.")
 
+    def CompileProfile(self, output):
+        """Write the source JSON profile in the compiled format."""
+        path = os.path.abspath(self.source)
+
+        # The directory IO manager also looks for gzip compressed profiles.
+        if path.endswith(".gz"):
+            path = path[:-3]
+
+        container = io_manager.DirectoryIOManager(
+            os.path.dirname(path), version=None)
+        data = container.GetData(os.path.basename(path))
+        if not data:
+            raise IOError("%s is not a Rekall profile." % self.source)
+
+        output.write(compiled_profile.CompileProfile(data))
+        logging.info("Compiled %s to %s", self.source, output.name)
+
     def render(self, renderer):
         with renderer.open(filename=self.out_file, mode="wb") as output:
+            if self.compiled:
+                return self.CompileProfile(output)
+
             if self.converter:
                 cls = ProfileConverter.classes.get(self.converter)
                 if not cls:
@@ -451,7 +484,9 @@ class BuildIndex(plugin.Command):
 
     The result is an index profile. This has an $INDEX section which is a dict,
     with keys being the profile name, and values being a list of (offset, match)
-    tuples. For example:
+    tuples. The $OFFSET_INDEX section inverts this, mapping each offset and
+    value to the profiles which expect it (see
+    profile_index.BuildOffsetIndex()). For example:
 
     {
      "$INDEX": {
@@ -621,6 +656,9 @@ class BuildIndex(plugin.Command):
         # Make sure to issue warnings if the index is not good enough.
         self.ValidateDataIndex(index, spec)
 
+        # The inverted index allows the reader to check each offset only once.
+        result["$OFFSET_INDEX"] = profile_index.BuildOffsetIndex(index)
+
         return result
 
     def BuildStructIndex(self, spec):
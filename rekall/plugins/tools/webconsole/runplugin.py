@@ -23,13 +23,20 @@
 __author__ = "Mikhail Bushkov <realbushman@gmail.com>"
 
 
+import Queue
 import cStringIO
 import hashlib
 import logging
 import os
 import stat
+import threading
+import time
 import traceback
 import zipfile
+import zlib
+
+import gevent
+from gevent import threadpool
 
 from flask import jsonify
 from flask import json
@@ -46,6 +53,114 @@ from flask_sockets import Sockets
 from manuskript import plugin as manuskript_plugin
 
 
+config.DeclareOption(
+    "--webconsole_workers", default=4, type="IntParser",
+    help="The number of cells the web console may run concurrently.")
+
+config.DeclareOption(
+    "--webconsole_frame_size", default=200, type="IntParser",
+    help="The maximum number of messages the web console batches into a "
+    "single websocket frame.")
+
+
+# Pending messages are sent at least this often (in seconds).
+FRAME_INTERVAL = 0.5
+
+# The number of frames which may be waiting for the websocket before the plugin
+# is blocked.
+MAX_PENDING_FRAMES = 16
+
+# How often the websocket handler checks for new frames (in seconds).
+POLL_INTERVAL = 0.05
+
+# These cache entries hold the process context. They are copied back to the
+# main session when a cell switches context, so the next cell runs in it too.
+PROCESS_CONTEXT_PARAMETERS = ("process_context", "default_address_space")
+
+
+class ClientDisconnected(IOError):
+    """Raised in the plugin's thread when the client has gone away."""
+
+
+class CellOutputStream(object):
+    """Carries the frames of a running cell from its plugin to the client.
+
+    The plugin runs in a worker thread and puts serialized frames into a bounded
+    queue. When the client can not keep up the queue fills, and the plugin
+    blocks until frames are drained (backpressure).
+
+    The websocket handler drains the queue, sends each frame to the client and
+    appends it to the cell's cache in the worksheet, so the cache is written as
+    the plugin runs.
+    """
+
+    def __init__(self, ws, cache_fd, compression=None):
+        self.ws = ws
+        self.cache_fd = cache_fd
+        self.compression = compression
+        self.frames = Queue.Queue(MAX_PENDING_FRAMES)
+        self.cancelled = threading.Event()
+        self.cached_frames = 0
+
+    def Put(self, frame):
+        """Queue a frame for sending. Called from the plugin's thread."""
+        while not self.cancelled.is_set():
+            try:
+                self.frames.put(frame, timeout=1)
+                return
+            except Queue.Full:
+                pass
+
+        raise ClientDisconnected("Client disconnected.")
+
+    def Close(self):
+        """Signal that the plugin is done. Called from the plugin's thread."""
+        try:
+            self.Put(None)
+        except ClientDisconnected:
+            pass
+
+    def Drain(self):
+        """Send all frames to the client until the plugin is done.
+
+        This runs in the websocket's greenlet so it must never block on the
+        queue - it polls it instead to give other greenlets a chance to run.
+        """
+        while True:
+            try:
+                frame = self.frames.get_nowait()
+            except Queue.Empty:
+                gevent.sleep(POLL_INTERVAL)
+                continue
+
+            if frame is None:
+                return
+
+            # Discard the rest of the frames so the plugin is not blocked.
+            if self.cancelled.is_set():
+                continue
+
+            try:
+                self._Send(frame)
+            except Exception as e:  # pylint: disable=broad-except
+                logging.info("Unable to send to client: %s", e)
+                self.cancelled.set()
+
+    def _Send(self, frame):
+        if self.compression == "zlib":
+            self.ws.send(zlib.compress(frame), binary=True)
+        else:
+            self.ws.send(frame)
+
+        # The cache holds a single list of all the messages, so we strip the
+        # brackets from each frame.
+        if self.cached_frames:
+            self.cache_fd.write(",")
+
+        self.cache_fd.write(frame[1:-1])
+        self.cached_frames += 1
+
+
 class FakeParser(object):
     """Fake parser used to reflect on Replugins' arguments."""
 
@@ -114,25 +229,89 @@ class WebConsoleRenderer(data_export.DataExportRenderer):
     spinner = r"/-\|"
     last_spin = 0
 
-    def __init__(self, ws=None, worksheet=None, cell_id=0, **kwargs):
+    def __init__(self, output_stream=None, worksheet=None, cell_id=0,
+                 **kwargs):
         """Initialize a WebConsoleRenderer.
 
         Args:
-          ws: A websocket we use to stream messages over.
+          output_stream: A CellOutputStream we send frames over.
           worksheet: The worksheet file to store files.
           cell_id: The cell id we are running under.
         """
         super(WebConsoleRenderer, self).__init__(**kwargs)
-        self.ws = ws
+        self.output_stream = output_stream
         self.cell_id = cell_id
         self.worksheet = worksheet
-        self.queue = []
+        self.frame_size = self.session.GetParameter(
+            "webconsole_frame_size", 200)
+
+        # Messages waiting to be sent in the next frame.
+        self.pending = []
+        self.last_frame_time = time.time()
+
+        # Protects the pending messages from the flusher thread.
+        self.lock = threading.RLock()
+        self.finished = threading.Event()
+
+    def start(self, plugin_name=None, kwargs=None):
+        super(WebConsoleRenderer, self).start(
+            plugin_name=plugin_name, kwargs=kwargs)
+
+        # The plugin may spend a long time between messages, so pending
+        # messages are also sent from a separate thread.
+        self.finished.clear()
+        flusher = threading.Thread(target=self._FlushPeriodically)
+        flusher.daemon = True
+        flusher.start()
+
+        return self
+
+    def end(self):
+        self.finished.set()
+        super(WebConsoleRenderer, self).end()
+
+    def _FlushPeriodically(self):
+        """Send the pending messages which are older than FRAME_INTERVAL."""
+        while not self.finished.wait(FRAME_INTERVAL):
+            with self.lock:
+                if (self.pending and
+                        time.time() > self.last_frame_time + FRAME_INTERVAL):
+                    try:
+                        self.SendFrame()
+                    except ClientDisconnected:
+                        return
 
     def SendMessage(self, message):
-        self.ws.send(json.dumps([message],
-                                cls=json_renderer.RobustEncoder))
-
-        self.queue.append(message)
+        # Stop the plugin as soon as the client goes away.
+        if self.output_stream.cancelled.is_set():
+            raise ClientDisconnected("Client disconnected.")
+
+        with self.lock:
+            # A progress message supersedes the one before it, so there is no
+            # point in sending both.
+            if (message[0] == "p" and self.pending and
+                    self.pending[-1][0] == "p"):
+                self.pending[-1] = message
+            else:
+                self.pending.append(message)
+
+            if (len(self.pending) >= self.frame_size or
+                    time.time() > self.last_frame_time + FRAME_INTERVAL):
+                self.SendFrame()
+
+    def SendFrame(self):
+        """Send all the pending messages in a single frame."""
+        with self.lock:
+            self.last_frame_time = time.time()
+            if self.pending:
+                frame = json.dumps(self.pending,
+                                   cls=json_renderer.RobustEncoder)
+                self.pending = []
+                self.output_stream.Put(frame)
+
+    def flush(self):
+        super(WebConsoleRenderer, self).flush()
+        self.SendFrame()
 
     def RenderProgress(self, message=" %(spinner)s", *args, **kwargs):
         if super(WebConsoleRenderer, self).RenderProgress():
@@ -176,6 +355,21 @@ class WebConsoleRenderer(data_export.DataExportRenderer):
         return self.worksheet.Open(full_path)
 
 
+def SyncProcessContext(cell_session, session, start_context):
+    """Copy a process context switch in the cell back to the main session.
+
+    Args:
+      cell_session: The session the cell ran in.
+      session: The main session.
+      start_context: The process context the cell started in.
+    """
+    if cell_session.state.cache.get("process_context") is start_context:
+        return
+
+    for parameter in PROCESS_CONTEXT_PARAMETERS:
+        session.SetCache(parameter, cell_session.state.cache.get(parameter))
+
+
 def GenerateCacheKey(state):
     data = json.dumps(state, sort_keys=True)
     hash = hashlib.md5(data).hexdigest()
@@ -451,40 +645,105 @@ class RekallRunPlugin(manuskript_plugin.Plugin):
     def PlugRunPluginsIntoApp(cls, app):
         sockets = Sockets(app)
 
+        # Plugins run in these worker threads so that a long running cell does
+        # not block the server, and several cells may run at once.
+        pool = threadpool.ThreadPool(
+            app.config["rekall_session"].GetParameter(
+                "webconsole_workers", 4))
+
+        # Each cell runs in its own clone of the main session, which is kept
+        # for when the cell is run again. The clones start with the main
+        # session's cache so the profile and address spaces are not detected
+        # again for each cell.
+        cell_sessions = {}
+        busy_sessions = set()
+
+        def GetCellSession(cell_id):
+            session = app.config["rekall_session"]
+            cell_session = cell_sessions.get(cell_id)
+
+            # If the cell is still running in its session (e.g. it was
+            # restarted), use a new one.
+            if cell_session is None or id(cell_session) in busy_sessions:
+                cell_session = session.clone(copy_cache=True)
+                cell_sessions[cell_id] = cell_session
+            else:
+                # Run in the current process context of the main session.
+                for parameter in PROCESS_CONTEXT_PARAMETERS:
+                    cell_session.SetCache(
+                        parameter, session.state.cache.get(parameter))
+
+            busy_sessions.add(id(cell_session))
+            return cell_session
+
+        def RunCell(renderer, plugin_name, kwargs):
+            """Runs the plugin in a worker thread."""
+            start_context = renderer.session.state.cache.get("process_context")
+            try:
+                with renderer.start():
+                    try:
+                        renderer.session.RunPlugin(
+                            plugin_name, renderer=renderer, **kwargs)
+                    except ClientDisconnected:
+                        raise
+                    except Exception:
+                        message = traceback.format_exc()
+                        renderer.report_error(message)
+
+            except ClientDisconnected:
+                logging.info("Client disconnected, aborting %s", plugin_name)
+
+            finally:
+                SyncProcessContext(renderer.session,
+                                   app.config["rekall_session"], start_context)
+                renderer.output_stream.Close()
+
         @sockets.route("/rekall/runplugin")
         def rekall_run_plugin_socket(ws):  # pylint: disable=unused-variable
             cell = json.loads(ws.receive())
             cell_id = cell["cell_id"]
             source = cell["source"]
-            rekall_session = app.config["rekall_session"]
             worksheet = app.config["worksheet"]
 
-            # If the data is cached locally just return it.
+            # If the data is cached locally just return it. The cache is
+            # already a json list of messages so it is sent as is.
             cache_key = "%s/%s" % (cell_id, GenerateCacheKey(source))
-            cache = worksheet.GetData(cache_key)
+            cache = worksheet.GetData(cache_key, raw=True)
             if cache:
                 logging.debug("Dumping request from cache")
-                ws.send(json.dumps(cache))
+                ws.send(cache)
                 return
 
             kwargs = source["arguments"]
+            cell_session = GetCellSession(cell_id)
+
+            try:
+                with worksheet.Create(cache_key) as cache_fd:
+                    cache_fd.write("[")
+                    output_stream = CellOutputStream(
+                        ws, cache_fd, compression=cell.get("compression"))
+
+                    renderer = WebConsoleRenderer(
+                        session=cell_session, output=cStringIO.StringIO(),
+                        cell_id=cell_id, output_stream=output_stream,
+                        worksheet=worksheet)
+
+                    pool.spawn(RunCell, renderer, source["plugin"]["name"],
+                               kwargs)
+
+                    output_stream.Drain()
+
+                    # Do not cache incomplete output.
+                    if output_stream.cancelled.is_set():
+                        raise ClientDisconnected("Client disconnected.")
+
+                    cache_fd.write("]")
+
+            except ClientDisconnected:
+                pass
 
-            output = cStringIO.StringIO()
-            renderer = WebConsoleRenderer(
-                session=rekall_session, output=output, cell_id=cell_id,
-                ws=ws, worksheet=worksheet)
-
-            with renderer.start():
-                try:
-                    rekall_session.RunPlugin(source["plugin"]["name"],
-                                             renderer=renderer,
-                                             **kwargs)
-                except Exception:
-                    message = traceback.format_exc()
-                    renderer.report_error(message)
-
-            # Cache the data in the worksheet.
-            worksheet.StoreData(cache_key, renderer.queue)
+            finally:
+                busy_sessions.discard(id(cell_session))
 
     @classmethod
     def PlugIntoApp(cls, app):
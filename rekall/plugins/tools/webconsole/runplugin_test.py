@@ -0,0 +1,170 @@
+import cStringIO
+import json
+import threading
+import time
+import unittest
+
+from rekall import session
+from rekall import testlib
+
+try:
+    from rekall.plugins.tools.webconsole import runplugin
+except ImportError:
+    # The web console dependencies (gevent, flask) are not installed.
+    runplugin = None
+
+
+class FakeWebSocket(object):
+    def __init__(self, fail=False):
+        self.sent = []
+        self.fail = fail
+
+    def send(self, data, binary=False):
+        _ = binary
+        if self.fail:
+            raise IOError("Connection closed.")
+
+        self.sent.append(data)
+
+
+@unittest.skipIf(runplugin is None, "The web console is not installed.")
+class CellOutputStreamTest(testlib.RekallBaseUnitTestCase):
+    """Test sending a cell's frames to the client."""
+
+    def setUp(self):
+        self.ws = FakeWebSocket()
+        self.cache_fd = cStringIO.StringIO()
+        self.stream = runplugin.CellOutputStream(self.ws, self.cache_fd)
+
+    def testDrain(self):
+        self.stream.Put('[["m", 1]]')
+        self.stream.Put('[["r", 2], ["r", 3]]')
+        self.stream.Close()
+        self.stream.Drain()
+
+        self.assertEqual(self.ws.sent, ['[["m", 1]]', '[["r", 2], ["r", 3]]'])
+
+        # The cache is written as a single list as the frames are sent.
+        self.assertEqual(json.loads("[%s]" % self.cache_fd.getvalue()),
+                         [["m", 1], ["r", 2], ["r", 3]])
+
+    def testBackpressure(self):
+        for i in range(runplugin.MAX_PENDING_FRAMES):
+            self.stream.Put("[%d]" % i)
+
+        # The queue is full so the plugin blocks until the frames are sent.
+        producer = threading.Thread(target=self.stream.Close)
+        producer.start()
+        producer.join(0.2)
+        self.assertTrue(producer.is_alive())
+
+        self.stream.Drain()
+        producer.join()
+        self.assertEqual(len(self.ws.sent), runplugin.MAX_PENDING_FRAMES)
+
+    def testDisconnect(self):
+        self.ws.fail = True
+        self.stream.Put("[1]")
+        self.stream.Put("[2]")
+        self.stream.Close()
+        self.stream.Drain()
+
+        self.assertTrue(self.stream.cancelled.is_set())
+        self.assertEqual(self.cache_fd.getvalue(), "")
+
+        # The plugin is stopped when it sends more data.
+        self.assertRaises(runplugin.ClientDisconnected, self.stream.Put, "[3]")
+
+
+@unittest.skipIf(runplugin is None, "The web console is not installed.")
+class WebConsoleRendererTest(testlib.RekallBaseUnitTestCase):
+    """Test batching messages into frames."""
+
+    def setUp(self):
+        self.session = session.Session()
+        with self.session:
+            self.session.SetParameter("webconsole_frame_size", 3)
+
+        self.stream = runplugin.CellOutputStream(
+            FakeWebSocket(), cStringIO.StringIO())
+
+        self.renderer = runplugin.WebConsoleRenderer(
+            session=self.session, output=cStringIO.StringIO(),
+            output_stream=self.stream)
+
+    def GetFrames(self):
+        frames = []
+        while not self.stream.frames.empty():
+            frames.append(json.loads(self.stream.frames.get()))
+
+        return frames
+
+    def testFrameSize(self):
+        self.renderer.last_frame_time = time.time() + 60
+        for i in range(7):
+            self.renderer.SendMessage(["r", i])
+
+        self.assertEqual(self.GetFrames(),
+                         [[["r", 0], ["r", 1], ["r", 2]],
+                          [["r", 3], ["r", 4], ["r", 5]]])
+
+        self.renderer.SendFrame()
+        self.assertEqual(self.GetFrames(), [[["r", 6]]])
+
+    def testProgress(self):
+        self.renderer.last_frame_time = time.time() + 60
+        self.renderer.SendMessage(["r", 1])
+        self.renderer.SendMessage(["p", "one"])
+        self.renderer.SendMessage(["p", "two"])
+        self.renderer.SendFrame()
+
+        # Only the last progress message is sent.
+        self.assertEqual(self.GetFrames(), [[["r", 1], ["p", "two"]]])
+
+    def testFlushPeriodically(self):
+        with self.renderer.start():
+            self.renderer.SendMessage(["r", 1])
+
+            # The plugin is busy so the message is sent by the flusher.
+            time.sleep(runplugin.FRAME_INTERVAL * 3)
+            messages = sum(self.GetFrames(), [])
+            self.assertEqual(messages[-1], ["r", 1])
+            self.assertEqual(self.renderer.pending, [])
+
+    def testDisconnect(self):
+        self.stream.cancelled.set()
+        self.assertRaises(runplugin.ClientDisconnected,
+                          self.renderer.SendMessage, ["r", 1])
+
+
+@unittest.skipIf(runplugin is None, "The web console is not installed.")
+class SyncProcessContextTest(testlib.RekallBaseUnitTestCase):
+    """Test sharing the process context between cells."""
+
+    def setUp(self):
+        self.session = session.Session()
+        self.cell_session = session.Session()
+        self.session.SetCache("process_context", "kernel")
+
+    def testSwitch(self):
+        self.cell_session.SetCache("process_context", "process")
+        self.cell_session.SetCache("default_address_space", "process_as")
+        runplugin.SyncProcessContext(self.cell_session, self.session, None)
+
+        self.assertEqual(self.session.GetParameter("process_context"),
+                         "process")
+        self.assertEqual(self.session.GetParameter("default_address_space"),
+                         "process_as")
+
+    def testNoSwitch(self):
+        # A cell which did not switch context leaves the main session alone.
+        context = object()
+        self.cell_session.SetCache("process_context", context)
+        runplugin.SyncProcessContext(self.cell_session, self.session, context)
+
+        self.assertEqual(self.session.GetParameter("process_context"),
+                         "kernel")
+
+
+if __name__ == "__main__":
+    unittest.main()
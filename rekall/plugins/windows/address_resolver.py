@@ -19,6 +19,7 @@
 """The module implements the windows specific address resolution plugin."""
 
 __author__ = "Michael Cohen <scudette@gmail.com>"
+import bisect
 import logging
 import re
 
@@ -45,11 +46,28 @@ class WindowsAddressResolver(address_resolver.AddressResolverMixin,
 
     def __init__(self, **kwargs):
         super(WindowsAddressResolver, self).__init__(**kwargs)
+        self.Reset()
+
+    def Reset(self):
+        """Forget all the modules, profiles and resolved addresses."""
         self.vad = None
         self.modules = None
         self.modules_by_name = {}
+        self.profiles = {}
+
+        # Sorted (base, end, module) tuples for the kernel modules.
+        self._module_ranges = None
+
+        # Memo of resolved addresses, keyed by process context.
+        self._resolved = {}
 
     def _EnsureInitialized(self):
+        # The kernel profile was replaced, so everything we resolved with the
+        # old one is stale.
+        if (self.modules is not None and
+                self.profiles.get("nt") is not self.session.profile):
+            self.Reset()
+
         if self.modules is None:
             try:
                 self.modules = self.session.plugins.modules()
@@ -64,6 +82,10 @@ class WindowsAddressResolver(address_resolver.AddressResolverMixin,
                 self.profiles["nt"] = self.session.profile
                 self.modules_by_name["nt"] = KernelModule(self.session)
 
+                # The resolved addresses depend on the modules.
+                self._module_ranges = None
+                self._resolved = {}
+
             except AttributeError:
                 self.modules = None
 
@@ -346,54 +368,117 @@ class WindowsAddressResolver(address_resolver.AddressResolverMixin,
         return ""
 
     def get_nearest_constant_by_address(self, address):
+        return self.resolve_many([address])[0]
+
+    def resolve_many(self, addresses):
+        """Resolve many addresses to their nearest symbols at once.
+
+        This is equivalent to calling get_nearest_constant_by_address() for
+        each address, but the addresses are sorted so that the kernel modules,
+        the process VADs and each module's profile constants are swept only
+        once. Results are remembered for the lifetime of this resolver.
+
+        Returns:
+          A list of (nearest_offset, full_name) tuples in the same order as
+          addresses.
+        """
         self._EnsureInitialized()
 
-        address = obj.Pointer.integer_to_address(address)
-        nearest_offset = 0
-        full_name = module_name = symbol_name = ""
-        profile = None
+        addresses = [obj.Pointer.integer_to_address(x) for x in addresses]
 
-        # Find the containing module and see if we have a profile for it.
-        containing_module = self._FindContainingModule(address)
-        if containing_module:
-            nearest_offset = containing_module.base
-            full_name = module_name = self.NormalizeModuleName(
-                containing_module)
+        context = repr(self.session.GetParameter("process_context") or
+                       "Kernel")
+        resolved = self._resolved.setdefault(context, {})
 
-            # Try to load the module profile.
-            profile = self.LoadProfileForName(module_name)
-            if profile:
-                offset, name = profile.get_nearest_constant_by_address(
+        pending = sorted(set(x for x in addresses if x not in resolved))
+        if pending:
+            resolved.update(self._ResolveSortedAddresses(pending))
+
+        return [resolved[x] for x in addresses]
+
+    def _GetModuleRanges(self):
+        if self._module_ranges is None and self.modules:
+            self._module_ranges = []
+            for base in self.modules.addresses():
+                module = self.modules.mod_lookup[base]
+                self._module_ranges.append(
+                    (base, base + module.SizeOfImage.v(), module))
+
+        return self._module_ranges or []
+
+    def _ResolveSortedAddresses(self, addresses):
+        """Resolve a sorted list of addresses.
+
+        Returns:
+          A dict mapping each address to (nearest_offset, full_name).
+        """
+        result = {}
+
+        # Assign each address to its containing kernel module.
+        module_ranges = self._GetModuleRanges()
+        module_bases = [x[0] for x in module_ranges]
+        in_module = {}
+        outside_modules = []
+        i = 0
+        for address in addresses:
+            i = bisect.bisect_right(module_bases, address, i)
+            if i and address < module_ranges[i-1][1]:
+                in_module.setdefault(i-1, []).append(address)
+            else:
+                outside_modules.append(address)
+
+        for i, module_addresses in in_module.iteritems():
+            base, _, module = module_ranges[i]
+            module_name = self.NormalizeModuleName(module)
+            self._ResolveInModule(
+                result, module_addresses, base, module_name, module_name,
+                self.LoadProfileForName(module_name))
+
+        if not outside_modules:
+            return result
+
+        # Maybe the addresses are in userspace.
+        vads = self.GetVADs()
+        if vads:
+            vad_hits = vads.find_le_many(outside_modules)
+        else:
+            vad_hits = [None] * len(outside_modules)
+
+        in_vad = {}
+        for address, vad_desc in zip(outside_modules, vad_hits):
+            # The address must also fall before the end of the VAD.
+            if vad_desc is None or address > vad_desc[1]:
+                result[address] = (0, "")
+            else:
+                in_vad.setdefault(vad_desc[0], (vad_desc, []))[1].append(
                     address)
 
-                # The profile's constant is closer than the module.
-                if address - offset < address - nearest_offset:
-                    nearest_offset = offset
-                    symbol_name = name
+        for vad_desc, vad_addresses in in_vad.itervalues():
+            start, _, filename, _ = vad_desc
+            module_name = self.NormalizeModuleName(filename)
+            self._ResolveInModule(
+                result, vad_addresses, start, module_name, filename,
+                self.LoadProfileForDll(start, module_name))
 
-            if symbol_name:
-                full_name = "%s!%s" % (module_name, symbol_name)
+        return result
+
+    def _ResolveInModule(self, result, addresses, base, module_name,
+                         full_name, profile):
+        """Resolve sorted addresses against a module's profile."""
+        if profile:
+            hits = profile.get_nearest_constants_by_address(addresses)
         else:
-            vad_desc = self.FindProcessVad(address)
-            if vad_desc:
-                start, _, full_name, _ = vad_desc
-                module_name = self.NormalizeModuleName(full_name)
-                nearest_offset = start
-                profile = self.LoadProfileForDll(start, module_name)
-
-                if profile:
-                    offset, name = profile.get_nearest_constant_by_address(
-                        address)
-
-                    # The profile's constant is closer than the module.
-                    if address - offset < address - nearest_offset:
-                        nearest_offset = offset
-                        symbol_name = name
-
-                if symbol_name:
-                    full_name = "%s!%s" % (module_name, symbol_name)
-
-        return nearest_offset, full_name
+            hits = [(base, "")] * len(addresses)
+
+        for address, (offset, name) in zip(addresses, hits):
+            # The profile's constant is closer than the module.
+            if address - offset < address - base:
+                if name:
+                    result[address] = (offset, "%s!%s" % (module_name, name))
+                else:
+                    result[address] = (offset, full_name)
+            else:
+                result[address] = (base, full_name)
 
     def search_symbol(self, pattern):
         # Currently we only allow searching in the same module.
@@ -0,0 +1,194 @@
+"""Tests for the windows address resolver."""
+
+import unittest
+
+from rekall import addrspace
+from rekall import obj
+from rekall import session
+from rekall import testlib
+from rekall import utils
+
+# Import and register all the plugins.
+from rekall import plugins # pylint: disable=unused-import
+from rekall.plugins.windows import address_resolver
+
+
+class FakeTask(object):
+    def __init__(self, pid):
+        self.pid = pid
+
+    def __repr__(self):
+        return "<FakeTask %s>" % self.pid
+
+
+class FakeImageSize(object):
+    def __init__(self, size):
+        self.size = size
+
+    def v(self):
+        return self.size
+
+
+class FakeModule(object):
+    def __init__(self, name, base, size):
+        self.name = name
+        self.base = base
+        self.SizeOfImage = FakeImageSize(size)
+
+
+class FakeModulesPlugin(object):
+    """Serves the kernel modules like the modules plugin."""
+
+    def __init__(self, modules):
+        self.mod_lookup = dict((x.base, x) for x in modules)
+
+    def addresses(self):
+        return sorted(self.mod_lookup)
+
+    def find_module(self, address):
+        for module in self.mod_lookup.itervalues():
+            if module.base <= address < module.base + module.SizeOfImage.v():
+                return module
+
+
+class FakeVadPlugin(object):
+    """Serves the VAD index of each fake task."""
+
+    def __init__(self, vads):
+        self.vads = vads
+
+    def GetVadsForProcess(self, task):
+        return self.vads.get(task.pid)
+
+    def find_file_in_task(self, address, task):
+        try:
+            return self.GetVadsForProcess(task).find_le(address)
+        except ValueError:
+            pass
+
+
+class AddressResolverTest(testlib.RekallBaseUnitTestCase):
+    """Test the batched address resolution."""
+
+    def setUp(self):
+        self.session = session.Session()
+        with self.session:
+            self.session.SetParameter(
+                "profile", obj.Profile.classes["Profile32Bits"](
+                    session=self.session))
+
+            address_space = addrspace.BufferAddressSpace(
+                data="\x00" * 0x100, session=self.session)
+            self.session.physical_address_space = address_space
+            self.session.kernel_address_space = address_space
+
+        self.task = FakeTask(1)
+        self.vad_plugin = FakeVadPlugin({
+            1: utils.IntervalIndex([
+                (0x10000, 0x1ffff, u"C:\\Windows\\System32\\kernel32.dll",
+                 None),
+                (0x40000, 0x40fff, u"", None),
+            ])})
+
+        self.dll_profile = self._MakeProfile(
+            "kernel32", CreateFileW=0x11000, ReadFile=0x12000)
+
+    def _MakeProfile(self, name, **constants):
+        profile = obj.Profile.classes["Profile32Bits"](
+            name=name, session=self.session)
+        profile.add_constants(constants_are_addresses=True, **constants)
+
+        return profile
+
+    def _MakeResolver(self, modules=()):
+        resolver = address_resolver.WindowsAddressResolver(
+            session=self.session)
+
+        resolver.modules = FakeModulesPlugin(modules)
+        for module in modules:
+            resolver.modules_by_name[module.name] = module
+
+        resolver.profiles["nt"] = self.session.profile
+        resolver.vad = self.vad_plugin
+        resolver.profiles["kernel32"] = self.dll_profile
+
+        # A driver without a profile.
+        resolver.profiles["tcpip"] = None
+
+        return resolver
+
+    def testVadResolution(self):
+        with self.session:
+            self.session.SetParameter("process_context", self.task)
+
+        addresses = [0x12010, 0x5000, 0x10010, 0x40010, 0x30000, 0x11000]
+        self.assertEqual(
+            self._MakeResolver().resolve_many(addresses),
+            [(0x12000, "kernel32!ReadFile"),
+             # Below all the VADs.
+             (0, ""),
+             # Before the first constant in the DLL.
+             (0x10000, u"C:\\Windows\\System32\\kernel32.dll"),
+             # A VAD without a file.
+             (0x40000, u""),
+             # Past the end of the kernel32 VAD.
+             (0, ""),
+             (0x11000, "kernel32!CreateFileW")])
+
+    def testModulesAndVads(self):
+        self.session.profile.add_constants(
+            constants_are_addresses=True,
+            KiServiceTable=0x80001000, NtCreateFile=0x80002000)
+
+        modules = [FakeModule("nt", 0x80000000, 0x100000),
+                   FakeModule("tcpip", 0x90000000, 0x1000)]
+
+        with self.session:
+            self.session.SetParameter("process_context", self.task)
+
+        addresses = [0x80002004, 0x12010, 0x90000010, 0x80000010,
+                     0x90001000, 0x80001000, 0x40010, 0x80002004, 0x5000]
+
+        results = self._MakeResolver(modules).resolve_many(addresses)
+        self.assertEqual(results[0], (0x80002000, "nt!NtCreateFile"))
+        self.assertEqual(results[2], (0x90000000, "tcpip"))
+        self.assertEqual(results[4], (0, ""))
+
+        # Resolving one address at a time gives the same results.
+        for address, result in zip(addresses, results):
+            resolver = self._MakeResolver(modules)
+            self.assertEqual(
+                resolver.get_nearest_constant_by_address(address), result)
+
+    def testReset(self):
+        resolver = self._MakeResolver()
+        with self.session:
+            self.session.SetParameter("process_context", self.task)
+
+        self.assertEqual(resolver.resolve_many([0x12010]),
+                         [(0x12000, "kernel32!ReadFile")])
+
+        # Reset() forgets the memo along with the profiles.
+        resolver.Reset()
+        self.assertEqual(resolver._resolved, {})
+        self.assertEqual(resolver.profiles, {})
+
+        # A new kernel profile invalidates what we resolved before.
+        resolver = self._MakeResolver()
+        resolver.resolve_many([0x12010])
+        with self.session:
+            self.session.SetParameter(
+                "profile", obj.Profile.classes["Profile32Bits"](
+                    session=self.session))
+
+        resolver._EnsureInitialized()
+        self.assertEqual(resolver._resolved, {})
+
+    def testKernelContext(self):
+        # Outside a process context the VADs are not used.
+        self.assertEqual(
+            self._MakeResolver().resolve_many([0x12010]), [(0, "")])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -27,6 +27,7 @@
 import collections
 import logging
 import re
+import struct
 
 from rekall import addrspace
 from rekall import scan
@@ -210,6 +211,17 @@ class PoolTagCheck(scan.StringCheck):
         return super(PoolTagCheck, self).check(
             buffer_as, offset + self.tag_offset)
 
+    def find_all(self, buffer_as, offset):
+        """Yields all the _POOL_HEADER offsets with the tag from offset."""
+        buffer_offset = buffer_as.get_buffer_offset(offset) + self.tag_offset
+        while True:
+            buffer_offset = buffer_as.data.find(self.needle, buffer_offset)
+            if buffer_offset == -1:
+                return
+
+            yield buffer_as.base_offset + buffer_offset - self.tag_offset
+            buffer_offset += 1
+
 
 class MultiPoolTagCheck(scan.MultiStringFinderCheck):
     """This scanner checks for the occurrence of a pool tag.
@@ -231,9 +243,44 @@ class MultiPoolTagCheck(scan.MultiStringFinderCheck):
         return super(MultiPoolTagCheck, self).check(
             buffer_as, offset + self.tag_offset)
 
+    def find_all(self, buffer_as, offset):
+        """Yields all the _POOL_HEADER offsets with any tag from offset."""
+        buffer_offset = buffer_as.get_buffer_offset(offset) + self.tag_offset
+        for hit_offset in sorted(set(
+                hit_offset for _, hit_offset in self.get_hits(buffer_as))):
+            if hit_offset >= buffer_offset:
+                yield buffer_as.base_offset + hit_offset - self.tag_offset
+
+
+class PoolHeaderFieldCheck(scan.ScannerCheck):
+    """A check on a single field of the _POOL_HEADER.
+
+    These checks can also be applied to the raw value of the field, without
+    instantiating the _POOL_HEADER. This allows the PoolScanner to reject most
+    hits by decoding the field directly from the scanned buffer.
+    """
+    __abstract = True
+
+    # The _POOL_HEADER member this check examines.
+    field = None
 
-class CheckPoolSize(scan.ScannerCheck):
+    def check_value(self, value):
+        """Returns if the raw value of self.field passes the check."""
+        _ = value
+        return True
+
+    def check(self, buffer_as, offset):
+        pool_hdr = self.profile._POOL_HEADER(
+            vm=buffer_as, offset=offset)
+
+        return self.check_value(pool_hdr.m(self.field).v())
+
+
+class CheckPoolSize(PoolHeaderFieldCheck):
     """ Check pool block size """
+
+    field = "BlockSize"
+
     def __init__(self, condition=None, min_size=None, **kwargs):
         super(CheckPoolSize, self).__init__(**kwargs)
         self.condition = condition
@@ -244,23 +291,26 @@ class CheckPoolSize(scan.ScannerCheck):
         if self.condition is None:
             raise RuntimeError("No pool size provided")
 
-    def check(self, buffer_as, offset):
-        pool_hdr = self.profile._POOL_HEADER(
-            vm=buffer_as, offset=offset)
+    def check_value(self, value):
+        return self.condition(value * self.pool_align)
 
-        block_size = pool_hdr.BlockSize.v()
 
-        return self.condition(block_size * self.pool_align)
+class CheckPoolType(PoolHeaderFieldCheck):
+    """ Check the pool type """
 
+    field = "PoolType"
 
-class CheckPoolType(scan.ScannerCheck):
-    """ Check the pool type """
     def __init__(self, paged=False, non_paged=False, free=False, **kwargs):
         super(CheckPoolType, self).__init__(**kwargs)
         self.non_paged = non_paged
         self.paged = paged
         self.free = free
 
+        # The meaning of the pool type differs between windows versions so we
+        # ask the _POOL_HEADER about each value we see.
+        self.value_cache = {}
+        self.pool_type_field = None
+
     def check(self, buffer_as, offset):
         pool_hdr = self.profile._POOL_HEADER(
             vm=buffer_as, offset=offset)
@@ -269,28 +319,163 @@ class CheckPoolType(scan.ScannerCheck):
                 (self.free and pool_hdr.FreePool) or
                 (self.paged and pool_hdr.PagedPool))
 
+    def check_value(self, value):
+        try:
+            return self.value_cache[value]
+        except KeyError:
+            pass
+
+        # Build a _POOL_HEADER with this pool type.
+        if self.pool_type_field is None:
+            self.pool_type_field = PoolHeaderField(self.profile, self.field)
 
-class CheckPoolIndex(scan.ScannerCheck):
+        buffer_as = addrspace.BufferAddressSpace(
+            data=self.pool_type_field.encode(value),
+            session=self.profile.session)
+
+        result = self.value_cache[value] = bool(self.check(buffer_as, 0))
+        return result
+
+
+class CheckPoolIndex(PoolHeaderFieldCheck):
     """ Checks the pool index """
+
+    field = "PoolIndex"
+
     def __init__(self, value=0, **kwargs):
         super(CheckPoolIndex, self).__init__(**kwargs)
         self.value = value
 
-    def check(self, buffer_as, offset):
-        pool_hdr = self.profile._POOL_HEADER(
-            vm=buffer_as, offset=offset)
+    def check_value(self, value):
+        return value == self.value
+
+
+class PoolHeaderField(object):
+    """Decodes a single _POOL_HEADER member directly from a buffer."""
+
+    def __init__(self, profile, name):
+        pool_hdr = profile._POOL_HEADER(vm=addrspace.BufferAddressSpace(
+            data="\x00" * profile.get_obj_size("_POOL_HEADER"),
+            session=profile.session))
+
+        member = pool_hdr.m(name)
+        if isinstance(member, obj.BitField):
+            format_string = member._proxy.format_string
+            self.start_bit = member.start_bit
+            self.end_bit = member.end_bit
+        else:
+            format_string = member.format_string
+            self.start_bit = 0
+            self.end_bit = member.obj_size * 8
 
-        return pool_hdr.PoolIndex == self.value
+        self.offset = member.obj_offset
+        self.header_size = pool_hdr.obj_size
+        self.struct = struct.Struct(format_string)
+        self.mask = (1 << self.end_bit) - 1
+
+    def decode(self, data, offsets):
+        """Returns the value of the field for all the headers at offsets."""
+        unpack_from = self.struct.unpack_from
+        field_offset = self.offset
+        mask = self.mask
+        start_bit = self.start_bit
+
+        return [(unpack_from(data, x + field_offset)[0] & mask) >> start_bit
+                for x in offsets]
+
+    def encode(self, value):
+        """Returns the data of a _POOL_HEADER with this field set to value."""
+        data = "\x00" * self.header_size
+        field_data = self.struct.pack(value << self.start_bit)
+        return (data[:self.offset] + field_data +
+                data[self.offset + len(field_data):])
 
 
 class PoolScanner(scan.BaseScanner):
-    """A scanner for pool allocations."""
+    """A scanner for pool allocations.
+
+    Pool scanners first find all the pool tags in each buffer, then check the
+    _POOL_HEADER fields for all these hits at once. Only the remaining hits are
+    examined by instantiating objects.
+    """
+
+    def build_constraints(self):
+        super(PoolScanner, self).build_constraints()
+
+        # The check which finds the candidate hits.
+        self.tag_check = None
+
+        # Field checks which can be applied to the raw header values.
+        self.field_checks = []
+
+        for check in self.constraints:
+            if (self.tag_check is None and
+                    isinstance(check, (PoolTagCheck, MultiPoolTagCheck))):
+                self.tag_check = check
+
+            elif isinstance(check, PoolHeaderFieldCheck):
+                self.field_checks.append(
+                    (PoolHeaderField(self.profile, check.field), check))
+
+    def filter_candidates(self, buffer_as, offsets):
+        """Removes the offsets which fail the _POOL_HEADER field checks."""
+        data = buffer_as.data
+
+        # Headers which are truncated at the end of the buffer are just left
+        # for the full checks.
+        header_size = self.profile.get_obj_size("_POOL_HEADER")
+        last_offset = buffer_as.end() - header_size
+        tail = [x for x in offsets if x > last_offset]
+        offsets = [x - buffer_as.base_offset for x in offsets
+                   if x <= last_offset]
+
+        for field, check in self.field_checks:
+            if not offsets:
+                break
+
+            check_value = check.check_value
+            offsets = [x for x, value in zip(offsets, field.decode(
+                data, offsets)) if check_value(value)]
+
+        return [x + buffer_as.base_offset for x in offsets] + tail
+
+    def scan_buffer(self, buffer_as):
+        if self.tag_check is None:
+            for hit in super(PoolScanner, self).scan_buffer(buffer_as):
+                yield hit
+
+            return
+
+        candidates = self.filter_candidates(
+            buffer_as, list(self.tag_check.find_all(
+                buffer_as, self.get_scan_start(buffer_as))))
+
+        for offset in candidates:
+            # Run the full checks on the remaining hits.
+            res = self.check_addr(offset, buffer_as=buffer_as)
+
+            # Remove multiple matches in the overlap region which we
+            # have previously reported.
+            if res is not None and offset > self.last_reported_hit:
+                self.last_reported_hit = offset
+                yield res
+
+        self.last_buffer_end = self.last_scan_offset = buffer_as.end()
 
     def scan(self, offset=0, maxlen=None):
         """Yields instances of _POOL_HEADER which potentially match."""
-
-        maxlen = maxlen or self.profile.get_constant("MaxPointer")
-        for hit in super(PoolScanner, self).scan(offset=offset, maxlen=maxlen):
+        # The multiscan plugin may have already scanned the entire address
+        # space for us in a single pass with other scanners.
+        hits = None
+        if offset == 0 and maxlen is None:
+            hits = self.session.GetParameter("pool_scan_hits", {}).get(
+                (self.__class__.__name__, self.address_space))
+
+        if hits is None:
+            maxlen = maxlen or self.profile.get_constant("MaxPointer")
+            hits = super(PoolScanner, self).scan(offset=offset, maxlen=maxlen)
+
+        for hit in hits:
             yield self.profile._POOL_HEADER(vm=self.address_space, offset=hit)
 
 
@@ -298,6 +483,10 @@ class PoolScannerPlugin(plugin.KernelASMixin, AbstractWindowsCommandPlugin):
     """A base class for all pool scanner plugins."""
     __abstract = True
 
+    # The PoolScanner classes this plugin uses. These are run together with the
+    # scanners from other plugins by the multiscan plugin.
+    pool_scanners = []
+
     @classmethod
     def args(cls, parser):
         super(PoolScannerPlugin, cls).args(parser)
@@ -321,6 +510,86 @@ class PoolScannerPlugin(plugin.KernelASMixin, AbstractWindowsCommandPlugin):
         else:
             self.address_space = address_space or self.physical_address_space
 
+    def get_pool_scanners(self):
+        """Instantiates the pool scanners this plugin uses."""
+        for scanner_cls in self.pool_scanners:
+            yield scanner_cls(profile=self.profile, session=self.session,
+                              address_space=self.address_space)
+
+
+class MultiPoolScan(PoolScannerPlugin):
+    """Runs several pool scanner plugins with a single pass over the image.
+
+    Each block of the image is read only once and handed to the pool scanners
+    of all the selected plugins. The plugins are then rendered from these hits
+    without scanning the image again.
+    """
+
+    __name = "multiscan"
+
+    @classmethod
+    def args(cls, parser):
+        super(MultiPoolScan, cls).args(parser)
+        parser.add_argument(
+            "plugins", type="ArrayStringParser",
+            help="The pool scanner plugins to run (Default all).")
+
+    def __init__(self, plugins=None, **kwargs):
+        super(MultiPoolScan, self).__init__(**kwargs)
+        self.plugins = plugins
+
+    def get_plugins(self):
+        """Instantiates the selected pool scanner plugins."""
+        names = self.plugins
+        if not names:
+            names = sorted(set(
+                cls.name for cls in self.classes.values()
+                if (utils.issubclass(cls, PoolScannerPlugin) and cls.name and
+                    cls.pool_scanners and cls.is_active(self.session))))
+
+        for name in names:
+            plugin_cls = self.session.plugins.GetPluginClass(name)
+            if plugin_cls == None:
+                logging.debug("Plugin %s is not active.", name)
+                continue
+
+            if not utils.issubclass(plugin_cls, PoolScannerPlugin):
+                raise plugin.PluginError(
+                    "%s is not a pool scanner plugin." % name)
+
+            yield plugin_cls(session=self.session, profile=self.profile,
+                             address_space=self.address_space)
+
+    def render(self, renderer):
+        plugins = list(self.get_plugins())
+
+        scanners = {}
+        for plugin_obj in plugins:
+            for scanner in plugin_obj.get_pool_scanners():
+                scanners[scanner.__class__.__name__] = scanner
+
+        group = scan.ScannerGroup(
+            scanners=scanners, profile=self.profile, session=self.session,
+            address_space=self.address_space)
+
+        # We need the raw hits here, since they are handed to the scanners'
+        # own scan() methods below.
+        hits = dict((name, []) for name in scanners)
+        for name, hit in group.scan_constraints():
+            hits[name].append(hit)
+
+        # Hand the hits to the plugins' scanners through the session cache.
+        self.session.SetCache("pool_scan_hits", dict(
+            ((name, self.address_space), offsets)
+            for name, offsets in hits.iteritems()))
+
+        try:
+            for plugin_obj in plugins:
+                renderer.section(plugin_obj.name)
+                plugin_obj.render(renderer)
+        finally:
+            self.session.SetCache("pool_scan_hits", None)
+
 
 class KDBGHook(kb.ParameterHook):
     """A Hook to calculate the KDBG when needed."""
@@ -0,0 +1,319 @@
+"""Tests for the common windows plugin classes."""
+
+import random
+import struct
+import unittest
+
+from rekall import addrspace
+from rekall import plugin
+from rekall import session
+from rekall import testlib
+from rekall.plugins.overlays import basic
+from rekall.plugins.overlays.windows import common as overlays_common
+from rekall.plugins.overlays.windows import win7
+from rekall.plugins.windows import common
+
+
+class PoolTestProfile(basic.Profile32Bits, basic.BasicClasses):
+    """A profile with an XP style _POOL_HEADER."""
+    __abstract = True
+
+    pool_header_class = overlays_common._POOL_HEADER
+
+    @classmethod
+    def Initialize(cls, profile):
+        super(PoolTestProfile, cls).Initialize(profile)
+        profile.add_types({
+            "_POOL_HEADER": [0x8, {
+                "PreviousSize": [0, ["BitField", dict(
+                    start_bit=0, end_bit=9, target="unsigned short")]],
+                "PoolIndex": [0, ["BitField", dict(
+                    start_bit=9, end_bit=16, target="unsigned short")]],
+                "BlockSize": [2, ["BitField", dict(
+                    start_bit=0, end_bit=9, target="unsigned short")]],
+                "PoolType": [2, ["BitField", dict(
+                    start_bit=9, end_bit=16, target="unsigned short")]],
+                "PoolTag": [4, ["unsigned long"]],
+            }]})
+        profile.add_classes(_POOL_HEADER=cls.pool_header_class)
+        profile.add_constants(PoolAlignment=8)
+
+
+class Win7PoolTestProfile(PoolTestProfile):
+    """Windows 7 swaps the meaning of paged and non paged pool types."""
+    __abstract = True
+
+    pool_header_class = win7._POOL_HEADER
+
+
+class FakePoolScanner(common.PoolScanner):
+    __abstract = True
+
+    def __init__(self, checks=None, **kwargs):
+        super(FakePoolScanner, self).__init__(**kwargs)
+        self.checks = checks
+
+
+class PoolHeaderFilterTest(testlib.RekallBaseUnitTestCase):
+    """The pre-filter must accept exactly what the object checks accept."""
+
+    HEADER = struct.Struct("<HH4s")
+
+    def setUp(self):
+        self.session = session.Session()
+        rand = random.Random(1)
+
+        # The boundary values of each field, then some random headers.
+        headers = []
+        for block_size in (0, 1, 7, 8, 9, 0x1ff):
+            for pool_type in (0, 1, 2, 3, 4, 5, 0x7f):
+                for pool_index in (0, 1, 0x7f):
+                    headers.append((0x1ff, pool_index, block_size, pool_type,
+                                    "Test"))
+
+        for _ in range(500):
+            headers.append((rand.randrange(0x200), rand.randrange(0x80),
+                            rand.randrange(0x200), rand.randrange(0x80),
+                            rand.choice(["Test", "Tesu", "Proc"])))
+
+        # The last header is a hit, so it can be truncated below.
+        headers.append((0, 0, 9, 1, "Test"))
+
+        data = ""
+        for previous_size, pool_index, block_size, pool_type, tag in headers:
+            data += self.HEADER.pack(previous_size | pool_index << 9,
+                                     block_size | pool_type << 9, tag)
+
+        self.data = data
+        self.base_offset = 0x10000
+
+    def _Check(self, profile_cls, checks):
+        profile = profile_cls(session=self.session)
+        buffer_as = addrspace.BufferAddressSpace(
+            data=self.data, base_offset=self.base_offset,
+            session=self.session)
+
+        scanner = FakePoolScanner(
+            checks=checks, profile=profile, session=self.session,
+            address_space=buffer_as)
+        scanner.build_constraints()
+
+        offsets = list(scanner.tag_check.find_all(
+            buffer_as, self.base_offset))
+
+        # Each field check gives the same answer on the raw value as on the
+        # _POOL_HEADER.
+        for field, check in scanner.field_checks:
+            values = field.decode(
+                self.data, [x - self.base_offset for x in offsets])
+
+            for offset, value in zip(offsets, values):
+                self.assertEqual(
+                    bool(check.check_value(value)),
+                    bool(check.check(buffer_as, offset)),
+                    "%s differs at %#x" % (check.__class__.__name__, offset))
+
+        # All together, the pre-filter passes exactly the hits which pass the
+        # object checks.
+        expected = [
+            x for x in offsets
+            if all(check.check(buffer_as, x)
+                   for _, check in scanner.field_checks)]
+
+        self.assertEqual(scanner.filter_candidates(buffer_as, offsets),
+                         expected)
+
+        # A header truncated at the end of the buffer is left for the object
+        # checks.
+        buffer_as.data = self.data[:-1]
+        last_offset = buffer_as.end() - self.HEADER.size
+        self.assertEqual(
+            scanner.filter_candidates(buffer_as, offsets),
+            [x for x in expected if x <= last_offset] +
+            [x for x in offsets if x > last_offset])
+
+        return expected
+
+    def testFieldChecks(self):
+        for profile_cls in (PoolTestProfile, Win7PoolTestProfile):
+            expected = self._Check(profile_cls, [
+                ("PoolTagCheck", dict(tag="Test")),
+                ("CheckPoolSize", dict(min_size=0x40)),
+                ("CheckPoolType", dict(paged=True, non_paged=True)),
+                ("CheckPoolIndex", dict(value=0)),
+            ])
+
+            # Some hits pass and some fail.
+            self.assertTrue(expected)
+            self.assertLess(len(expected), self.data.count("Test"))
+
+    def testPoolTypes(self):
+        for profile_cls in (PoolTestProfile, Win7PoolTestProfile):
+            for kwargs in (dict(paged=True), dict(non_paged=True),
+                           dict(free=True), dict(paged=True, free=True)):
+                self._Check(profile_cls, [
+                    ("PoolTagCheck", dict(tag="Test")),
+                    ("CheckPoolType", kwargs),
+                ])
+
+    def testSizeCondition(self):
+        self._Check(PoolTestProfile, [
+            ("PoolTagCheck", dict(tag="Test")),
+            ("CheckPoolSize", dict(condition=lambda x: x == 0x48)),
+        ])
+
+    def testNoFieldChecks(self):
+        self.assertEqual(
+            len(self._Check(PoolTestProfile, [
+                ("PoolTagCheck", dict(tag="Test"))])),
+            self.data.count("Test"))
+
+
+class CountingAddressSpace(addrspace.BufferAddressSpace):
+    """A buffer which counts how much data is read from it."""
+    __abstract = True
+
+    def __init__(self, **kwargs):
+        super(CountingAddressSpace, self).__init__(**kwargs)
+        self.bytes_read = 0
+
+    def read(self, addr, length):
+        self.bytes_read += length
+        return super(CountingAddressSpace, self).read(addr, length)
+
+
+class WindowsPoolTestProfile(PoolTestProfile):
+    __abstract = True
+
+    METADATA = dict(os="windows")
+
+
+class FakeTagScanner(common.PoolScanner):
+    checks = [("PoolTagCheck", dict(tag="Test")),
+              ("CheckPoolSize", dict(min_size=0x40))]
+
+
+class FakeProcScanner(common.PoolScanner):
+    checks = [("PoolTagCheck", dict(tag="Proc"))]
+
+
+class FakePoolScanPlugin(common.PoolScannerPlugin):
+    __abstract = True
+
+    def render(self, renderer):
+        for scanner in self.get_pool_scanners():
+            for pool_header in scanner.scan():
+                renderer.table_row(pool_header.obj_offset)
+
+
+class FakeTagPoolScan(FakePoolScanPlugin):
+    __name = "fake_tag_pool_scan"
+
+    pool_scanners = [FakeTagScanner]
+
+
+class FakeProcPoolScan(FakePoolScanPlugin):
+    __name = "fake_proc_pool_scan"
+
+    pool_scanners = [FakeProcScanner]
+
+
+class FakeRenderer(object):
+    def __init__(self):
+        self.rows = {}
+        self.current = self.rows.setdefault(None, [])
+
+    def section(self, name=None, **_):
+        self.current = self.rows.setdefault(name, [])
+
+    def table_row(self, *row):
+        self.current.append(row)
+
+
+class MultiPoolScanTest(testlib.RekallBaseUnitTestCase):
+    """Test running pool scanner plugins in a single pass."""
+
+    HEADER = struct.Struct("<HH4s")
+
+    def setUp(self):
+        self.session = session.Session()
+        with self.session:
+            self.session.SetParameter(
+                "profile", WindowsPoolTestProfile(session=self.session))
+
+        data = "".join(
+            self.HEADER.pack(0, block_size | 1 << 9, tag) + "\x00" * 0x38
+            for block_size, tag in [(8, "Test"), (2, "Test"), (8, "Proc"),
+                                    (8, "None"), (0x10, "Test")] * 10)
+
+        self.address_space = CountingAddressSpace(
+            data=data, session=self.session)
+        self.session.physical_address_space = self.address_space
+        self.session.kernel_address_space = self.address_space
+
+        self.plugins = ["fake_tag_pool_scan", "fake_proc_pool_scan"]
+
+    def testMultiScan(self):
+        expected = {}
+        for name in self.plugins:
+            renderer = FakeRenderer()
+            self.address_space.bytes_read = 0
+            self.session.plugins.GetPluginClass(name)(
+                session=self.session).render(renderer)
+            expected[name] = renderer.rows[None]
+
+        self.assertEqual(len(expected["fake_tag_pool_scan"]), 20)
+        self.assertEqual(len(expected["fake_proc_pool_scan"]), 10)
+
+        renderer = FakeRenderer()
+        self.address_space.bytes_read = 0
+        common.MultiPoolScan(
+            session=self.session, plugins=self.plugins).render(renderer)
+
+        self.assertEqual(renderer.rows.pop(None), [])
+        self.assertEqual(renderer.rows, expected)
+
+        # The image was only read once for both plugins.
+        self.assertEqual(self.address_space.bytes_read,
+                         len(self.address_space))
+
+        # The hits are not left behind in the session.
+        self.assertFalse(self.session.GetParameter("pool_scan_hits"))
+
+    def testGetPlugins(self):
+        multiscan = common.MultiPoolScan(
+            session=self.session, plugins=self.plugins + ["no_such_plugin"])
+        self.assertEqual([x.name for x in multiscan.get_plugins()],
+                         self.plugins)
+
+        multiscan = common.MultiPoolScan(
+            session=self.session, plugins=["info"])
+        self.assertRaises(plugin.PluginError, list, multiscan.get_plugins())
+
+    def testPoolScanHits(self):
+        scanner = FakeTagScanner(
+            profile=self.session.profile, session=self.session,
+            address_space=self.address_space)
+
+        self.session.SetCache("pool_scan_hits", {
+            ("FakeTagScanner", self.address_space): [0x80, 0xc0]})
+
+        # The cached hits are used without reading the image.
+        self.address_space.bytes_read = 0
+        self.assertEqual([x.obj_offset for x in scanner.scan()],
+                         [0x80, 0xc0])
+        self.assertEqual(self.address_space.bytes_read, 0)
+
+        # Only scans of the whole address space use the cached hits.
+        self.assertEqual([x.obj_offset for x in scanner.scan(offset=0x40)][0],
+                         0x100)
+
+        # The hits are only used for the same scanner and address space.
+        other_scanner = FakeProcScanner(
+            profile=self.session.profile, session=self.session,
+            address_space=self.address_space)
+        self.assertEqual(len(list(other_scanner.scan())), 10)
+
+
+if __name__ == "__main__":
+    unittest.main()
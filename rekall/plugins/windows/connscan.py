@@ -47,12 +47,19 @@ class ConnScan(tcpip_vtypes.TcpipPluginMixin,
 
     __name = "connscan"
 
+    pool_scanners = [PoolScanConnFast]
+
     @classmethod
     def is_active(cls, session):
         # These only work for XP.
         return (super(ConnScan, cls).is_active(session) and
                 session.profile.metadata("major") == "5")
 
+    def get_pool_scanners(self):
+        for scanner_cls in self.pool_scanners:
+            yield scanner_cls(session=self.session, profile=self.tcpip_profile,
+                              address_space=self.address_space)
+
     def generate_hits(self):
         """Search the physical address space for _TCPT_OBJECTs.
 
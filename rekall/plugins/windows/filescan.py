@@ -54,6 +54,8 @@ class FileScan(common.PoolScannerPlugin):
     """
     __name = "filescan"
 
+    pool_scanners = [PoolScanFile]
+
     def generate_hits(self):
         """Generate possible hits."""
         scanner = PoolScanFile(profile=self.profile, session=self.session,
@@ -127,6 +129,8 @@ class DriverScan(FileScan):
 
     __name = "driverscan"
 
+    pool_scanners = [PoolScanDriver]
+
     def generate_hits(self):
         """Generate possible hits."""
         scanner = PoolScanDriver(session=self.session,
@@ -198,6 +202,8 @@ class SymLinkScan(FileScan):
 
     __name = "symlinkscan"
 
+    pool_scanners = [PoolScanSymlink]
+
     def generate_hits(self):
         """Generate possible hits."""
         scanner = PoolScanSymlink(profile=self.profile, session=self.session,
@@ -261,6 +267,8 @@ class MutantScan(plugin.VerbosityMixIn, FileScan):
 
     __name = "mutantscan"
 
+    pool_scanners = [PoolScanMutant]
+
     def generate_hits(self):
         scanner = PoolScanMutant(profile=self.profile, session=self.session,
                                  address_space=self.address_space)
@@ -378,6 +386,8 @@ class PSScan(common.PoolScannerPlugin):
 
     __name = "psscan"
 
+    pool_scanners = [PoolScanProcess]
+
     def scan_processes(self):
         """Generate possible hits."""
         # Just grab the AS and scan it using our scanner
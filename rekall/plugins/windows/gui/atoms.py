@@ -47,6 +47,8 @@ class AtomScan(win32k_core.Win32kPluginMixin, common.PoolScannerPlugin):
 
     __name = "atomscan"
 
+    pool_scanners = [PoolScanAtom]
+
     @classmethod
     def args(cls, parser):
         super(AtomScan, cls).args(parser)
@@ -59,6 +61,11 @@ class AtomScan(win32k_core.Win32kPluginMixin, common.PoolScannerPlugin):
         super(AtomScan, self).__init__(**kwargs)
         self.sort_by = sort_by
 
+    def get_pool_scanners(self):
+        for scanner_cls in self.pool_scanners:
+            yield scanner_cls(profile=self.win32k_profile, session=self.session,
+                              address_space=self.address_space)
+
     def generate_hits(self):
         scanner = PoolScanAtom(
             profile=self.win32k_profile, session=self.session,
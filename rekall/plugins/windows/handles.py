@@ -52,42 +52,79 @@ class Handles(common.WinProcessFilter):
 
         super(Handles, self).__init__(*args, **kwargs)
 
+    def _resolve_file_names(self, handles):
+        device_names = {}
+        for handle in handles:
+            file_obj = handle.dereference_as("_FILE_OBJECT")
+            yield file_obj.file_name_with_device(device_names=device_names)
+
+    def _resolve_key_names(self, handles):
+        # Keys opened by a process usually share most of their path.
+        key_names = {}
+        for handle in handles:
+            key_obj = handle.dereference_as("_CM_KEY_BODY")
+            yield key_obj.full_key_name(key_names=key_names)
+
+    def _resolve_process_names(self, handles):
+        for handle in handles:
+            proc_obj = handle.dereference_as("_EPROCESS")
+            yield u"{0}({1})".format(
+                utils.SmartUnicode(proc_obj.ImageFileName),
+                proc_obj.UniqueProcessId)
+
+    def _resolve_thread_names(self, handles):
+        for handle in handles:
+            thrd_obj = handle.dereference_as("_ETHREAD")
+            yield u"TID {0} PID {1}".format(
+                thrd_obj.Cid.UniqueThread,
+                thrd_obj.Cid.UniqueProcess)
+
+    def _resolve_object_names(self, handles):
+        for handle in handles:
+            if handle.NameInfo.Name == None:
+                yield ""
+            else:
+                yield handle.NameInfo.Name
+
+    name_resolvers = dict(
+        File=_resolve_file_names,
+        Key=_resolve_key_names,
+        Process=_resolve_process_names,
+        Thread=_resolve_thread_names,
+        )
+
     def enumerate_handles(self, task):
-        if task.ObjectTable.HandleTableList:
-            for handle in task.ObjectTable.handles():
-                name = ""
-                object_type = handle.get_object_type(self.kernel_address_space)
-
-                if object_type == None:
-                    continue
-
-                if self.object_list and object_type not in self.object_list:
-                    continue
-
-                elif object_type == "File":
-                    file_obj = handle.dereference_as("_FILE_OBJECT")
-                    name = file_obj.file_name_with_device()
-                elif object_type == "Key":
-                    key_obj = handle.dereference_as("_CM_KEY_BODY")
-                    name = key_obj.full_key_name()
-                elif object_type == "Process":
-                    proc_obj = handle.dereference_as("_EPROCESS")
-                    name = u"{0}({1})".format(
-                        utils.SmartUnicode(proc_obj.ImageFileName),
-                        proc_obj.UniqueProcessId)
-
-                elif object_type == "Thread":
-                    thrd_obj = handle.dereference_as("_ETHREAD")
-                    name = u"TID {0} PID {1}".format(
-                        thrd_obj.Cid.UniqueThread,
-                        thrd_obj.Cid.UniqueProcess)
-
-                elif handle.NameInfo.Name == None:
-                    name = ""
-                else:
-                    name = handle.NameInfo.Name
-
-                yield handle, object_type, name
+        if not task.ObjectTable.HandleTableList:
+            return
+
+        handles = []
+        handles_by_type = {}
+        for handle in task.ObjectTable.handles():
+            object_type = handle.get_object_type(self.kernel_address_space)
+
+            if object_type == None:
+                continue
+
+            if self.object_list and object_type not in self.object_list:
+                continue
+
+            handles.append((handle, object_type))
+            handles_by_type.setdefault(object_type, []).append(handle)
+
+        # Resolve the names of all the objects of each type together, so they
+        # can share the work.
+        names = {}
+        for object_type, typed_handles in handles_by_type.iteritems():
+            resolver = self.name_resolvers.get(
+                object_type, Handles._resolve_object_names)
+
+            for handle, name in zip(typed_handles,
+                                    resolver(self, typed_handles)):
+                names[handle.obj_offset, handle.HandleValue] = name
+
+        for handle, object_type in handles:
+            yield handle, object_type, names[
+                handle.obj_offset, handle.HandleValue]
 
     def render(self, renderer):
         renderer.table_header([("_OBJECT_HEADER", "offset_v", "[addrpad]"),
@@ -0,0 +1,120 @@
+"""Tests for the handles plugin."""
+
+import unittest
+
+from rekall import addrspace
+from rekall import obj
+from rekall import session
+from rekall import testlib
+
+# Import and register all the plugins.
+from rekall import plugins # pylint: disable=unused-import
+from rekall.plugins.windows import handles
+
+
+class FakeName(object):
+    def __init__(self, name):
+        self.Name = name
+
+
+class FakeKeyBody(object):
+    def __init__(self, path, memos):
+        self.path = path
+        self.memos = memos
+
+    def full_key_name(self, key_names=None):
+        self.memos.append(key_names)
+        return self.path
+
+
+class FakeHandle(object):
+    """A handle as yielded by _HANDLE_TABLE.handles()."""
+
+    def __init__(self, offset, handle_value, object_type, name=None,
+                 memos=None):
+        self.obj_offset = offset
+        self.HandleValue = handle_value
+        self.object_type = object_type
+        self.NameInfo = FakeName(name)
+        self.memos = memos
+
+    def get_object_type(self, _):
+        return self.object_type
+
+    def dereference_as(self, type_name):
+        if type_name == "_CM_KEY_BODY":
+            return FakeKeyBody(self.NameInfo.Name, self.memos)
+
+
+class FakeHandleTable(object):
+    HandleTableList = 1
+
+    def __init__(self, handle_list):
+        self.handle_list = handle_list
+
+    def handles(self):
+        return iter(self.handle_list)
+
+
+class FakeTask(object):
+    def __init__(self, handle_list):
+        self.ObjectTable = FakeHandleTable(handle_list)
+
+
+class EnumerateHandlesTest(testlib.RekallBaseUnitTestCase):
+    """Test resolving the handle names by type."""
+
+    def setUp(self):
+        self.session = session.Session()
+        with self.session:
+            self.session.SetParameter(
+                "profile", obj.Profile.classes["Profile32Bits"](
+                    session=self.session))
+
+            address_space = addrspace.BufferAddressSpace(
+                data="\x00" * 0x100, session=self.session)
+            self.session.physical_address_space = address_space
+            self.session.kernel_address_space = address_space
+
+        self.memos = []
+        self.handle_list = [
+            FakeHandle(0x1000, 4, "Key", "MACHINE\\SOFTWARE", self.memos),
+            FakeHandle(0x2000, 8, "Mutant", "Lock"),
+            # An entry with an unknown type is skipped.
+            FakeHandle(0x3000, 12, None, "Bad"),
+            FakeHandle(0x4000, 16, "Event"),
+            FakeHandle(0x5000, 20, "Key", "MACHINE\\SYSTEM", self.memos),
+            FakeHandle(0x2000, 24, "Mutant", "Lock2"),
+        ]
+
+    def _Enumerate(self, task=None, **kwargs):
+        plugin = handles.Handles(session=self.session, **kwargs)
+        return [(handle.HandleValue, object_type, name)
+                for handle, object_type, name in plugin.enumerate_handles(
+                    task or FakeTask(self.handle_list))]
+
+    def testEnumerateHandles(self):
+        self.assertEqual(self._Enumerate(), [
+            (4, "Key", "MACHINE\\SOFTWARE"),
+            (8, "Mutant", "Lock"),
+            (16, "Event", ""),
+            (20, "Key", "MACHINE\\SYSTEM"),
+            (24, "Mutant", "Lock2")])
+
+        # All the keys share the same memo.
+        self.assertEqual(len(self.memos), 2)
+        self.assertTrue(self.memos[0] is self.memos[1])
+
+    def testObjectTypes(self):
+        self.assertEqual(self._Enumerate(object_types=["Mutant"]), [
+            (8, "Mutant", "Lock"),
+            (24, "Mutant", "Lock2")])
+
+    def testEmptyTable(self):
+        task = FakeTask(self.handle_list)
+        task.ObjectTable.HandleTableList = 0
+        self.assertEqual(self._Enumerate(task), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -68,9 +68,19 @@ class WinYaraScan(common.WinProcessFilter):
             "--scan_physical", default=False, type="Boolean",
             help="If specified we scan the physcial address space.")
 
+        parser.add_argument(
+            "--yara_rule_sets", default=[], type="ArrayStringParser",
+            help="Several yara signature files which are matched in a single "
+            "pass. Hits are attributed to the file they came from.")
+
+        parser.add_argument(
+            "--yara_statistics", default=False, type="Boolean",
+            help="If specified we report the number of hits for each rule and "
+            "the time spent matching.")
+
     def __init__(self, string=None, scan_vads=False, scan_physical=False,
                  yara_file=None, yara_expression=None, binary_string=None,
-                 **kwargs):
+                 yara_rule_sets=None, yara_statistics=False, **kwargs):
         """Scan using yara signatures."""
         super(WinYaraScan, self).__init__(**kwargs)
         if yara_expression:
@@ -88,12 +98,22 @@ class WinYaraScan(common.WinProcessFilter):
 
         elif yara_file:
             self.compile_rule(open(yara_file).read())
+
+        elif yara_rule_sets:
+            try:
+                self.rules = yarascanner.CompileRuleSets(yara, yara_rule_sets)
+            except Exception as e:
+                raise plugin.PluginError(
+                    "Failed to compile yara rule sets: %s" % e)
+
         else:
             raise plugin.PluginError("You must specify a yara rule file or "
                                      "string to match.")
 
         self.scan_vads = scan_vads
         self.scan_physical = scan_physical
+        self.yara_statistics = yara_statistics
+        self.statistics = yarascanner.YaraStatistics()
 
     def compile_rule(self, rule):
         self.rules_source = rule
@@ -107,7 +127,7 @@ class WinYaraScan(common.WinProcessFilter):
         scanner = yarascanner.BaseYaraASScanner(
             profile=self.profile, session=self.session,
             address_space=address_space,
-            rules=self.rules)
+            rules=self.rules, statistics=self.statistics)
 
         return scanner.scan()
 
@@ -153,7 +173,8 @@ class WinYaraScan(common.WinProcessFilter):
         task_as = task.get_process_address_space()
 
         scanner = VadYaraScanner(
-            session=self.session, rules=self.rules, task=task)
+            session=self.session, rules=self.rules, task=task,
+            statistics=self.statistics)
 
         for rule, address, _, _ in scanner.scan():
             renderer.format("Rule: {0}\n", rule)
@@ -167,7 +188,7 @@ class WinYaraScan(common.WinProcessFilter):
     def render(self, renderer):
         """Render output."""
         if self.scan_physical:
-            return self.render_scan_physical(renderer)
+            self.render_scan_physical(renderer)
 
         elif self.scan_vads or self.filtering_requested:
             for task in self.filter_processes():
@@ -178,7 +199,10 @@ class WinYaraScan(common.WinProcessFilter):
 
         # We are searching the kernel address space
         else:
-            return self.render_kernel_scan(renderer)
+            self.render_kernel_scan(renderer)
+
+        if self.yara_statistics:
+            self.statistics.render(renderer)
 
 
 class TestYara(testlib.SimpleTestCase):
@@ -60,6 +60,8 @@ class ModScan(filescan.FileScan):
 
     __name = "modscan"
 
+    pool_scanners = [PoolScanModuleFast]
+
     def generate_hits(self):
         scanner = PoolScanModuleFast(profile=self.profile, session=self.session,
                                      address_space=self.address_space)
@@ -120,6 +122,8 @@ class ThrdScan(ModScan):
 
     __name = "thrdscan"
 
+    pool_scanners = [PoolScanThreadFast]
+
     def generate_hits(self):
         scanner = PoolScanThreadFast(profile=self.profile, session=self.session,
                                      address_space=self.address_space)
@@ -100,6 +100,9 @@ class WinNetscan(tcpip_vtypes.TcpipPluginMixin,
 
     __name = "netscan"
 
+    pool_scanners = [PoolScanTcpListener, PoolScanTcpEndpoint,
+                     PoolScanUdpEndpoint]
+
     @classmethod
     def is_active(cls, session):
         # This plugin works with the _TCP_ENDPOINT interfaces. This interface
@@ -107,6 +110,11 @@ class WinNetscan(tcpip_vtypes.TcpipPluginMixin,
         return (super(WinNetscan, cls).is_active(session) and
                 session.profile.get_constant('RtlEnumerateEntryHashTable'))
 
+    def get_pool_scanners(self):
+        for scanner_cls in self.pool_scanners:
+            yield scanner_cls(profile=self.tcpip_profile, session=self.session,
+                              address_space=self.address_space)
+
     def generate_hits(self):
         scanner = PoolScanTcpListener(
             profile=self.tcpip_profile, session=self.session,
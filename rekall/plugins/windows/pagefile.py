@@ -62,6 +62,14 @@ class WindowsPagedMemoryMixin(object):
         self._resolve_vads = True
         self.vads = None
 
+    def cache_translation(self, vaddr, paddr):
+        # While resolving a prototype PTE we refuse to consult the VADs (see
+        # get_phys_addr()), so the result may be incomplete and must not be
+        # cached.
+        if self._resolve_vads:
+            super(WindowsPagedMemoryMixin, self).cache_translation(
+                vaddr, paddr)
+
     def entry_present(self, entry):
         # Treat Transition PTEs as valid.
         return entry & self.transition_valid_mask
@@ -136,10 +144,10 @@ class WindowsPagedMemoryMixin(object):
             return (pte.u.Soft.PageFileHigh * 0x1000 + self.pagefile_mapping +
                     (virtual_address & 0xFFF))
 
-    def get_available_addresses(self, start=0):
+    def walk_available_addresses(self, start=0):
         self.vads = list(self.session.address_resolver.GetVADs())
         for ranges in super(
-                WindowsPagedMemoryMixin, self).get_available_addresses(
+                WindowsPagedMemoryMixin, self).walk_available_addresses(
                     start=start):
             yield ranges
 
@@ -271,41 +279,34 @@ class WindowsIA32PagedMemoryPae(WindowsPagedMemoryMixin,
                                 intel.IA32PagedMemoryPae):
     """A Windows specific IA32PagedMemoryPae."""
 
-    def vtop(self, vaddr):
-        '''Translates virtual addresses into physical offsets.
+    def walk_page_tables(self, vaddr):
+        '''Translates a virtual address by walking the page tables.
 
         The function should return either None (no valid mapping) or the offset
         in physical memory where the address maps.
         '''
-        vaddr = int(vaddr)
-        try:
-            return self._tlb.Get(vaddr)
-        except KeyError:
-            pdpte = self.get_pdpte(vaddr)
-            if not self.entry_present(pdpte):
-                return None
-
-            pde = self.get_pde(vaddr, pdpte)
-            if not self.entry_present(pde):
-                # If PDE is not valid the page table does not exist
-                # yet. According to
-                # http://i-web.i.u-tokyo.ac.jp/edu/training/ss/lecture/new-documents/Lectures/14-AdvVirtualMemory/AdvVirtualMemory.pdf
-                # slide 11 this is the same as PTE of zero - i.e. consult the
-                # VAD.
-                if not self._resolve_vads:
-                    return None
+        pdpte = self.get_pdpte(vaddr)
+        if not self.entry_present(pdpte):
+            return None
 
-                return self.get_phys_addr(vaddr, 0)
+        pde = self.get_pde(vaddr, pdpte)
+        if not self.entry_present(pde):
+            # If PDE is not valid the page table does not exist
+            # yet. According to
+            # http://i-web.i.u-tokyo.ac.jp/edu/training/ss/lecture/new-documents/Lectures/14-AdvVirtualMemory/AdvVirtualMemory.pdf
+            # slide 11 this is the same as PTE of zero - i.e. consult the
+            # VAD.
+            if not self._resolve_vads:
+                return None
 
-            if self.page_size_flag(pde):
-                return self.get_two_meg_paddr(vaddr, pde)
+            return self.get_phys_addr(vaddr, 0)
 
-            pte = self.get_pte(vaddr, pde)
+        if self.page_size_flag(pde):
+            return self.get_two_meg_paddr(vaddr, pde)
 
-            res = self.get_phys_addr(vaddr, pte)
+        pte = self.get_pte(vaddr, pde)
 
-            self._tlb.Put(vaddr, res)
-            return res
+        return self.get_phys_addr(vaddr, pte)
 
 
 class WindowsAMD64PagedMemory(WindowsPagedMemoryMixin, amd64.AMD64PagedMemory):
@@ -315,50 +316,43 @@ class WindowsAMD64PagedMemory(WindowsPagedMemoryMixin, amd64.AMD64PagedMemory):
     contains a pagefile.
     """
 
-    def vtop(self, vaddr):
-        '''Translates virtual addresses into physical offsets.
+    def walk_page_tables(self, vaddr):
+        '''Translates a virtual address by walking the page tables.
 
         The function returns either None (no valid mapping) or the offset in
         physical memory where the address maps.
         '''
-        try:
-            return self._tlb.Get(vaddr)
-        except KeyError:
-            vaddr = long(vaddr)
-            pml4e = self.get_pml4e(vaddr)
-            if not self.entry_present(pml4e):
-                # Add support for paged out PML4E
-                return None
-
-            pdpte = self.get_pdpte(vaddr, pml4e)
-            if not self.entry_present(pdpte):
-                # Add support for paged out PDPTE
-                # Insert buffalo here!
-                return None
+        pml4e = self.get_pml4e(vaddr)
+        if not self.entry_present(pml4e):
+            # Add support for paged out PML4E
+            return None
 
-            if self.page_size_flag(pdpte):
-                return self.get_one_gig_paddr(vaddr, pdpte)
+        pdpte = self.get_pdpte(vaddr, pml4e)
+        if not self.entry_present(pdpte):
+            # Add support for paged out PDPTE
+            # Insert buffalo here!
+            return None
 
-            pde = self.get_pde(vaddr, pdpte)
-            if not self.entry_present(pde):
-                # If PDE is not valid the page table does not exist
-                # yet. According to
-                # http://i-web.i.u-tokyo.ac.jp/edu/training/ss/lecture/new-documents/Lectures/14-AdvVirtualMemory/AdvVirtualMemory.pdf
-                # slide 11 this is the same PTE of zero.
-                if not self._resolve_vads:
-                    return None
+        if self.page_size_flag(pdpte):
+            return self.get_one_gig_paddr(vaddr, pdpte)
 
-                return self.get_phys_addr(vaddr, 0)
+        pde = self.get_pde(vaddr, pdpte)
+        if not self.entry_present(pde):
+            # If PDE is not valid the page table does not exist
+            # yet. According to
+            # http://i-web.i.u-tokyo.ac.jp/edu/training/ss/lecture/new-documents/Lectures/14-AdvVirtualMemory/AdvVirtualMemory.pdf
+            # slide 11 this is the same PTE of zero.
+            if not self._resolve_vads:
+                return None
 
-            # Is this a 2 meg page?
-            if self.page_size_flag(pde):
-                return self.get_two_meg_paddr(vaddr, pde)
+            return self.get_phys_addr(vaddr, 0)
 
-            pte = self.get_pte(vaddr, pde)
-            res = self.get_phys_addr(vaddr, pte)
+        # Is this a 2 meg page?
+        if self.page_size_flag(pde):
+            return self.get_two_meg_paddr(vaddr, pde)
 
-            self._tlb.Put(vaddr, res)
-            return res
+        pte = self.get_pte(vaddr, pde)
+        return self.get_phys_addr(vaddr, pte)
 
 
 class Pagefiles(common.WindowsCommandPlugin):
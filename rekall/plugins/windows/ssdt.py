@@ -47,9 +47,13 @@ class WinSSDT(common.WindowsCommandPlugin):
 
     def _render_x64_table(self, table, renderer):
         resolver = self.session.address_resolver
+        function_addresses = [table.obj_offset + (entry >> 4)
+                              for entry in table.values()]
 
-        for j, entry in enumerate(table):
-            function_address = table.obj_offset + (entry >> 4)
+        # Resolve all the symbols in one pass.
+        resolver.resolve_many(function_addresses)
+
+        for j, function_address in enumerate(function_addresses):
             renderer.table_row(
                 j, function_address,
                 resolver.format_address(
@@ -58,8 +62,12 @@ class WinSSDT(common.WindowsCommandPlugin):
 
     def _render_x86_table(self, table, renderer):
         resolver = self.session.address_resolver
+        function_addresses = table.values()
+
+        # Resolve all the symbols in one pass.
+        resolver.resolve_many(function_addresses)
 
-        for j, function_address in enumerate(table):
+        for j, function_address in enumerate(function_addresses):
             renderer.table_row(
                 j, function_address,
                 resolver.format_address(
@@ -40,6 +40,23 @@ from rekall.plugins import core
 from rekall.plugins.windows import common
 
 
+class VadIndexCache(object):
+    """A session wide cache of the VAD index of each process.
+
+    Building the index requires walking the entire VAD tree of the process, so
+    all plugins share the indexes through the session.
+    """
+
+    def __init__(self):
+        self.indexes = {}
+        self.hits = 0
+        self.misses = 0
+
+    def cache_stats(self):
+        return dict(hits=self.hits, misses=self.misses,
+                    processes=len(self.indexes))
+
+
 class VADInfo(common.WinProcessFilter):
     """Dump the VAD info"""
 
@@ -232,11 +249,15 @@ class VAD(common.WinProcessFilter):
     def __init__(self, *args, **kwargs):
         self.regex = kwargs.pop("regex", None)
         self.offset = kwargs.pop("offset", None)
-        self._cache = {}
 
         # Pass positional args to the WinProcessFilter constructor.
         super(VAD, self).__init__(*args, **kwargs)
 
+        self._cache = self.session.GetParameter("vad_index_cache")
+        if not self._cache:
+            self._cache = VadIndexCache()
+            self.session.SetCache("vad_index_cache", self._cache)
+
     def find_file(self, addr):
         """Finds the file mapped at this address."""
         for task in self.filter_processes():
@@ -251,26 +272,36 @@ class VAD(common.WinProcessFilter):
             return None
 
     def _make_cache(self, task):
-        result = utils.SortedCollection(key=lambda x: x[0])
         self.session.report_progress(
             " Enumerating VADs in %s (%s)", task.name, task.pid)
 
-        for vad in task.RealVadRoot.traverse():
-            result.insert(
-                (vad.Start, vad.End, self._get_filename(vad), vad))
-
-        return result
+        return utils.IntervalIndex(
+            (vad.Start, vad.End, self._get_filename(vad), vad)
+            for vad in task.RealVadRoot.traverse())
 
     def GetVadsForProcess(self, task):
+        """Returns the VAD index of the process.
+
+        This is a utils.IntervalIndex of (start, end, filename, vad) tuples.
+        """
         try:
-            resolver = self._cache[task]
+            resolver = self._cache.indexes[task]
+            self._cache.hits += 1
         except KeyError:
+            self._cache.misses += 1
+
             # Break the recursion by placing a None for the resolver. The
             # self._make_cache() call will run the vad plugin which might
             # resolve a VAD PTE, calling this code. This means that we can only
             # use non-VAD PTEs to read the VAD itself.
-            self._cache[task] = None
-            resolver = self._cache[task] = self._make_cache(task)
+            self._cache.indexes[task] = None
+            try:
+                resolver = self._make_cache(task)
+            finally:
+                # Do not leave the marker behind if we failed.
+                del self._cache.indexes[task]
+
+            self._cache.indexes[task] = resolver
 
         return resolver
 
@@ -465,10 +496,8 @@ class VADDump(core.DirectoryDumperMixin, VAD):
             with self.session.plugins.cc() as cc:
                 cc.SwitchProcessContext(task)
 
-                for vad in task.RealVadRoot.traverse():
-                    # Find the start and end range
-                    start = vad.Start
-                    end = vad.End
+                for start, end, vad_filename, _ in self.GetVadsForProcess(
+                        task):
 
                     filename = "{0}.{1:x}.{2:08x}-{3:08x}.dmp".format(
                         name, offset, start, end)
@@ -485,8 +514,7 @@ class VADDump(core.DirectoryDumperMixin, VAD):
                         self.session.report_progress("Dumping %s" % filename)
                         self.CopyToFile(task_space, start, end + 1, fd)
                         renderer.table_row(
-                            start, end, end-start, filename,
-                            self._get_filename(vad))
+                            start, end, end-start, filename, vad_filename)
 
 
 class VadScanner(scan.BaseScanner):
@@ -511,7 +539,8 @@ class VadScanner(scan.BaseScanner):
     def scan(self, offset=0, maxlen=None):
         maxlen = maxlen or self.profile.get_constant("MaxPointer")
 
-        for vad in self.task.RealVadRoot.traverse():
+        vads = self.session.plugins.vad().GetVadsForProcess(self.task) or []
+        for start, _, _, vad in vads:
             # Only scan the VAD region.
-            for match in super(VadScanner, self).scan(vad.Start, vad.Length):
+            for match in super(VadScanner, self).scan(start, vad.Length):
                 yield match
@@ -22,7 +22,14 @@
 
 """Tests for the vadinfo plugins."""
 
+import struct
+
+from rekall import addrspace
+from rekall import session
 from rekall import testlib
+from rekall.plugins.overlays import basic
+from rekall.plugins.overlays.windows import common
+from rekall.plugins.windows import vadinfo
 
 
 class TestVadInfo(testlib.SimpleTestCase):
@@ -61,3 +68,177 @@ class TestVADDump(testlib.SimpleTestCase):
     PARAMETERS = dict(
         commandline="vaddump --pid %(pid)s --dump_dir %(tempdir)s"
     )
+
+
+class FakeVadNode(common.VadTraverser):
+    """A minimal VAD node for testing the traverser."""
+    __abstract = True
+
+    tag_map = {"VadS": "_TEST_VAD"}
+
+
+class VadTestProfile(basic.Profile32Bits, basic.BasicClasses):
+    """A profile with just enough to build a VAD tree."""
+    __abstract = True
+
+    @classmethod
+    def Initialize(cls, profile):
+        super(VadTestProfile, cls).Initialize(profile)
+        profile.add_types({
+            "_TEST_VAD": [0x10, {
+                "Tag": [0, ["String", dict(length=4)]],
+                "LeftChild": [4, ["Pointer", dict(target="_TEST_VAD")]],
+                "RightChild": [8, ["Pointer", dict(target="_TEST_VAD")]],
+                "Start": [12, ["unsigned int"]],
+            }]})
+        profile.add_classes(_TEST_VAD=FakeVadNode)
+
+
+class VadTraverserTest(testlib.RekallBaseUnitTestCase):
+    """Test the iterative VAD tree walk."""
+
+    def setUp(self):
+        self.session = session.Session()
+        self.profile = VadTestProfile(session=self.session)
+
+    def _BuildTree(self, nodes):
+        """Builds the VAD tree from (tag, left, right) tuples.
+
+        Node i is at offset (i + 1) * 0x10, and children are given as node
+        indexes (or None). Each node's Start is its index.
+        """
+        data = "\x00" * 0x10
+        for i, (tag, left, right) in enumerate(nodes):
+            data += struct.pack(
+                "<4sIII", tag,
+                0 if left is None else (left + 1) * 0x10,
+                0 if right is None else (right + 1) * 0x10,
+                i)
+
+        address_space = addrspace.BufferAddressSpace(
+            data=data, session=self.session)
+
+        return self.profile._TEST_VAD(offset=0x10, vm=address_space)
+
+    def _Walk(self, root):
+        return [(int(vad.Start), vad.obj_context["depth"])
+                for vad in root.traverse()]
+
+    def testPreorder(self):
+        # The root's tag is not in the tag_map and it is not yielded.
+        root = self._BuildTree([
+            ("\x00" * 4, 1, None),
+            ("VadS", 2, 3),
+            ("VadS", 4, None),
+            ("VadS", None, 5),
+            ("VadS", None, None),
+            ("VadS", None, None),
+        ])
+
+        self.assertEqual(self._Walk(root),
+                         [(1, 1), (2, 2), (4, 3), (3, 2), (5, 3)])
+
+    def testCycle(self):
+        # Node 3 points back to node 1 and node 2 points to itself.
+        root = self._BuildTree([
+            ("\x00" * 4, 1, None),
+            ("VadS", 2, 3),
+            ("VadS", 2, None),
+            ("VadS", None, 1),
+        ])
+
+        self.assertEqual(self._Walk(root), [(1, 1), (2, 2), (3, 2)])
+
+    def testBadTag(self):
+        # Nodes with unknown tags below the root are pruned with their
+        # subtrees.
+        root = self._BuildTree([
+            ("\x00" * 4, 1, None),
+            ("VadS", 2, 3),
+            ("Bad!", 4, None),
+            ("VadS", None, None),
+            ("VadS", None, None),
+        ])
+
+        self.assertEqual(self._Walk(root), [(1, 1), (3, 2)])
+
+    def testDepthLimit(self):
+        # A chain much deeper than MAX_DEPTH.
+        depth = FakeVadNode.MAX_DEPTH + 20
+        nodes = [("\x00" * 4, 1, None)]
+        for i in range(1, depth):
+            nodes.append(("VadS", i + 1 if i + 1 < depth else None, None))
+
+        walked = self._Walk(self._BuildTree(nodes))
+        self.assertEqual(len(walked), FakeVadNode.MAX_DEPTH)
+        self.assertEqual(walked[-1], (FakeVadNode.MAX_DEPTH,
+                                      FakeVadNode.MAX_DEPTH))
+
+
+class FakeVad(object):
+    def __init__(self, start, end):
+        self.Start = start
+        self.End = end
+
+
+class FakeVadRoot(object):
+    def __init__(self, vads):
+        self.vads = vads
+        self.walks = 0
+
+    def traverse(self):
+        self.walks += 1
+        for vad in self.vads:
+            if isinstance(vad, Exception):
+                raise vad
+
+            yield vad
+
+
+class FakeTask(object):
+    name = "test.exe"
+    pid = 1
+
+    def __init__(self, vads):
+        self.RealVadRoot = FakeVadRoot(vads)
+
+
+class VadIndexCacheTest(testlib.RekallBaseUnitTestCase):
+    """Test that the VAD index is shared through the session."""
+
+    def setUp(self):
+        self.session = session.Session()
+        with self.session:
+            self.session.SetParameter(
+                "profile", VadTestProfile(session=self.session))
+
+            address_space = addrspace.BufferAddressSpace(
+                data="\x00" * 0x100, session=self.session)
+            self.session.physical_address_space = address_space
+            self.session.kernel_address_space = address_space
+
+    def testSharedIndex(self):
+        task = FakeTask([FakeVad(0x3000, 0x3fff), FakeVad(0x1000, 0x1fff)])
+
+        vads = vadinfo.VAD(session=self.session).GetVadsForProcess(task)
+        self.assertEqual([x[0] for x in vads], [0x1000, 0x3000])
+
+        # Another instance of the plugin uses the same index.
+        other = vadinfo.VAD(session=self.session)
+        self.assertTrue(other.GetVadsForProcess(task) is vads)
+        self.assertEqual(other.find_file_in_task(0x1800, task)[0], 0x1000)
+        self.assertEqual(task.RealVadRoot.walks, 1)
+
+        stats = self.session.GetParameter("vad_index_cache").cache_stats()
+        self.assertEqual(stats, dict(hits=2, misses=1, processes=1))
+
+    def testFailedWalk(self):
+        task = FakeTask([FakeVad(0x1000, 0x1fff), IOError("Bad VAD")])
+        vad_plugin = vadinfo.VAD(session=self.session)
+
+        self.assertRaises(IOError, vad_plugin.GetVadsForProcess, task)
+
+        # The recursion marker is not left behind.
+        task.RealVadRoot.vads.pop()
+        self.assertEqual(len(vad_plugin.GetVadsForProcess(task)), 1)
+        self.assertEqual(task.RealVadRoot.walks, 2)
@@ -20,19 +20,77 @@
 
 
 """A Rekall Memory Forensics scanner which uses yara."""
+import collections
+import os
+import time
+
 from rekall import scan
 
 
+def CompileRuleSets(yara, filenames):
+    """Compile several yara files into a single set of rules.
+
+    Each file is compiled into its own namespace (named after the file), so
+    all the rule sets are matched in a single pass over the data, and the hits
+    are still attributed to their rule set.
+    """
+    filepaths = {}
+    for filename in filenames:
+        namespace = os.path.splitext(os.path.basename(filename))[0]
+        filepaths[namespace] = filename
+
+    return yara.compile(filepaths=filepaths)
+
+
+class YaraStatistics(object):
+    """Match counters and timing for yara scanners."""
+
+    def __init__(self):
+        self.hits = collections.Counter()
+        self.match_time = 0
+        self.blocks = 0
+
+    def merge(self, other):
+        """Adds the counters from another YaraStatistics."""
+        self.hits.update(other.hits)
+        self.match_time += other.match_time
+        self.blocks += other.blocks
+
+    def render(self, renderer):
+        renderer.format(
+            "Yara matched {0} blocks in {1:.2f} seconds.\n",
+            self.blocks, self.match_time)
+
+        renderer.table_header([("Rule", "rule", "40s"),
+                               ("Hits", "hits", ">8")])
+
+        for rule, count in self.hits.most_common():
+            renderer.table_row(rule, count)
+
+
 class BaseYaraASScanner(scan.BaseScanner):
-    """An address space scanner for Yara signatures."""
+    """An address space scanner for Yara signatures.
+
+    Rules may be compiled from several namespaces (see CompileRuleSets()), in
+    which case the rule names are qualified by their namespace.
+    """
     overlap = 1024
 
-    def __init__(self, rules=None, **kwargs):
+    def __init__(self, rules=None, statistics=None, **kwargs):
         super(BaseYaraASScanner, self).__init__(**kwargs)
         self.rules = rules
-        self.hits = []
+        self.statistics = statistics or YaraStatistics()
+
+        # The (offset, namespace, hit) in the current buffer, in offset order.
+        self.hits = collections.deque()
         self.base_offset = None
 
+    def _rule_name(self, namespace, rule):
+        if namespace and namespace != "default":
+            return "%s:%s" % (namespace, rule)
+
+        return rule
+
     def _match_rules(self, buffer_as):
         """Compatibility for yara modules.
 
@@ -48,43 +106,91 @@ class BaseYaraASScanner(scan.BaseScanner):
         These do not work the same and so we need to support both.
 
         Yields:
-          a tuple of (offset, rule_name, name, value)
+          a tuple of (namespace, (rule_name, offset, name, value))
         """
+        start = time.time()
         matches = self.rules.match(data=buffer_as.data)
+        self.statistics.match_time += time.time() - start
+        self.statistics.blocks += 1
+
         # yara-cpython bindings from pip.
         if type(matches) is dict:
-            for _, matches in matches.items():
+            for namespace, matches in matches.items():
                 for match in matches:
+                    rule = self._rule_name(namespace, match["rule"])
                     for string in match["strings"]:
                         hit_offset = string["offset"] + buffer_as.base_offset
 
-                        yield (match["rule"], hit_offset,
-                               string["identifier"], string["data"])
+                        yield namespace, (rule, hit_offset,
+                                          string["identifier"], string["data"])
 
         else:
             # native bindings from http://plusvic.github.io/yara/
             for match in matches:
+                namespace = getattr(match, "namespace", None)
+                rule = self._rule_name(namespace, match.rule)
                 for buffer_offset, name, value in match.strings:
                     hit_offset = buffer_offset + buffer_as.base_offset
-                    yield (match.rule, hit_offset, name, value)
+                    yield namespace, (rule, hit_offset, name, value)
+
+    def reset_scan(self):
+        super(BaseYaraASScanner, self).reset_scan()
+        self.hits = collections.deque()
+        self.base_offset = None
 
     def check_addr(self, scan_offset, buffer_as=None):
+        """Returns the hits at scan_offset, one for each namespace."""
         # The buffer was changed - we scan the entire buffer and record the
         # hits - then we can feed it to the Rekall scan framework.
         if self.base_offset != buffer_as.base_offset:
             self.base_offset = buffer_as.base_offset
-            self.hits = []
 
-            for rule, offset, name, value in self._match_rules(buffer_as):
-                self.hits.append((rule, offset, name, value))
+            # Hits from different rules are not ordered.
+            self.hits = collections.deque(sorted(
+                ((hit[1], namespace, hit)
+                 for namespace, hit in self._match_rules(buffer_as)),
+                key=lambda x: x[0]))
+
+        # Drop hits we have skipped over (e.g. in the overlap with the last
+        # buffer).
+        while self.hits and self.hits[0][0] < scan_offset:
+            self.hits.popleft()
+
+        # Only one hit is reported for each offset in each namespace, so rule
+        # sets matching the same data are all reported.
+        result = collections.OrderedDict()
+        while self.hits and self.hits[0][0] == scan_offset:
+            _, namespace, hit = self.hits.popleft()
+            result.setdefault(namespace, hit)
+
+        if result:
+            return result.values()
+
+    def scan(self, offset=0, maxlen=None):
+        for hits in super(BaseYaraASScanner, self).scan(
+                offset=offset, maxlen=maxlen):
+            for hit in hits:
+                self.statistics.hits[hit[0]] += 1
+                yield hit
+
+    def init_worker(self):
+        # Parallel scan workers count their blocks from zero and send them to
+        # the parent's statistics. The hits are counted by the parent.
+        self.statistics = YaraStatistics()
+
+    def get_worker_state(self):
+        statistics = self.statistics
+        self.statistics = YaraStatistics()
+
+        return statistics
 
-        if self.hits and scan_offset == self.hits[0][1]:
-            return self.hits.pop(0)
+    def merge_worker_state(self, state):
+        self.statistics.merge(state)
 
     def skip(self, buffer_as, offset):
-        # Skip the entire buffer.
+        # Skip the rest of the buffer.
         if not self.hits:
-            return len(buffer_as.data)
+            return buffer_as.end() - offset
 
-        next_hit = self.hits[0][1]
+        next_hit = self.hits[0][0]
         return next_hit - offset
@@ -0,0 +1,135 @@
+import collections
+import unittest
+
+from rekall import addrspace
+from rekall import constants
+from rekall import session
+from rekall import testlib
+from rekall.plugins import yarascanner
+
+
+class FakeMatch(object):
+    def __init__(self, rule, namespace, strings):
+        self.rule = rule
+        self.namespace = namespace
+        self.strings = strings
+
+
+class FakeRules(object):
+    """Emulates compiled yara rules which match verbatim strings."""
+
+    def __init__(self, rules):
+        # A list of (namespace, rule, needle).
+        self.rules = rules
+
+    def match(self, data=None):
+        result = []
+        for namespace, rule, needle in self.rules:
+            strings = []
+            offset = data.find(needle)
+            while offset != -1:
+                strings.append((offset, "$a", needle))
+                offset = data.find(needle, offset + 1)
+
+            if strings:
+                result.append(FakeMatch(rule, namespace, strings))
+
+        return result
+
+
+class YaraScannerTest(testlib.RekallBaseUnitTestCase):
+    """Test the yara address space scanner."""
+
+    def setUp(self):
+        self.session = session.Session()
+        self.old_blocksize = constants.SCAN_BLOCKSIZE
+
+        # Use a small block size so hits fall in the overlap between blocks.
+        constants.SCAN_BLOCKSIZE = 2000
+        self.data = ("x" * 500 + "foo" + "y" * 500 + "bar") * 20
+        self.address_space = addrspace.BufferAddressSpace(
+            data=self.data, session=self.session)
+
+    def tearDown(self):
+        constants.SCAN_BLOCKSIZE = self.old_blocksize
+
+    def testRuleSets(self):
+        statistics = yarascanner.YaraStatistics()
+        scanner = yarascanner.BaseYaraASScanner(
+            session=self.session, address_space=self.address_space,
+            statistics=statistics, rules=FakeRules([
+                ("iocs", "bar_rule", "bar"),
+                ("default", "foo_rule", "foo")]))
+
+        hits = [(rule, offset) for rule, offset, _, _ in scanner.scan(
+            maxlen=len(self.data))]
+
+        expected = []
+        for i in range(len(self.data)):
+            if self.data.startswith("foo", i):
+                expected.append(("foo_rule", i))
+            elif self.data.startswith("bar", i):
+                expected.append(("iocs:bar_rule", i))
+
+        # Hits from all the rules are reported once, in order.
+        self.assertEqual(hits, expected)
+        self.assertEqual(statistics.hits, collections.Counter(
+            {"foo_rule": 20, "iocs:bar_rule": 20}))
+        self.assertTrue(statistics.blocks > 0)
+
+    def testSameOffset(self):
+        statistics = yarascanner.YaraStatistics()
+        scanner = yarascanner.BaseYaraASScanner(
+            session=self.session, address_space=self.address_space,
+            statistics=statistics, rules=FakeRules([
+                ("iocs", "foo_rule", "foo"),
+                ("iocs", "fo_rule", "fo"),
+                ("default", "foo_rule", "foo"),
+                ("more_iocs", "oo_rule", "oo")]))
+
+        hits = [(rule, offset) for rule, offset, _, _ in scanner.scan(
+            maxlen=len(self.data))]
+
+        # Every namespace matching at an offset reports its first hit there.
+        expected = []
+        for i in range(len(self.data)):
+            if self.data.startswith("foo", i):
+                expected.extend([("iocs:foo_rule", i), ("foo_rule", i),
+                                 ("more_iocs:oo_rule", i + 1)])
+
+        self.assertEqual(hits, expected)
+        self.assertEqual(statistics.hits, collections.Counter(
+            {"iocs:foo_rule": 20, "foo_rule": 20, "more_iocs:oo_rule": 20}))
+
+    def testParallelStatistics(self):
+        rules = FakeRules([("iocs", "bar_rule", "bar"),
+                           ("default", "foo_rule", "foo")])
+
+        results = []
+        for workers in (0, 3):
+            with self.session:
+                self.session.SetParameter("scan_workers", workers)
+
+            # Some statistics from an earlier scan.
+            statistics = yarascanner.YaraStatistics()
+            statistics.blocks = 5
+            scanner = yarascanner.BaseYaraASScanner(
+                session=self.session, address_space=self.address_space,
+                statistics=statistics, rules=rules)
+
+            # Scan twice so the scanner is reused.
+            for _ in range(2):
+                hits = list(scanner.scan(maxlen=len(self.data)))
+
+            results.append((hits, statistics.hits, statistics.blocks))
+
+        with self.session:
+            self.session.SetParameter("scan_workers", 0)
+
+        # The workers send their statistics back to the parent.
+        self.assertEqual(results[0], results[1])
+        self.assertEqual(results[0][2], 5 + 2 * (len(self.data) / 2000 + 1))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -21,13 +21,23 @@
 __author__ = "Michael Cohen <scudette@gmail.com>"
 
 import acora
+import multiprocessing
+import os
 import re
 
 from rekall import addrspace
+from rekall import config
 from rekall import constants
 from rekall import registry
 
 
+config.DeclareOption(
+    "--scan_workers", default=0, type="IntParser",
+    help="The number of worker processes used for scanning. If larger "
+    "than 1, scanners split the image into blocks which are scanned in "
+    "parallel.")
+
+
 class BaseScanner(object):
     """ A more thorough scanner which checks every byte """
 
@@ -103,41 +113,28 @@ class BaseScanner(object):
         return skip
 
     overlap = 1024
-    def scan(self, offset=0, maxlen=None):
-        """Scan the region from offset for maxlen.
+    def generate_blocks(self, offset=0, end=None):
+        """Plans the blocks which cover the region between offset and end.
 
-        Args:
-          offset: The starting offset in our current address space to scan.
+        We try to optimize the scanning by first merging contiguous ranges and
+        then reading up to constants.SCAN_BLOCKSIZE bytes at once.
 
-          maxlen: The maximum length to scan. If not provided we just scan until
-            there is no data.
+        If range has less data than the block size, then the full range is
+        read at once.
+
+        If a range is larger than the block size, it's split in chunks until
+        it's fully consumed. Overlap is applied only in this case, starting
+        from the second chunk.
 
         Yields:
-          offsets where all the constrainst are satisfied.
+          tuples of (chunk_offset, phys_chunk_offset, chunk_size,
+          overlap_length). The overlap_length is the number of bytes from the
+          end of the previous block which must precede this block.
         """
-        maxlen = maxlen or 2**64
-        end = offset + maxlen
-        overlap = ""
-
-        # Record the last reported hit to prevent multiple reporting of the same
-        # hits when using an overlap.
-        last_reported_hit = -1
-
-        # Delay building the constraints so they can be added after scanner
-        # construction.
-        if self.constraints is None:
-            self.build_constraints()
+        if end is None:
+            end = 2**64
 
-        # We try to optimize the scanning by first merging contiguous ranges
-        # and then passing up to constants.SCAN_BLOCKSIZE bytes to the checkers
-        # and skippers.
-        #
-        # If range has less data than the block size, then the full range is
-        # scanned at once.
-        #
-        # If a range is larger than the block size, it's split in chunks until
-        # it's fully consumed. Overlap is applied only in this case, starting
-        # from the second chunk.
+        overlap_length = 0
         chunk_end = 0
 
         for (range_start, phys_start,
@@ -154,29 +151,16 @@ class BaseScanner(object):
 
             # Calculate where in the range we'll be reading data from.
             # Covers the case where offset falls within a range.
-            start = max(range_start, offset)
-
-            # Store where this chunk will start. Absolute offset.
-            chunk_offset = start
-
-            buffer_as = addrspace.BufferAddressSpace(session=self.session)
+            chunk_offset = max(range_start, offset)
 
-            # Keep scanning this range as long as the current chunk isn't
-            # past the end of the range or the end of the scanner.
+            # Keep reading this range as long as the current chunk isn't past
+            # the end of the range or the end of the scanner.
             while chunk_offset < end and chunk_offset < range_end:
-                if self.session:
-                    self.session.report_progress(
-                        self.progress_message % dict(
-                            offset=chunk_offset,
-                            name=self.__class__.__name__))
-
                 # This chunk does not begin where the last chunk ended - this
                 # means there is a gap in the virtual address space and
                 # therefore we should not use any overlap.
                 if chunk_offset != chunk_end:
-                    overlap = ""
-
-                chunk_offset = max(start, chunk_offset)
+                    overlap_length = 0
 
                 # Our chunk is SCAN_BLOCKSIZE long or as much data there's
                 # left in the range.
@@ -191,33 +175,289 @@ class BaseScanner(object):
 
                 phys_chunk_offset = phys_start + (chunk_offset - range_start)
 
-                # Consume the next block in this range.
-                buffer_as.assign_buffer(
-                    overlap + self.address_space.phys_base.read(
-                        phys_chunk_offset, chunk_size),
-                    base_offset=chunk_offset - len(overlap))
+                yield (chunk_offset, phys_chunk_offset, chunk_size,
+                       overlap_length)
+
+                overlap_length = min(self.overlap, overlap_length + chunk_size)
+                chunk_offset = chunk_end
+
+    def generate_buffers(self, offset=0, end=None):
+        """Reads the region between offset and end one block at a time.
+
+        Yields:
+          A BufferAddressSpace containing each block, preceded by the overlap
+          from the previous block. Note that the same instance is reused for
+          all the blocks so callers should not hold on to it.
+        """
+        buffer_as = addrspace.BufferAddressSpace(session=self.session)
+        phys_base = self.address_space.phys_base
+
+        for (chunk_offset, phys_chunk_offset, chunk_size,
+             overlap_length) in self.generate_blocks(offset, end):
+            if self.session:
+                self.session.report_progress(
+                    self.progress_message % dict(
+                        offset=chunk_offset,
+                        name=self.__class__.__name__))
+
+            # Each byte is only read once - the overlap is taken from the
+            # previous block rather than read again. The checks need the
+            # overlap and the block as a single string, so the block is read
+            # with read() rather than read_buffer() and then joined.
+            data = phys_base.read(phys_chunk_offset, chunk_size)
+            if overlap_length:
+                data = buffer_as.data[-overlap_length:] + data
+
+            # Consume the next block in this range.
+            buffer_as.assign_buffer(
+                data, base_offset=chunk_offset - overlap_length)
+
+            yield buffer_as
+
+    def reset_scan(self):
+        """Forget about previously scanned buffers.
+
+        This must be called before feeding a new region into scan_buffer().
+        """
+        # Record the last reported hit to prevent multiple reporting of the
+        # same hits when using an overlap.
+        self.last_reported_hit = -1
+
+        # The end of the last buffer we scanned and the offset we reached in
+        # it (The skippers may take us past the end of the buffer).
+        self.last_buffer_end = 0
+        self.last_scan_offset = 0
+
+        # Delay building the constraints so they can be added after scanner
+        # construction.
+        if self.constraints is None:
+            self.build_constraints()
+
+        # The checks may remember the last buffer by its offset, which a new
+        # scan (or a block scanned by a worker) may start at again.
+        for check in self.constraints:
+            check.reset()
+
+    def get_scan_start(self, buffer_as):
+        """Returns the offset in buffer_as where scanning should start."""
+        scan_offset = buffer_as.base_offset
+
+        # This block continues the previous one.
+        if scan_offset < self.last_buffer_end:
+            if self.last_scan_offset > self.last_buffer_end:
+                # The skippers told us there is nothing to find until here.
+                scan_offset = self.last_scan_offset
+            else:
+                scan_offset = max(scan_offset,
+                                  self.last_buffer_end - self.overlap)
+
+        return scan_offset
+
+    def scan_buffer(self, buffer_as):
+        """Runs our constraints over a single block.
+
+        Blocks must be provided in increasing order (e.g. from
+        generate_buffers()). The block may carry more overlap than
+        self.overlap (e.g. when it is shared by a ScannerGroup) - we only
+        rescan as much of the overlap as we would have if we read the block
+        ourselves.
+
+        Yields:
+          offsets where all the constraints are satisfied.
+        """
+        scan_offset = self.get_scan_start(buffer_as)
+        while scan_offset < buffer_as.end():
+            # Check the current offset for a match.
+            res = self.check_addr(scan_offset, buffer_as=buffer_as)
+
+            # Remove multiple matches in the overlap region which we
+            # have previously reported.
+            if res is not None and scan_offset > self.last_reported_hit:
+                self.last_reported_hit = scan_offset
+                yield res
+
+            # Skip as much data as the skippers tell us to, up to the
+            # end of the buffer.
+            scan_offset += min(buffer_as.end(),
+                               self.skip(buffer_as, scan_offset))
+
+        self.last_buffer_end = buffer_as.end()
+        self.last_scan_offset = scan_offset
+
+    def scan_block(self, chunk_offset, phys_chunk_offset, chunk_size,
+                   overlap_length):
+        """Scans a single block from generate_blocks() on its own.
+
+        This does not depend on any state from scanning the previous blocks, so
+        blocks can be scanned in any order (e.g. by parallel workers).
+
+        Returns:
+          A list of (offset, hit) tuples. Hits in the overlap region may have
+          been already reported by the previous block and should be removed by
+          the caller.
+        """
+        self.reset_scan()
+
+        overlap = ""
+        if overlap_length:
+            overlap = self.address_space.read(
+                chunk_offset - overlap_length, overlap_length)
+
+            # Pretend we just finished scanning the previous block.
+            self.last_buffer_end = self.last_scan_offset = chunk_offset
+
+        buffer_as = addrspace.BufferAddressSpace(
+            session=self.session, base_offset=chunk_offset - overlap_length,
+            data=overlap + self.address_space.phys_base.read(
+                phys_chunk_offset, chunk_size))
+
+        result = []
+        for hit in self.scan_buffer(buffer_as):
+            result.append((self.last_reported_hit, hit))
+
+        return result
+
+    def init_worker(self):
+        """Called in each parallel scan worker before it scans any blocks."""
 
-                if self.overlap > 0:
-                    overlap = buffer_as.data[-self.overlap:]
+    def get_worker_state(self):
+        """Returns the state a parallel scan worker sends back to the parent.
 
-                scan_offset = buffer_as.base_offset
-                while scan_offset < buffer_as.end():
-                    # Check the current offset for a match.
-                    res = self.check_addr(scan_offset, buffer_as=buffer_as)
+        This is called in the worker after each block, and the result is
+        passed to merge_worker_state() in the parent.
+        """
 
-                    # Remove multiple matches in the overlap region which we
-                    # have previously reported.
-                    if res is not None and scan_offset > last_reported_hit:
-                        last_reported_hit = scan_offset
-                        yield res
+    def merge_worker_state(self, state):
+        """Merges the state from get_worker_state() into this scanner."""
 
-                    # Skip as much data as the skippers tell us to, up to the
-                    # end of the buffer.
-                    scan_offset += min(buffer_as.end(),
-                                       self.skip(buffer_as, scan_offset))
+    def parallel_scan(self, offset, end, workers):
+        """Scans the blocks in a pool of worker processes.
 
+        Blocks are scanned independently by the workers, and the hits are
+        merged back in offset order. The hits are the same as a serial scan
+        would produce. Any other state the workers change (e.g. statistics) is
+        lost, unless the scanner returns it from get_worker_state().
+        """
+        global _PARALLEL_SCANNER  # pylint: disable=global-statement
 
-                chunk_offset = scan_offset
+        # Plan all the blocks in advance so the address ranges are only
+        # enumerated once by the parent.
+        blocks = list(self.generate_blocks(offset, end))
+
+        # The workers are forked from us and inherit this scanner.
+        _PARALLEL_SCANNER = self
+        try:
+            pool = multiprocessing.Pool(workers, _InitScanWorker)
+        finally:
+            _PARALLEL_SCANNER = None
+
+        try:
+            last_reported_hit = -1
+            for i, (hits, state) in enumerate(pool.imap(_ScanBlock, blocks)):
+                self.merge_worker_state(state)
+
+                if self.session:
+                    self.session.report_progress(
+                        self.progress_message % dict(
+                            offset=blocks[i][0],
+                            name=self.__class__.__name__) +
+                        " (%d/%d blocks)" % (i + 1, len(blocks)))
+
+                # Remove multiple matches in the overlap region which we have
+                # previously reported.
+                for hit_offset, hit in hits:
+                    if hit_offset > last_reported_hit:
+                        last_reported_hit = hit_offset
+                        yield hit
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def scan(self, offset=0, maxlen=None):
+        """Scan the region from offset for maxlen.
+
+        Args:
+          offset: The starting offset in our current address space to scan.
+
+          maxlen: The maximum length to scan. If not provided we just scan until
+            there is no data.
+
+        Yields:
+          offsets where all the constrainst are satisfied.
+        """
+        maxlen = maxlen or 2**64
+        end = offset + maxlen
+
+        self.reset_scan()
+
+        workers = self.session.GetParameter("scan_workers") or 0
+        if workers > 1 and hasattr(os, "fork"):
+            for hit in self.parallel_scan(offset, end, workers):
+                yield hit
+
+            return
+
+        for buffer_as in self.generate_buffers(offset, end):
+            for hit in self.scan_buffer(buffer_as):
+                yield hit
+
+
+# The scanner run by the parallel scan workers. It is only set while the worker
+# pool is created, so the forked workers inherit it.
+_PARALLEL_SCANNER = None
+
+# The scanner used inside each worker process.
+_WORKER_SCANNER = None
+
+
+def _ResetAddressSpacesAfterFork(address_space):
+    """Prepares all the layers of the address space for use in this process.
+
+    The after_fork() method of each address space stacked under address_space
+    is called, so e.g. file handles (which share a single file offset with the
+    parent) are reopened, and thread pools inherited without their threads are
+    dropped.
+    """
+    seen = set()
+    stack = [address_space]
+    while stack:
+        address_space = stack.pop()
+        if address_space is None or id(address_space) in seen:
+            continue
+
+        seen.add(id(address_space))
+
+        # Do not look up after_fork() on the instance, since some address
+        # spaces delegate unknown attributes to their base.
+        if getattr(type(address_space), "after_fork", None):
+            address_space.after_fork()
+
+        members = getattr(address_space, "__dict__", {})
+        stack.extend(members.get(x) for x in ("base", "phys_base"))
+
+
+def _InitScanWorker():
+    """Prepares a forked worker process for scanning."""
+    global _WORKER_SCANNER  # pylint: disable=global-statement
+    _WORKER_SCANNER = _PARALLEL_SCANNER
+
+    _ResetAddressSpacesAfterFork(_WORKER_SCANNER.address_space)
+    _WORKER_SCANNER.init_worker()
+
+    # Only the parent reports progress.
+    if _WORKER_SCANNER.session:
+        _WORKER_SCANNER.session.progress = type(
+            _WORKER_SCANNER.session.progress)()
+
+
+def _ScanBlock(block):
+    """Scans a single block in a worker process.
+
+    Returns:
+      The hits in the block and the worker state of the scanner.
+    """
+    hits = _WORKER_SCANNER.scan_block(*block)
+    return hits, _WORKER_SCANNER.get_worker_state()
 
 
 class MultiStringScanner(BaseScanner):
@@ -235,6 +475,10 @@ class MultiStringScanner(BaseScanner):
             profile=self.profile, address_space=self.address_space,
             needles=self.needles)
 
+    def reset_scan(self):
+        super(MultiStringScanner, self).reset_scan()
+        self.check.reset()
+
     def check_addr(self, offset, buffer_as=None):
         # Ask the check if this offset is possible.
         val = self.check.check(buffer_as, offset)
@@ -300,6 +544,9 @@ class ScannerCheck(object):
     def object_offset(self, offset):
         return offset
 
+    def reset(self):
+        """Forget any state kept from previously checked buffers."""
+
     def check(self, buffer_as, offset):
         _ = offset
         _ = buffer_as
@@ -346,20 +593,37 @@ class MultiStringFinderCheck(ScannerCheck):
         tree = acora.AcoraBuilder(*needles)
 
         self.engine = tree.build()
+        self.reset()
 
+    def reset(self):
         self.base_offset = None
         self.hits = None
         self.next_hit_index = 0
         self.current_hit = None
 
-    def check(self, buffer_as, offset):
+    def get_hits(self, buffer_as):
+        """Returns all the (string, buffer offset) hits in the buffer.
+
+        The hits are sorted by offset.
+        """
         if buffer_as.base_offset != self.base_offset:
-            self.hits = self.engine.findall(buffer_as.data)
+            self.hits = sorted(self.engine.findall(buffer_as.data),
+                               key=lambda x: x[1])
             self.base_offset = buffer_as.base_offset
             self.current_hit = 0
             self.next_hit_index = 0
 
+        return self.hits
+
+    def check(self, buffer_as, offset):
+        hits = self.get_hits(buffer_as)
         data_offset = offset - buffer_as.base_offset
+
+        # Forget about the hits we have already passed.
+        while (self.next_hit_index < len(hits) and
+               hits[self.next_hit_index][1] < data_offset):
+            self.next_hit_index += 1
+
         try:
             string, offset = self.hits[self.next_hit_index]
             if offset == data_offset:
@@ -423,7 +687,13 @@ class RegexCheck(ScannerCheck):
 
 
 class ScannerGroup(BaseScanner):
-    """Runs a bunch of scanners in one pass over the image."""
+    """Runs a bunch of scanners in one pass over the image.
+
+    Each block is read from the image only once and the same buffer is handed
+    to the constraints of all the scanners in the group. Scanners which
+    override scan() (e.g. to post-process their hits) can not share the buffer,
+    so they are run with their own scan() instead.
+    """
 
     def __init__(self, scanners=None, **kwargs):
         """Create a new scanner group.
@@ -437,38 +707,75 @@ class ScannerGroup(BaseScanner):
         for scanner in scanners.values():
             scanner.address_space = self.address_space
 
+        # The shared buffer must carry enough overlap for all the scanners.
+        self.overlap = max([0] + [s.overlap for s in scanners.values()])
+
         # A dict to hold all hits for each scanner.
         self.result = {}
 
-    def scan(self, offset=0, maxlen=None):
-        available_length = maxlen or self.profile.get_constant("MaxPointer")
+    def scan_constraints(self, offset=0, maxlen=None, scanners=None):
+        """Runs the constraints of the scanners in a single pass.
 
-        while available_length > 0:
-            to_read = min(constants.SCAN_BLOCKSIZE + self.overlap,
-                          available_length)
+        Note that the hits are the raw offsets from the scanners'
+        scan_buffer(), i.e. they are not processed by the scanners' own scan()
+        methods.
 
-            # Now feed all the scanners from the same address space.
-            for name, scanner in self.scanners.items():
-                for hit in scanner.scan(offset=offset, maxlen=to_read):
-                    # Yield the result as well as cache it.
-                    yield name, hit
+        Args:
+          scanners: The names of the scanners to run (Default all).
 
-            # Move to the next scan block.
-            offset += constants.SCAN_BLOCKSIZE
-            available_length -= constants.SCAN_BLOCKSIZE
+        Yields:
+          tuples of (name, offset) where name is the key of the scanner in the
+          scanners dict.
+        """
+        maxlen = maxlen or self.profile.get_constant("MaxPointer")
+        if scanners is None:
+            scanners = self.scanners.keys()
 
+        scanners = [(name, self.scanners[name]) for name in scanners]
+        if not scanners:
+            return
 
-class DiscontigScannerGroup(ScannerGroup):
-    """A scanner group which works over a virtual address space."""
+        for _, scanner in scanners:
+            scanner.reset_scan()
+
+        for buffer_as in self.generate_buffers(offset, offset + maxlen):
+            # Now feed all the scanners from the same buffer.
+            for name, scanner in scanners:
+                for hit in scanner.scan_buffer(buffer_as):
+                    yield name, hit
 
     def scan(self, offset=0, maxlen=None):
+        """Scans the region with all the scanners.
+
+        The hits are the same as each scanner's scan() would produce.
+
+        Yields:
+          tuples of (name, hit) where name is the key of the scanner in the
+          scanners dict.
+        """
         maxlen = maxlen or self.profile.get_constant("MaxPointer")
 
-        for (start, _, length) in self.address_space.get_address_ranges(
-            offset, offset + maxlen):
-            for match in super(DiscontigScannerGroup, self).scan(
-                start, maxlen=length):
-                yield match
+        shared = []
+        for name, scanner in self.scanners.items():
+            if type(scanner).scan.im_func is BaseScanner.scan.im_func:
+                shared.append(name)
+
+        for name, hit in self.scan_constraints(
+                offset=offset, maxlen=maxlen, scanners=shared):
+            yield name, hit
+
+        for name, scanner in self.scanners.items():
+            if name not in shared:
+                for hit in scanner.scan(offset=offset, maxlen=maxlen):
+                    yield name, hit
+
+
+class DiscontigScannerGroup(ScannerGroup):
+    """A scanner group which works over a virtual address space.
+
+    Since the ScannerGroup only reads the valid address ranges this is now the
+    same as the ScannerGroup.
+    """
 
 
 class DebugChecker(ScannerCheck):
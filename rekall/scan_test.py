@@ -0,0 +1,194 @@
+import os
+import tempfile
+import unittest
+
+from rekall import addrspace
+from rekall import constants
+from rekall import scan
+from rekall import session
+from rekall import testlib
+from rekall.plugins.addrspaces import standard
+
+
+class CountingAddressSpace(addrspace.BufferAddressSpace):
+    """A buffer which counts how much data is read from it."""
+
+    def __init__(self, **kwargs):
+        super(CountingAddressSpace, self).__init__(**kwargs)
+        self.bytes_read = 0
+
+    def read(self, addr, length):
+        self.bytes_read += length
+        return super(CountingAddressSpace, self).read(addr, length)
+
+
+class StringScanner(scan.BaseScanner):
+    def __init__(self, needle=None, **kwargs):
+        super(StringScanner, self).__init__(**kwargs)
+        self.checks = [("StringCheck", dict(needle=needle))]
+
+
+class LabellingScanner(StringScanner):
+    """A scanner which post-processes its hits in scan()."""
+
+    def scan(self, offset=0, maxlen=None):
+        for hit in super(LabellingScanner, self).scan(
+                offset=offset, maxlen=maxlen):
+            yield "hit at %d" % hit
+
+
+class ScannerGroupTest(testlib.RekallBaseUnitTestCase):
+    """Test the single pass ScannerGroup."""
+
+    def setUp(self):
+        self.session = session.Session()
+        self.old_blocksize = constants.SCAN_BLOCKSIZE
+
+        # Use a small block size so hits fall across block boundaries.
+        constants.SCAN_BLOCKSIZE = 100
+        data = ("x" * 97 + "foo" + "bar" + "y" * 50) * 10
+        self.address_space = CountingAddressSpace(
+            data=data, session=self.session)
+
+    def tearDown(self):
+        constants.SCAN_BLOCKSIZE = self.old_blocksize
+
+    def _MakeScanner(self, needle):
+        return StringScanner(needle=needle, session=self.session,
+                             profile=self.session.profile,
+                             address_space=self.address_space)
+
+    def testGroupMatchesScanners(self):
+        expected = {}
+        for needle in ("foo", "obar", "y" * 5):
+            self.address_space.bytes_read = 0
+            expected[needle] = list(self._MakeScanner(needle).scan())
+
+            # Each byte is read once, even with the overlap.
+            self.assertEqual(self.address_space.bytes_read,
+                             len(self.address_space))
+
+        self.address_space.bytes_read = 0
+        group = scan.ScannerGroup(
+            scanners=dict((k, self._MakeScanner(k)) for k in expected),
+            session=self.session, profile=self.session.profile,
+            address_space=self.address_space)
+
+        result = dict((k, []) for k in expected)
+        for name, hit in group.scan(maxlen=len(self.address_space)):
+            result[name].append(hit)
+
+        self.assertEqual(result, expected)
+
+        # Each byte was only read once for all the scanners.
+        self.assertEqual(self.address_space.bytes_read,
+                         len(self.address_space))
+
+    def testScanConstraints(self):
+        scanners = dict(foo=self._MakeScanner("foo"),
+                        bar=LabellingScanner(
+                            needle="bar", session=self.session,
+                            profile=self.session.profile,
+                            address_space=self.address_space))
+
+        group = scan.ScannerGroup(
+            scanners=scanners, session=self.session,
+            profile=self.session.profile, address_space=self.address_space)
+
+        # The raw hits of all the scanners come from a single pass.
+        self.address_space.bytes_read = 0
+        result = dict(foo=[], bar=[])
+        for name, hit in group.scan_constraints(
+                maxlen=len(self.address_space)):
+            result[name].append(hit)
+
+        self.assertEqual(self.address_space.bytes_read,
+                         len(self.address_space))
+        self.assertEqual(result["foo"], [97 + x * 153 for x in range(10)])
+        self.assertEqual(result["bar"], [100 + x * 153 for x in range(10)])
+
+        # scan() yields the hits as each scanner's own scan() does.
+        result = dict(foo=[], bar=[])
+        for name, hit in group.scan(maxlen=len(self.address_space)):
+            result[name].append(hit)
+
+        self.assertEqual(result["foo"], [97 + x * 153 for x in range(10)])
+        self.assertEqual(result["bar"],
+                         ["hit at %d" % (100 + x * 153) for x in range(10)])
+
+    def testMultiStringScanner(self):
+        scanner = scan.MultiStringScanner(
+            needles=["foo", "obar", "barx"], session=self.session,
+            profile=self.session.profile, address_space=self.address_space)
+
+        # Hits must be reported in order, including overlapping needles.
+        data = self.address_space.data
+        expected = []
+        for i in range(len(data)):
+            for needle in ("foo", "obar", "barx"):
+                if data.startswith(needle, i):
+                    expected.append((i, needle))
+
+        self.assertEqual(list(scanner.scan()), expected)
+
+    def testParallelFileScan(self):
+        # Workers reading the same file must not share its file offset. Use
+        # large blocks so the workers' reads overlap in time.
+        constants.SCAN_BLOCKSIZE = 0x10000
+        fd, filename = tempfile.mkstemp()
+        try:
+            os.write(fd, ("x" * 0x1ffd + "obar") * 0x400)
+            os.close(fd)
+
+            address_space = standard.FileAddressSpace(
+                filename=filename, session=self.session)
+            scanner = StringScanner(
+                needle="obar", session=self.session,
+                profile=self.session.profile, address_space=address_space)
+            expected = list(scanner.scan())
+            self.assertEqual(len(expected), 0x400)
+
+            with self.session:
+                self.session.SetParameter("scan_workers", 8)
+
+            try:
+                for _ in range(5):
+                    self.assertEqual(list(scanner.scan()), expected)
+            finally:
+                with self.session:
+                    self.session.SetParameter("scan_workers", 0)
+
+            # The parent keeps its own handle.
+            self.assertFalse(address_space.fhandle.closed)
+
+            # Address spaces stacked on the file are reopened too.
+            stacked = addrspace.BufferAddressSpace(
+                data="", session=self.session)
+            stacked.base = address_space
+            fhandle = address_space.fhandle
+            scan._ResetAddressSpacesAfterFork(stacked)
+
+            self.assertTrue(fhandle.closed)
+            self.assertEqual(address_space.read(0x1ffd, 4), "obar")
+            address_space.close()
+
+        finally:
+            os.unlink(filename)
+
+    def testParallelScan(self):
+        for needle in ("foo", "obar", "y" * 5):
+            expected = list(self._MakeScanner(needle).scan())
+
+            with self.session:
+                self.session.SetParameter("scan_workers", 3)
+
+            try:
+                self.assertEqual(list(self._MakeScanner(needle).scan()),
+                                 expected)
+            finally:
+                with self.session:
+                    self.session.SetParameter("scan_workers", 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
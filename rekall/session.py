@@ -70,6 +70,17 @@ config.DeclareOption(
     "--max_collector_cost", default=4, type="IntParser",
     help="If specified, collectors with higher cost will not be used.")
 
+config.DeclareOption(
+    "--kb_cache", default=False, type="Boolean",
+    help="Remember autodetected parameters (e.g. the profile) for each image "
+    "in the cache_dir, so later sessions do not need to detect them again.")
+
+config.DeclareOption(
+    "--struct_snapshots", default=False, type="Boolean",
+    help="Read each struct in one go on first access, and decode its members "
+    "from that snapshot. This is faster but structs do not reflect later "
+    "changes to memory (e.g. when analysing live memory).")
+
 
 class PluginContainer(object):
     """A container for plugins.
@@ -408,6 +419,12 @@ class Session(object):
         # session.GetParameter("process_context").
         self.context_cache = {}
 
+        # The persistent cache of parameter hook results for the image.
+        self._kb_cache = None
+
+        # The parameters cached by each currently running parameter hook.
+        self._hook_cache_updates = []
+
         # Store user configurable attributes here. These will be read/written to
         # the configuration file.
         self.state = Configuration(session=self)
@@ -430,6 +447,7 @@ class Session(object):
         self.profile_cache = {}
         self.physical_address_space = None
         self.kernel_address_space = None
+        self._kb_cache = None
         self.state.cache.clear()
 
     @property
@@ -505,19 +523,63 @@ class Session(object):
         """Store something in the cache."""
         self.state.cache.Set(item, value)
 
+        # Remember which parameters the running hook cached.
+        if self._hook_cache_updates:
+            self._hook_cache_updates[-1][item] = value
+
     def SetParameter(self, item, value):
         self.state.Set(item, value)
 
+    def _GetKnowledgeBaseCache(self):
+        """Returns the persistent KnowledgeBaseCache for the image, if enabled.
+        """
+        if self._kb_cache is None:
+            filename = self.state.get("filename")
+            cache_dir = self.GetParameter("cache_dir")
+            if (not self.GetParameter("kb_cache", False) or not cache_dir or
+                    not filename or not os.path.isfile(filename)):
+                return
+
+            # Cache dir may be specified relative to the home directory.
+            cache_dir = os.path.join(config.GetHomeDir(), cache_dir)
+            try:
+                self._kb_cache = kb.KnowledgeBaseCache(
+                    session=self, filename=filename, cache_dir=cache_dir)
+            except (IOError, OSError) as e:
+                logging.debug("Unable to use the knowledge base cache: %s", e)
+                return
+
+        return self._kb_cache
+
     def _RunParameterHook(self, name):
         """Launches the registered parameter hook for name."""
         for cls in kb.ParameterHook.classes.values():
             if cls.name == name and cls.is_active(self):
+                # Only parameters which do not expire are kept on disk.
+                kb_cache = None
+                if cls.expiry is None:
+                    kb_cache = self._GetKnowledgeBaseCache()
+
+                if kb_cache:
+                    found, result = kb_cache.Restore(name)
+                    if found:
+                        self.state.cache[name] = result
+                        return result
+
                 hook = cls(session=self)
-                result = hook.calculate()
+                self._hook_cache_updates.append({})
+                try:
+                    result = hook.calculate()
+                finally:
+                    cache_updates = self._hook_cache_updates.pop()
 
                 # Cache the output from the hook directly.
                 self.state.cache[name] = result
 
+                # Failures are not remembered across sessions.
+                if kb_cache and result != None:
+                    kb_cache.Store(name, cls.__name__, result, cache_updates)
+
                 return result
 
     def _CorrectKWArgs(self, kwargs):
@@ -669,7 +731,7 @@ class Session(object):
             container = io_manager.DirectoryIOManager(os.path.dirname(name),
                                                       version=None)
             result = obj.Profile.LoadProfileFromData(
-                container.GetData(os.path.basename(name)),
+                container.GetProfileData(os.path.basename(name)),
                 self, name=name)
         except IOError:
             pass
@@ -690,14 +752,14 @@ class Session(object):
 
                     # The inventory allows us to fail fetching the profile
                     # quickly - without making the round trip.
-                    if not manager.CheckInventory(name):
+                    if not manager.CheckProfileInventory(name):
                         logging.debug(
                             "Skipped profile %s from %s (Not in inventory)",
                             name, path)
                         continue
 
                     result = obj.Profile.LoadProfileFromData(
-                        manager.GetData(name), self,
+                        manager.GetProfileData(name), self,
                         name=name)
                     logging.info(
                         "Loaded profile %s from %s", name, manager)
@@ -749,7 +811,15 @@ class Session(object):
     def profile(self, value):
         self.state.cache.Set('profile', value)
 
-    def clone(self, session_name=None, **kwargs):
+    def clone(self, session_name=None, copy_cache=False, **kwargs):
+        """Make a new session with the same parameters as this one.
+
+        Args:
+          session_name: The name of the new session.
+          copy_cache: If set, the new session starts with this session's cache,
+             address spaces and profiles, so it does not have to detect them
+             again. Otherwise the new session starts with an empty cache.
+        """
         new_state = self.state.copy()
         # Remove the cache from the copy so we start with a fresh cache.
         new_state.pop("cache")
@@ -761,6 +831,12 @@ class Session(object):
         new_session.Reset()
         new_session.locals = self.locals
 
+        if copy_cache:
+            new_session.state.cache.update(self.state.cache)
+            new_session.profile_cache.update(self.profile_cache)
+            new_session.physical_address_space = self.physical_address_space
+            new_session.kernel_address_space = self.kernel_address_space
+
         # Now override all parameters as requested.
         with new_session:
             for k, v in kwargs.iteritems():
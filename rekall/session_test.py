@@ -0,0 +1,58 @@
+import unittest
+
+from rekall import addrspace
+from rekall import obj
+from rekall import session
+from rekall import testlib
+
+# Import and register all the plugins.
+from rekall import plugins # pylint: disable=unused-import
+
+
+class SessionCloneTest(testlib.RekallBaseUnitTestCase):
+    """Test cloning sessions."""
+
+    def setUp(self):
+        self.session = session.Session()
+        with self.session:
+            self.session.SetParameter("session_id", 1)
+            self.session.SetParameter("session_name", "test")
+            self.session.SetParameter("cache_dir", "/tmp/cache")
+            self.session.SetParameter(
+                "profile", obj.Profile.classes["Profile32Bits"](
+                    session=self.session))
+
+        self.address_space = addrspace.BufferAddressSpace(
+            data="\x00" * 0x100, session=self.session)
+        self.session.physical_address_space = self.address_space
+        self.session.kernel_address_space = self.address_space
+        self.session.SetCache("process_context", "process")
+        self.session.profile_cache["nt/GUID/1234"] = "profile"
+
+    def testClone(self):
+        clone = self.session.clone()
+
+        self.assertEqual(clone.GetParameter("cache_dir"), "/tmp/cache")
+        self.assertEqual(clone.state.cache, {})
+        self.assertEqual(clone.profile_cache, {})
+        self.assertEqual(clone.physical_address_space, None)
+        self.assertEqual(clone.kernel_address_space, None)
+
+    def testCloneWithCache(self):
+        clone = self.session.clone(copy_cache=True)
+
+        self.assertEqual(clone.GetParameter("cache_dir"), "/tmp/cache")
+        self.assertTrue(clone.profile is self.session.profile)
+        self.assertEqual(clone.GetParameter("process_context"), "process")
+        self.assertEqual(clone.profile_cache, {"nt/GUID/1234": "profile"})
+        self.assertTrue(clone.physical_address_space is self.address_space)
+        self.assertTrue(clone.kernel_address_space is self.address_space)
+
+        # The clone's cache is separate from ours.
+        clone.SetCache("process_context", "other")
+        self.assertEqual(
+            self.session.GetParameter("process_context"), "process")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -211,8 +211,16 @@ class RekallBaseUnitTestCase(unittest.TestCase):
         result.startTest(self)
         testMethod = getattr(self, self._testMethodName)
         try:
+            if getattr(self.__class__, "__unittest_skip__", False):
+                result.addSkip(
+                    self, getattr(self.__class__, "__unittest_skip_why__", ""))
+                return
+
             try:
                 self.setUp()
+            except unittest.SkipTest as e:
+                result.addSkip(self, str(e))
+                return
             except KeyboardInterrupt:
                 raise
             except Exception:
@@ -226,6 +234,8 @@ class RekallBaseUnitTestCase(unittest.TestCase):
             try:
                 testMethod()
                 ok = True
+            except unittest.SkipTest as e:
+                result.addSkip(self, str(e))
             except self.failureException:
                 if self.debug:
                     pdb.post_mortem()
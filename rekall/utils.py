@@ -22,10 +22,13 @@
 
 """These are various utilities for rekall."""
 import __builtin__
+import array
 import bisect
+import collections
 import importlib
 import itertools
 import json
+import Queue
 import re
 import socket
 import threading
@@ -752,12 +755,42 @@ class SortedCollection(object):
         self._keys.insert(i, k)
         self._items.insert(i, item)
 
+    def insert_many(self, items):
+        """Insert all the items, sorting the collection only once.
+
+        Inserting n items one at a time costs O(n) each, so callers adding
+        many items at once should use this instead.
+        """
+        decorated = sorted((self._key(item), item) for item in items)
+        if not decorated:
+            return
+
+        # Items which all sort after the collection are simply appended.
+        if self._keys and decorated[0][0] < self._keys[-1]:
+            decorated = sorted(
+                zip(self._keys, self._items) + decorated,
+                key=lambda x: x[0])
+
+            self._keys = []
+            self._items = []
+
+        self._keys.extend(k for k, _ in decorated)
+        self._items.extend(item for _, item in decorated)
+
+    def freeze(self):
+        """Returns an immutable FrozenSortedCollection of our items."""
+        return FrozenSortedCollection(self._items, key=self._given_key)
+
     def remove(self, item):
         'Remove first occurence of item.  Raise ValueError if not found'
         i = self.index(item)
         del self._keys[i]
         del self._items[i]
 
+    def index_le(self, k):
+        'Return the index of the last item with a key <= k, or -1 if none.'
+        return bisect.bisect_right(self._keys, k) - 1
+
     def find(self, k):
         'Return first item with a key == k.  Raise ValueError if not found.'
         i = bisect.bisect_left(self._keys, k)
@@ -772,6 +805,20 @@ class SortedCollection(object):
             return self._items[i-1]
         raise ValueError('No item found with key at or below: %r' % (k,))
 
+    def find_le_many(self, keys):
+        '''Return the last item with a key <= k for each k in sorted keys.
+
+        The keys must be sorted so the collection is only swept once. Keys
+        which have no item at or below them give None.
+        '''
+        result = []
+        i = 0
+        for k in keys:
+            i = bisect.bisect_right(self._keys, k, i)
+            result.append(self._items[i-1] if i else None)
+
+        return result
+
     def find_lt(self, k):
         'Return last item with a key < k.  Raise ValueError if not found.'
         i = bisect.bisect_left(self._keys, k)
@@ -797,6 +844,49 @@ class SortedCollection(object):
         raise ValueError('No item found with key above: %r' % (k,))
 
 
+class FrozenSortedCollection(SortedCollection):
+    """An immutable SortedCollection for read-mostly data.
+
+    The collection is built from all its items in one go. The items are kept
+    in a tuple, and where all the keys are unsigned integers (e.g. addresses)
+    they are stored in a compact array, rather than as a list of int objects.
+
+    >>> s = FrozenSortedCollection([(30, "c"), (10, "a"), (20, "b")],
+    ...                            key=lambda x: x[0])
+    >>> s.find_le(25)
+    (20, 'b')
+    >>> s.insert((40, "d"))
+    Traceback (most recent call last):
+    ...
+    TypeError: FrozenSortedCollection is immutable.
+    """
+
+    # The typecode of the array used for integer keys, if it is large enough
+    # to hold 64 bit addresses.
+    KEY_TYPECODE = "L" if array.array("L").itemsize == 8 else None
+
+    def __init__(self, iterable=(), key=None):
+        super(FrozenSortedCollection, self).__init__(iterable, key=key)
+        self._items = tuple(self._items)
+
+        if self.KEY_TYPECODE:
+            try:
+                self._keys = array.array(self.KEY_TYPECODE, self._keys)
+            except (TypeError, OverflowError):
+                pass
+
+    def copy(self):
+        return self
+
+    def freeze(self):
+        return self
+
+    def _immutable(self, *_, **__):
+        raise TypeError("%s is immutable." % self.__class__.__name__)
+
+    insert = insert_right = insert_many = remove = clear = _immutable
+
+
 class RangedCollection(object):
     """A convenience wrapper around SortedCollection for ranges."""
 
@@ -816,6 +906,187 @@ class RangedCollection(object):
             return None
 
 
+class IntervalIndex(object):
+    """An immutable index of non-overlapping address ranges.
+
+    The index is built from (start, end, ...) tuples in one go, with a single
+    sort, rather than inserting the ranges one at a time. The start and end
+    addresses are kept in their own sorted lists so lookups bisect plain
+    integers. The end address of each range is inclusive.
+
+    Iteration yields the tuples ordered by their start address.
+    """
+
+    def __init__(self, items=()):
+        self._items = tuple(sorted(items, key=lambda x: int(x[0])))
+        self._starts = [int(x[0]) for x in self._items]
+        self._ends = [int(x[1]) for x in self._items]
+
+    def __len__(self):
+        return len(self._items)
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def __getitem__(self, i):
+        return self._items[i]
+
+    def __repr__(self):
+        return "<%s of %d ranges>" % (self.__class__.__name__, len(self))
+
+    def find_le(self, address):
+        """Returns the last range which starts at or below address.
+
+        Raises ValueError if not found (like SortedCollection.find_le()).
+        """
+        i = bisect.bisect_right(self._starts, address)
+        if i:
+            return self._items[i-1]
+
+        raise ValueError('No item found with key at or below: %r' % (
+            address,))
+
+    def find_le_many(self, addresses):
+        """Returns the last range starting at or below each address.
+
+        The addresses must be sorted (like SortedCollection.find_le_many()).
+        Addresses which have no range at or below them give None.
+        """
+        result = []
+        i = 0
+        for address in addresses:
+            i = bisect.bisect_right(self._starts, address, i)
+            result.append(self._items[i-1] if i else None)
+
+        return result
+
+    def find(self, address):
+        """Returns the range which contains address, or None."""
+        i = bisect.bisect_right(self._starts, address)
+        if i and address <= self._ends[i-1]:
+            return self._items[i-1]
+
+    def overlapping(self, start, end):
+        """Yields the ranges which overlap [start, end]."""
+        i = max(0, bisect.bisect_right(self._starts, start) - 1)
+        while i < len(self._items) and self._starts[i] <= end:
+            if self._ends[i] >= start:
+                yield self._items[i]
+
+            i += 1
+
+
+class TwoQueueStore(object):
+    """A scan resistant cache implementing the simplified 2Q algorithm.
+
+    New objects are placed in a small FIFO queue (A1in). When they expire from
+    it only their keys are remembered (A1out). Objects which are stored again
+    while their key is in A1out are placed in the main LRU queue (Am). This
+    means that a single pass over a lot of data (e.g. a scan) can not flush
+    out the objects which are used repeatedly.
+
+    See Johnson and Shasha, "2Q: A Low Overhead High Performance Buffer
+    Management Replacement Algorithm", VLDB 1994.
+
+    The interface is the same as FastStore.
+    """
+
+    def __init__(self, max_size=10, kill_cb=None, lock=False):
+        self._limit = max_size
+        self._in_limit = max(1, max_size / 4)
+        self._out_limit = max(1, max_size / 2)
+        self._main_limit = max(1, max_size - self._in_limit)
+
+        self._a1in = collections.OrderedDict()
+        self._a1out = collections.OrderedDict()
+        self._am = collections.OrderedDict()
+        self._kill_cb = kill_cb
+        self.lock = None
+        if lock:
+            self.lock = threading.RLock()
+
+    def _Kill(self, item):
+        if self._kill_cb and item is not None:
+            self._kill_cb(item)
+
+    @Synchronized
+    def Put(self, key, item):
+        """Add the object to the cache."""
+        if key in self._am:
+            del self._am[key]
+            self._am[key] = item
+
+        elif key in self._a1in:
+            self._a1in[key] = item
+
+        elif key in self._a1out:
+            # This object was seen recently - it is worth keeping.
+            del self._a1out[key]
+            self._am[key] = item
+            while len(self._am) > self._main_limit:
+                _, old_item = self._am.popitem(last=False)
+                self._Kill(old_item)
+
+        else:
+            self._a1in[key] = item
+            while len(self._a1in) > self._in_limit:
+                old_key, old_item = self._a1in.popitem(last=False)
+                self._Kill(old_item)
+
+                self._a1out[old_key] = None
+                while len(self._a1out) > self._out_limit:
+                    self._a1out.popitem(last=False)
+
+        return key
+
+    @Synchronized
+    def Get(self, key):
+        """Fetch the object from cache.
+
+        Raises:
+            KeyError: If the object is not present in the cache.
+        """
+        try:
+            item = self._am.pop(key)
+            self._am[key] = item
+            return item
+        except KeyError:
+            # Hits in A1in do not change its order.
+            return self._a1in[key]
+
+    @Synchronized
+    def ExpireObject(self, key):
+        """Expire a specific object from cache."""
+        item = self._am.pop(key, None)
+        if item is None:
+            item = self._a1in.pop(key, None)
+
+        self._Kill(item)
+        return item
+
+    @Synchronized
+    def __contains__(self, key):
+        return key in self._am or key in self._a1in
+
+    @Synchronized
+    def __getitem__(self, key):
+        return self.Get(key)
+
+    @Synchronized
+    def Flush(self):
+        """Flush all items from cache."""
+        for queue in (self._am, self._a1in):
+            for item in queue.values():
+                self._Kill(item)
+
+            queue.clear()
+
+        self._a1out.clear()
+
+    def __len__(self):
+        return len(self._am) + len(self._a1in)
+
+
 class JITIterator(object):
     def __init__(self, baseclass):
         self.baseclass = baseclass
@@ -843,23 +1114,114 @@ def CopyFDs(in_fd, out_fd, length=2**64):
         length -= len(data)
 
 
+# A block of zeros used to detect holes.
+_ZERO_BLOCK = "\x00" * 1024 * 1024
+
+
+def IsZeroBuffer(data):
+    """Returns True if data (a string or a buffer) only contains zeros."""
+    data = buffer(data)
+    for i in xrange(0, len(data), len(_ZERO_BLOCK)):
+        chunk = buffer(data, i, len(_ZERO_BLOCK))
+        if chunk != buffer(_ZERO_BLOCK, 0, len(chunk)):
+            return False
+
+    return True
+
+
+def ReadAhead(in_as, blocks, queue_size=8):
+    """Reads blocks from an address space in a background thread.
+
+    This allows the caller to process (e.g. write) each block while the next
+    blocks are being read.
+
+    Args:
+      in_as: The address space to read.
+      blocks: An iterable of (offset, length) to read.
+      queue_size: The largest number of blocks to read ahead of the caller.
+
+    Yields:
+      (offset, data) for each block in order. The data is the result of
+      read_buffer().
+    """
+    queue = Queue.Queue(queue_size)
+    stop = threading.Event()
+
+    def _Reader():
+        try:
+            for offset, length in blocks:
+                if stop.is_set():
+                    break
+
+                queue.put((offset, in_as.read_buffer(offset, length)))
+
+        except Exception as e:  # pylint: disable=broad-except
+            queue.put(e)
+
+        finally:
+            queue.put(None)
+
+    reader = threading.Thread(target=_Reader)
+    reader.daemon = True
+    reader.start()
+
+    try:
+        while True:
+            item = queue.get()
+            if item is None:
+                break
+
+            if isinstance(item, Exception):
+                raise item
+
+            yield item
+
+    finally:
+        # Unblock the reader if the caller stopped early.
+        stop.set()
+        while reader.is_alive():
+            try:
+                queue.get(timeout=0.1)
+            except Queue.Empty:
+                pass
+
+
 def CopyAStoFD(in_as, out_fd, start=0, length=2**64, cb=lambda x: None):
-    """Copy an address space into a file-like object."""
+    """Copy an address space into a file-like object.
+
+    Blocks are read in the background while previous blocks are written. Blocks
+    of zeros are not written at all, leaving holes which most filesystems store
+    sparsely.
+    """
     blocksize = 1024 * 1024
 
-    for range_offset, _, range_length in in_as.get_available_addresses(
-            start=start):
-        range_end = range_offset + range_length
+    def _GenerateBlocks(length):
+        for range_offset, _, range_length in in_as.get_available_addresses(
+                start=start):
+            range_end = range_offset + range_length
 
-        for offset in xrange(range_offset, range_end, blocksize):
-            to_read = min(blocksize, range_end - offset, length)
-            data = in_as.read(offset, to_read)
+            for offset in xrange(range_offset, range_end, blocksize):
+                to_read = min(blocksize, range_end - offset, length)
+                if to_read <= 0:
+                    return
 
+                yield offset, to_read
+                length -= to_read
+
+    end = written_end = 0
+    for offset, data in ReadAhead(in_as, _GenerateBlocks(length)):
+        end = offset + len(data)
+        if not IsZeroBuffer(data):
             out_fd.seek(offset)
             out_fd.write(data)
-            length -= len(data)
+            written_end = end
+
+        cb(offset)
 
-            cb(offset)
+    # Extend the file over a trailing hole.
+    if end > written_end:
+        out_fd.seek(end - 1)
+        out_fd.write("\x00")
 
 
 def issubclass(obj, cls):    # pylint: disable=redefined-builtin
@@ -0,0 +1,75 @@
+import unittest
+
+from rekall import testlib
+from rekall import utils
+
+
+class IntervalIndexTest(testlib.RekallBaseUnitTestCase):
+    """Test the IntervalIndex."""
+
+    def setUp(self):
+        # The ranges are inclusive of their end and given out of order.
+        self.index = utils.IntervalIndex([
+            (0x3000, 0x3fff, "c"),
+            (0x1000, 0x1fff, "a"),
+            (0x2000, 0x20ff, "b"),
+        ])
+
+    def testOrder(self):
+        self.assertEqual([x[2] for x in self.index], ["a", "b", "c"])
+        self.assertEqual(len(self.index), 3)
+        self.assertEqual(self.index[1][2], "b")
+
+    def testFindLe(self):
+        self.assertRaises(ValueError, self.index.find_le, 0xfff)
+        self.assertEqual(self.index.find_le(0x1000)[2], "a")
+
+        # find_le() does not check the end of the range.
+        self.assertEqual(self.index.find_le(0x2fff)[2], "b")
+        self.assertEqual(self.index.find_le(0x10000)[2], "c")
+
+    def testFindLeMany(self):
+        addresses = [0, 0x1000, 0x1500, 0x2fff, 0x3000, 0x10000]
+        expected = [None, "a", "a", "b", "c", "c"]
+
+        self.assertEqual(
+            [x and x[2] for x in self.index.find_le_many(addresses)],
+            expected)
+
+        # The same as calling find_le() for each address.
+        for address, hit in zip(addresses,
+                                self.index.find_le_many(addresses)):
+            try:
+                self.assertEqual(hit, self.index.find_le(address))
+            except ValueError:
+                self.assertEqual(hit, None)
+
+    def testFind(self):
+        self.assertEqual(self.index.find(0xfff), None)
+        self.assertEqual(self.index.find(0x1fff)[2], "a")
+        self.assertEqual(self.index.find(0x20ff)[2], "b")
+
+        # In the gap between b and c.
+        self.assertEqual(self.index.find(0x2100), None)
+        self.assertEqual(self.index.find(0x4000), None)
+
+    def testOverlapping(self):
+        def Names(start, end):
+            return [x[2] for x in self.index.overlapping(start, end)]
+
+        self.assertEqual(Names(0, 0xfff), [])
+        self.assertEqual(Names(0x1fff, 0x2000), ["a", "b"])
+        self.assertEqual(Names(0x1800, 0x3000), ["a", "b", "c"])
+        self.assertEqual(Names(0x2100, 0x2fff), [])
+        self.assertEqual(Names(0x3fff, 0x5000), ["c"])
+
+    def testEmpty(self):
+        index = utils.IntervalIndex()
+        self.assertFalse(index)
+        self.assertEqual(index.find(0), None)
+        self.assertEqual(index.find_le_many([0, 1]), [None, None])
+        self.assertEqual(list(index.overlapping(0, 100)), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
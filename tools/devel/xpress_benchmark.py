@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+
+# Rekall Memory Forensics
+# Copyright 2014 Google Inc. All Rights Reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or (at
+# your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+#
+
+"""Compare the xpress decoders on a synthetic corpus.
+
+The corpus consists of 64kb blocks resembling memory pages: runs of zeros,
+repeated structures, text and random data.
+
+Usage: xpress_benchmark.py [number of blocks]
+"""
+import random
+import sys
+import time
+
+from rekall.plugins.addrspaces import xpress
+
+
+def MakeBlock(rand):
+    parts = []
+    size = 0
+    while size < xpress.XPRESS_BLOCK_SIZE:
+        kind = rand.random()
+        if kind < 0.3:
+            part = "\x00" * rand.randint(16, 4096)
+        elif kind < 0.6:
+            part = "".join(chr(rand.randint(0, 255))
+                           for _ in range(rand.randint(8, 32)))
+            part *= rand.randint(2, 64)
+        elif kind < 0.9:
+            part = "The quick brown fox jumps over the lazy dog. " * (
+                rand.randint(1, 20))
+        else:
+            part = "".join(chr(rand.randint(0, 255))
+                           for _ in range(rand.randint(64, 1024)))
+
+        parts.append(part)
+        size += len(part)
+
+    return "".join(parts)[:xpress.XPRESS_BLOCK_SIZE]
+
+
+def Benchmark(name, decoder, corpus, expected):
+    start = time.time()
+    for compressed, data in zip(corpus, expected):
+        if decoder(compressed) != data:
+            raise RuntimeError("%s produced incorrect output." % name)
+
+    elapsed = time.time() - start
+    print "%-25s %8.3f sec %8.2f MB/s" % (
+        name, elapsed, len(expected) * xpress.XPRESS_BLOCK_SIZE /
+        elapsed / 1024 / 1024)
+
+
+def main(argv):
+    count = int(argv[1]) if len(argv) > 1 else 20
+    rand = random.Random(0)
+    expected = [MakeBlock(rand) for _ in range(count)]
+    corpus = [xpress.xpress_encode(x) for x in expected]
+
+    print "%d blocks, %d bytes compressed to %d bytes." % (
+        count, sum(len(x) for x in expected), sum(len(x) for x in corpus))
+
+    Benchmark("xpress_decode_reference", xpress.xpress_decode_reference,
+              corpus, expected)
+    Benchmark("xpress_decode", xpress.xpress_decode, corpus, expected)
+
+
+if __name__ == "__main__":
+    main(sys.argv)